@@ -0,0 +1,33 @@
+function convert_batch(jobFile, compression)
+{
+     // Define Camera RAW open options
+     var openOptions = new CameraRAWOpenOptions();
+     openOptions.colorSpace = ColorSpaceType.SRGB;
+     openOptions.bitsPerChannel = BitsPerChannelType.SIXTEEN;
+
+     // Define TIFF save options
+     var tiffSaveOptions = new TiffSaveOptions();
+     tiffSaveOptions.embedColorProfile = true;
+     tiffSaveOptions.imageCompression = TIFFEncoding[compression || 'TIFFLZW'];
+
+     // One job per line: <CR2 file>\t<TIFF file>
+     var jobs = File(jobFile);
+     jobs.open('r');
+     while (!jobs.eof) {
+         var line = jobs.readln();
+         if (line.length == 0) {
+             continue;
+         }
+         var job = line.split('\t');
+         var doc = open(File(job[0]), openOptions);
+         // Set color space
+         doc.convertProfile('sRGB IEC61966-2.1', Intent.RELATIVECOLORIMETRIC, true, true);
+         // Save TIFF
+         doc.saveAs(File(job[1]), tiffSaveOptions, true);
+         // Close document
+         doc.close(SaveOptions.DONOTSAVECHANGES);
+     }
+     jobs.close();
+ }
+
+ convert_batch(arguments[0], arguments[1]);
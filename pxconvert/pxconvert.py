@@ -6,27 +6,59 @@ Converting Canon Camera RAW (CR2) images to TIFF 16 bit
 Using Adobe Photoshop CC 2019 via applescript and javascript
 The python code is a wrapper to copy/remove the XMP file along side the CR2 images
 and calls osascript to execute an applescript to activate PS and run a javascript
+
+On Linux the CR2s can be developed in process with NumPy (--backend native)
 """
 
 import os
 import re
 import sys
-import imghdr
-import shlex
+import json
+import hashlib
+import struct
 import logging
 import signal
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
 import colorama  # https://pypi.org/project/colorama/
 import platform
 import subprocess
 
 from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from multiprocessing import cpu_count, get_context
+from multiprocessing.pool import ThreadPool
 from tqdm import tqdm
 from pathlib import Path
+from functools import lru_cache
+from xml.etree import ElementTree
 from shutil import copyfile
 from queue import PriorityQueue
-from click import command, option
+from click import command, option, Choice, UsageError
 from colorama import Fore
 
+import numpy as np
+
+try:
+    import rawpy  # https://pypi.org/project/rawpy/
+except ImportError:
+    rawpy = None
+
+try:
+    import zstandard  # https://pypi.org/project/zstandard/
+except ImportError:
+    zstandard = None
+
+try:
+    import imagecodecs  # https://pypi.org/project/imagecodecs/
+except ImportError:
+    imagecodecs = None
+
 __author__ = "Stephan Osterburg"
 __copyright__ = "Copyright 2020, Pixelgun Studio"
 __credits__ = ["Stephan Osterburg", "Mauricio Baiocchi"]
@@ -102,120 +134,1691 @@ class GlobalDirs:
                 'px14': '10.0.53.114'}
 
 
-def copy_xmp(directory, player, xmps, task):
-    """Copy XMP template along  side every Camera RAW image so that
+# Take names: <date or index>_<first>_<last>_<pose>_<take>
+# i.e. 01_12_2020_jefferson_amile_yell_angry_tk2 (project) or 4_carbonel_ray_neutral_tk3 (_incoming)
+TAKE_PATTERN = re.compile(r'^(?:(?P<date>\d{2}_\d{2}_\d{4})|(?P<index>\d+))_'
+                          r'(?P<player>[^_]+_[^_]+)_(?P<pose>.+)_(?P<take>[^_]+)$')
+
+
+class TakeName:
+    """Parsed take name"""
+
+    __slots__ = ('name', 'date', 'index', 'player', 'pose', 'take')
+
+    def __init__(self, name, date, index, player, pose, take):
+        self.name = name
+        self.date = date
+        self.index = index
+        self.player = player
+        self.pose = pose
+        self.take = take
+
+    @property
+    def prefix(self):
+        """Date and player, i.e. 01_12_2020_jefferson_amile"""
+        return '%s_%s' % (self.date or self.index, self.player)
+
+    @property
+    def base(self):
+        """Take name without the take number, i.e. 01_12_2020_jefferson_amile_yell_angry"""
+        return '%s_%s' % (self.prefix, self.pose)
+
+    def __repr__(self):
+        return 'TakeName(%r)' % self.name
+
+
+@lru_cache(maxsize=4096)
+def _parse_take_name(name):
+    match = TAKE_PATTERN.match(name)
+    if match is None:
+        return None
+
+    return TakeName(name, **match.groupdict())
+
+
+def parse_take(path):
+    """Parse the take name of a path (memoized), None if it isn't a take"""
+    return _parse_take_name(os.path.basename(path.rstrip('/')))
+
+
+# TIFF compression schemes by name
+COMPRESSIONS = {'none': 1, 'lzw': 5, 'deflate': 8, 'zstd': 50000}
+
+
+class TiffEncoding:
+    """How the TIFFs get written: compression, predictor and strips or tiles
+
+    Strips or tiles are compressed in a thread pool, zlib, zstd and imagecodecs release the GIL.
+    """
+
+    def __init__(self, compression='none', predictor=False, tile=0, strip_size=1 << 20, threads=None):
+        """
+        :param compression: 'none', 'lzw', 'deflate' or 'zstd'
+        :param predictor: horizontal differencing before compressing
+        :param tile: tile size in pixels (multiple of 16), 0 for strips
+        :param strip_size: uncompressed bytes per strip
+        :param threads: number of compressing threads, None for one per core
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression {}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd needs the zstandard module')
+        if tile % 16:
+            raise ValueError('the tile size has to be a multiple of 16')
+
+        self.compression = compression
+        self.predictor = predictor and compression != 'none'
+        self.tile = tile
+        self.strip_size = strip_size
+        self.threads = threads or cpu_count()
+
+    def __repr__(self):
+        return '{}{}{}'.format(self.compression, '+predictor' if self.predictor else '',
+                               ', {0}x{0} tiles'.format(self.tile) if self.tile else '')
+
+    def compress(self, chunk):
+        """Compress a (rows, columns, RGB) block into the bytes of a strip or tile"""
+        if self.predictor:
+            chunk = chunk.copy()
+            chunk[:, 1:] -= chunk[:, :-1].copy()
+        data = chunk.astype('<u2').tobytes()
+
+        if self.compression == 'lzw':
+            if imagecodecs is None:
+                raise ValueError('lzw needs the imagecodecs module')
+            return imagecodecs.lzw_encode(data)
+        elif self.compression == 'deflate':
+            return zlib.compress(data, 6)
+        elif self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=9).compress(data)
+
+        return data
+
+    def encode(self, image):
+        """Split an image into strips or tiles and compress them
+
+        :param image: (height, width, RGB) uint16 array
+        :return: (list of compressed strips or tiles, dictionary of TIFF tag and values of the layout)
+        """
+        height, width = image.shape[:2]
+        if self.tile:
+            size = self.tile
+            rows, columns = -(-height // size), -(-width // size)
+            # Tiles on the right and bottom edge are padded
+            padded = np.zeros((rows * size, columns * size, 3), dtype=np.uint16)
+            padded[:height, :width] = image
+            chunks = [padded[r * size:(r + 1) * size, c * size:(c + 1) * size]
+                      for r in range(rows) for c in range(columns)]
+            layout = {322: (size,), 323: (size,)}
+        else:
+            rows_per_strip = max(1, min(height, self.strip_size // (width * 6)))
+            chunks = [image[r:r + rows_per_strip] for r in range(0, height, rows_per_strip)]
+            layout = {278: (rows_per_strip,)}
+
+        if len(chunks) > 1 and self.compression != 'none':
+            pool = ThreadPool(processes=min(self.threads, len(chunks)))
+            data = pool.map(self.compress, chunks)
+            pool.close()
+            pool.join()
+        else:
+            data = [self.compress(chunk) for chunk in chunks]
+
+        return data, layout
+
+
+def decompress(data, compression):
+    """Decompress a strip or tile"""
+    if compression == 1:
+        return data
+    elif compression == 5 and imagecodecs is not None:
+        return imagecodecs.lzw_decode(data)
+    elif compression in (8, 32946):
+        return zlib.decompress(data)
+    elif compression == 50000 and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    raise ValueError('unsupported compression {}'.format(compression))
+
+
+def write_tiff16(filename, width, height, pixels, encoding=None):
+    """Write a 16 bit RGB TIFF
+
+    :param filename: TIFF file to write
+    :param width: width of the image
+    :param height: height of the image
+    :param pixels: interleaved RGB samples as (height, width, 3) uint16 array or little endian uint16 bytes
+    :param encoding: TiffEncoding, uncompressed strips by default
+    :return: None
+    """
+    if encoding is None:
+        encoding = TiffEncoding()
+    if isinstance(pixels, (bytes, bytearray)):
+        pixels = np.frombuffer(pixels, dtype='<u2').reshape(height, width, 3)
+    chunks, layout = encoding.encode(pixels)
+    counts = tuple(len(chunk) for chunk in chunks)
+
+    # (type, values) of every tag, the chunk offsets are filled in below
+    tags = {256: (4, (width,)),                             # ImageWidth
+            257: (4, (height,)),                            # ImageLength
+            258: (3, (16, 16, 16)),                         # BitsPerSample
+            259: (3, (COMPRESSIONS[encoding.compression],)),
+            262: (3, (2,)),                                 # PhotometricInterpretation: RGB
+            277: (3, (3,)),                                 # SamplesPerPixel
+            284: (3, (1,)),                                 # PlanarConfiguration: chunky
+            317: (3, (2 if encoding.predictor else 1,))}    # Predictor: horizontal or none
+    tags.update({tag: (4, value) for tag, value in layout.items()})
+    offsets_tag, counts_tag = (324, 325) if encoding.tile else (273, 279)
+    tags[offsets_tag] = (4, (0,) * len(chunks))
+    tags[counts_tag] = (4, counts)
+
+    ifd_size = 2 + len(tags) * 12 + 4
+    extra_size = sum(len(values) * (2 if typ == 3 else 4) for typ, values in tags.values()
+                     if len(values) * (2 if typ == 3 else 4) > 4)
+    data_offset = 8 + ifd_size + extra_size
+    offsets = []
+    for count in counts:
+        offsets.append(data_offset)
+        data_offset += count
+    tags[offsets_tag] = (4, tuple(offsets))
+
+    ifd = struct.pack('<H', len(tags))
+    extra = b''
+    for tag in sorted(tags):
+        typ, values = tags[tag]
+        data = struct.pack('<%d%s' % (len(values), 'H' if typ == 3 else 'I'), *values)
+        if len(data) > 4:
+            ifd += struct.pack('<HHII', tag, typ, len(values), 8 + ifd_size + len(extra))
+            extra += data
+        else:
+            ifd += struct.pack('<HHI', tag, typ, len(values)) + data.ljust(4, b'\x00')
+    ifd += struct.pack('<I', 0)
+
+    with open(filename, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, 8))
+        f.write(ifd)
+        f.write(extra)
+        for chunk in chunks:
+            f.write(chunk)
+
+
+# TIFF field types and their struct format, ASCII and UNDEFINED are returned as bytes
+TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 7: 's', 8: 'h', 9: 'i', 16: 'Q'}
+
+
+def read_ifd(f, order, offset, tags=None, big=False):
+    """Read the entries of an IFD
+
+    :param f: TIFF file opened in binary mode
+    :param order: byte order, '<' or '>'
+    :param offset: file offset of the IFD
+    :param tags: tag numbers to read, None for all
+    :param big: True for a BigTIFF IFD
+    :return: (dictionary of tag and tuple of values or bytes, offset of the next IFD)
+    """
+    if big:
+        count_fmt, entry_fmt, entry_size, inline, offset_fmt = 'Q', 'HHQ8s', 20, 8, 'Q'
+    else:
+        count_fmt, entry_fmt, entry_size, inline, offset_fmt = 'H', 'HHI4s', 12, 4, 'I'
+
+    f.seek(offset)
+    count_size = struct.calcsize(count_fmt)
+    count = struct.unpack(order + count_fmt, f.read(count_size))[0]
+    ifd = f.read(count * entry_size + inline)
+    if len(ifd) != count * entry_size + inline:
+        raise ValueError('truncated IFD')
+
+    values = {}
+    for i in range(count):
+        tag, typ, n, data = struct.unpack(order + entry_fmt, ifd[i * entry_size:(i + 1) * entry_size])
+        if (tags is not None and tag not in tags) or typ not in TIFF_TYPES:
+            continue
+
+        fmt = order + ('%ds' % n if TIFF_TYPES[typ] == 's' else TIFF_TYPES[typ] * n)
+        size = struct.calcsize(fmt)
+        if size > inline:
+            f.seek(struct.unpack(order + offset_fmt, data)[0])
+            data = f.read(size)
+            if len(data) != size:
+                raise ValueError('truncated tag %s' % tag)
+        value = struct.unpack(fmt, data[:size])
+        values[tag] = value[0] if TIFF_TYPES[typ] == 's' else value
+
+    return values, struct.unpack(order + offset_fmt, ifd[-inline:])[0]
+
+
+def read_tiff_header(f):
+    """Read the header of a TIFF or BigTIFF
+
+    :param f: TIFF file opened in binary mode
+    :return: (byte order, True for BigTIFF, offset of the first IFD)
+    """
+    f.seek(0)
+    header = f.read(16)
+    if len(header) < 8:
+        raise ValueError('truncated header')
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        raise ValueError('not a TIFF')
+
+    magic = struct.unpack(order + 'H', header[2:4])[0]
+    if magic == 42:
+        return order, False, struct.unpack(order + 'I', header[4:8])[0]
+    elif magic == 43:
+        return order, True, struct.unpack(order + 'Q', header[8:16])[0]
+
+    raise ValueError('not a TIFF')
+
+
+def read_tiff_tags(f, tags):
+    """Read the requested tags of the first IFD, nothing else is read
+
+    :param f: TIFF file opened in binary mode
+    :param tags: tag numbers to read
+    :return: (byte order, dictionary of tag and tuple of values)
+    """
+    order, big, offset = read_tiff_header(f)
+
+    return order, read_ifd(f, order, offset, tags, big)[0]
+
+
+def validate_tiff(filename, bits=16):
+    """Check the structure of a TIFF without reading its pixel data
+
+    Dimensions, bit depth and the strip/tile offsets and byte counts are checked against the file size.
+
+    :param filename: TIFF file
+    :param bits: expected bits per sample, None to accept any
+    :return: None if the TIFF is fine, otherwise the reason why not
+    """
+    try:
+        with open(filename, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            _, tags = read_tiff_tags(f, {256, 257, 258, 259, 273, 277, 279, 322, 323, 324, 325})
+    except FileNotFoundError:
+        return 'missing'
+    except (OSError, ValueError, struct.error) as exc:
+        return str(exc)
+
+    width, height = tags.get(256, (0,))[0], tags.get(257, (0,))[0]
+    if not width or not height:
+        return 'no dimensions'
+    if bits is not None and any(b != bits for b in tags.get(258, (1,))):
+        return 'bit depth %s' % (tags.get(258, (1,)),)
+
+    if 273 in tags:
+        offsets, counts = tags[273], tags.get(279, ())
+    else:
+        offsets, counts = tags.get(324, ()), tags.get(325, ())
+    if not offsets or len(offsets) != len(counts):
+        return 'no strips or tiles'
+    if not all(counts):
+        return 'empty strip or tile'
+    if max(o + c for o, c in zip(offsets, counts)) > file_size:
+        return 'truncated'
+
+    # Uncompressed strips have to hold every pixel
+    if 273 in tags and tags.get(259, (1,))[0] == 1:
+        expected = width * height * tags.get(277, (1,))[0] * sum(tags.get(258, (1,))) // 8 // len(tags.get(258, (1,)))
+        if sum(counts) < expected:
+            return 'strips too short'
+
+    return None
+
+
+def validate_tiffs(jobs, workers=16):
+    """Validate TIFFs in a thread pool
+
+    :param jobs: list of (CR2 file, TIFF file) tuples
+    :param workers: number of threads
+    :return: list of (job, reason) of all invalid TIFFs
+    """
+    if not jobs:
+        return []
+
+    pool = ThreadPool(processes=min(workers, len(jobs)))
+    reasons = pool.map(lambda job: validate_tiff(job[1]), jobs)
+    pool.close()
+    pool.join()
+
+    return [(job, reason) for job, reason in zip(jobs, reasons) if reason is not None]
+
+
+# Linear sRGB (D65) to XYZ
+XYZ_RGB = ((0.412453, 0.357580, 0.180423),
+           (0.212671, 0.715160, 0.072169),
+           (0.019334, 0.119193, 0.950227))
+
+
+class RawImage:
+    """Bayer data of a CR2 and everything needed to develop it"""
+
+    def __init__(self, bayer, black, white, wb=(1.0, 1.0, 1.0), pattern='RGGB', matrix=None, orientation=1,
+                 daylight=None):
+        """
+        :param bayer: 2D uint16 array of the visible sensor area
+        :param black: black level
+        :param white: white level
+        :param wb: as shot white balance multipliers (R, G, B)
+        :param pattern: CFA pattern of the top left 2x2 pixels
+        :param matrix: 3x3 camera to linear sRGB matrix, None for none
+        :param orientation: EXIF orientation
+        :param daylight: daylight white balance multipliers (R, G, B), None if unknown
+        """
+        self.bayer = bayer
+        self.black = black
+        self.white = white
+        self.wb = wb
+        self.pattern = pattern
+        self.matrix = matrix
+        self.orientation = orientation
+        self.daylight = daylight
+
+
+def camera_to_srgb(cam_xyz):
+    """Turn a XYZ to camera matrix into a camera to linear sRGB matrix, the way dcraw does
+
+    :param cam_xyz: 3x3 XYZ to camera matrix
+    :return: (3x3 camera to linear sRGB matrix, daylight white balance multipliers)
+    """
+    cam_rgb = np.asarray(cam_xyz, dtype=np.float64).reshape(3, 3) @ np.asarray(XYZ_RGB)
+    # Normalize, so white balanced white stays white, the row sums are the daylight balance
+    daylight = 1.0 / cam_rgb.sum(axis=1)
+    cam_rgb /= cam_rgb.sum(axis=1, keepdims=True)
+
+    return np.linalg.inv(cam_rgb), tuple(daylight / daylight[1])
+
+
+# LibRaw's flip of the image to the EXIF orientation
+FLIPS = {3: 3, 5: 8, 6: 6}
+
+
+def read_cr2(filename):
+    """Read the Bayer data and the metadata needed for developing of a Canon CR2 with LibRaw (rawpy)
+
+    :param filename: CR2 file
+    :return: RawImage
+    """
+    with rawpy.imread(filename) as raw:
+        matrix, daylight = camera_to_srgb(raw.rgb_xyz_matrix[:3]) if raw.rgb_xyz_matrix.any() else (None, None)
+        # As shot multipliers in R, G, B, G2
+        r, g, b, _ = raw.camera_whitebalance
+        wb = (r / g, 1.0, b / g) if r and g and b else (1.0, 1.0, 1.0)
+
+        return RawImage(raw.raw_image_visible.copy(), float(np.mean(raw.black_level_per_channel)),
+                        float(raw.white_level), wb, ''.join('RGBG'[c] for c in raw.raw_pattern.reshape(-1)),
+                        matrix, FLIPS.get(raw.sizes.flip, 1), daylight)
+
+
+def demosaic(cfa, pattern='RGGB'):
+    """Bilinear demosaic of a Bayer image
+
+    :param cfa: 2D float32 array
+    :param pattern: CFA pattern of the top left 2x2 pixels
+    :return: 3D float32 array (height, width, RGB)
+    """
+    height, width = cfa.shape
+    rgb = np.zeros((height, width, 3), dtype=np.float32)
+    masks = np.zeros((height, width, 3), dtype=np.float32)
+    for i, color in enumerate(pattern):
+        channel = 'RGB'.index(color)
+        rgb[i // 2::2, i % 2::2, channel] = cfa[i // 2::2, i % 2::2]
+        masks[i // 2::2, i % 2::2, channel] = 1.0
+
+    # Average the known neighbours of every pixel, 3x3 with weights 1 2 1
+    def blur(a):
+        a = np.pad(a, ((1, 1), (1, 1), (0, 0)), mode='reflect')
+        a = a[:-2] + 2 * a[1:-1] + a[2:]
+        return a[:, :-2] + 2 * a[:, 1:-1] + a[:, 2:]
+
+    interpolated = blur(rgb) / np.maximum(blur(masks), 1e-6)
+
+    return np.where(masks > 0, rgb, interpolated)
+
+
+def srgb_gamma(linear):
+    """Encode linear values 0..1 with the sRGB transfer function"""
+    return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(linear, 1 / 2.4) - 0.055)
+
+
+# Camera Raw settings namespace of the color card XMPs
+CRS = '{http://ns.adobe.com/camera-raw-settings/1.0/}'
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+
+# Bradford cone response, used to adapt the white point
+BRADFORD = ((0.8951, 0.2664, -0.1614),
+            (-0.7502, 1.7135, 0.0367),
+            (0.0389, -0.0685, 1.0296))
+D65 = (0.95047, 1.0, 1.08883)
+
+
+class CameraRawSettings:
+    """The Camera Raw settings of a color card XMP which the native backend applies
+
+    The settings compile into a 3x3 matrix for linear sRGB (white balance and exposure) and
+    a 16 bit lookup table per channel for the sRGB encoded values (contrast and tone curves).
+    """
+
+    def __init__(self, values):
+        """
+        :param values: dictionary of crs: names to their string or list of strings
+        """
+        self.white_balance = values.get('WhiteBalance', 'As Shot')
+        self.temperature = float(values.get('Temperature', 6500))
+        self.tint = float(values.get('Tint', 0))
+        self.exposure = float(values.get('Exposure2012', 0))
+        self.contrast = float(values.get('Contrast2012', 0))
+        self.curves = tuple(tuple(tuple(int(v) for v in point.split(',')) for point in values.get(name, ()))
+                            for name in ('ToneCurvePV2012', 'ToneCurvePV2012Red',
+                                         'ToneCurvePV2012Green', 'ToneCurvePV2012Blue'))
+
+    @property
+    def custom_white_balance(self):
+        return self.white_balance not in ('As Shot', 'Auto')
+
+    def matrix(self):
+        """Return the 3x3 matrix applied to linear sRGB"""
+        adapt = np.identity(3)
+        if self.custom_white_balance:
+            # Bring the white of the card's illuminant to D65
+            xyz_rgb = np.asarray(XYZ_RGB)
+            bradford = np.asarray(BRADFORD)
+            scale = (bradford @ D65) / (bradford @ temperature_to_xyz(self.temperature, self.tint))
+            adapt = np.linalg.inv(xyz_rgb) @ np.linalg.inv(bradford) @ np.diag(scale) @ bradford @ xyz_rgb
+
+        return adapt * 2.0 ** self.exposure
+
+    def lut(self):
+        """Return the (3, 65536) uint16 lookup table of the sRGB encoded values"""
+        return _compile_lut(self.contrast, self.curves)
+
+
+def temperature_to_xyz(temperature, tint=0.0):
+    """XYZ (Y = 1) of a color temperature on the Planckian locus, shifted by a Camera Raw tint
+
+    The locus is the cubic approximation of Kim et al., the tint moves perpendicular
+    to it in CIE 1960 uv, 3000 tint units per uv unit like the DNG SDK.
+    """
+    def uv(t):
+        t = min(max(t, 1667.0), 25000.0)
+        if t <= 4000:
+            x = -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2 + 0.8776956e3 / t + 0.179910
+        else:
+            x = -3.0258469e9 / t ** 3 + 2.1070379e6 / t ** 2 + 0.2226347e3 / t + 0.240390
+        if t <= 2222:
+            y = -1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683
+        elif t <= 4000:
+            y = -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867
+        else:
+            y = 3.0817580 * x ** 3 - 5.87338670 * x ** 2 + 3.75112997 * x - 0.37001483
+        d = -2 * x + 12 * y + 3
+        return 4 * x / d, 6 * y / d
+
+    u, v = uv(temperature)
+    if tint:
+        du, dv = (a - b for a, b in zip(uv(temperature + 10), uv(temperature - 10)))
+        length = (du * du + dv * dv) ** 0.5
+        # Normal pointing to green, a positive tint means a greener light
+        u, v = u - dv / length * tint / 3000.0, v + du / length * tint / 3000.0
+
+    d = 2 * u - 8 * v + 4
+    x, y = 3 * u / d, 2 * v / d
+
+    return np.array([x / y, 1.0, (1 - x - y) / y])
+
+
+def monotone_curve(points, x):
+    """Evaluate a Camera Raw point curve (0..255) as monotone cubic through its points
+
+    :param points: tuple of (input, output) points
+    :param x: array of values 0..1
+    :return: array of values 0..1
+    """
+    if len(points) < 2:
+        return x
+
+    px, py = np.array(sorted(points), dtype=np.float64).T / 255.0
+    h = np.diff(px)
+    delta = np.diff(py) / h
+
+    # Fritsch-Carlson tangents, flat where the curve turns
+    m = np.empty_like(px)
+    m[0], m[-1] = delta[0], delta[-1]
+    w1, w2 = 2 * h[1:] + h[:-1], h[1:] + 2 * h[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m[1:-1] = np.where(delta[:-1] * delta[1:] > 0, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0.0)
+
+    i = np.clip(np.searchsorted(px, x) - 1, 0, len(h) - 1)
+    t = np.clip((x - px[i]) / h[i], 0.0, 1.0)
+    y = ((2 * t ** 3 - 3 * t ** 2 + 1) * py[i] + (t ** 3 - 2 * t ** 2 + t) * h[i] * m[i] +
+         (-2 * t ** 3 + 3 * t ** 2) * py[i + 1] + (t ** 3 - t ** 2) * h[i] * m[i + 1])
+
+    return np.clip(y, 0.0, 1.0)
+
+
+@lru_cache(maxsize=32)
+def _compile_lut(contrast, curves):
+    """Lookup table of contrast and tone curves, cached as every sidecar of a card has the same"""
+    x = np.linspace(0.0, 1.0, 65536)
+
+    # Contrast bends around the middle grey with a smoothstep S curve
+    y = x + contrast / 200.0 * (x * x * (3 - 2 * x) - x)
+    y = monotone_curve(curves[0], y)
+
+    lut = np.stack([monotone_curve(curve, y) for curve in curves[1:]])
+    lut = np.rint(lut * 65535).astype(np.uint16)
+    lut.flags.writeable = False
+
+    return lut
+
+
+@lru_cache(maxsize=1024)
+def _parse_xmp(filename, mtime):
+    """Parse the crs: settings of an XMP, memoized per file and modification time"""
+    values = {}
+    for element in ElementTree.parse(filename).iter():
+        for name, value in element.attrib.items():
+            if name.startswith(CRS):
+                values[name[len(CRS):]] = value
+        if element.tag.startswith(CRS):
+            items = [li.text or '' for li in element.iter(RDF + 'li')]
+            values[element.tag[len(CRS):]] = items if items else (element.text or '').strip()
+
+    return CameraRawSettings(values)
+
+
+def camera_raw_settings(filename):
+    """Return the Camera Raw settings of an XMP, parsed once per modification
+
+    :param filename: XMP file
+    :return: CameraRawSettings
+    """
+    filename = os.path.realpath(filename)
+
+    return _parse_xmp(filename, os.stat(filename).st_mtime_ns)
+
+
+def develop(raw, exposure=0.0, settings=None):
+    """Develop the Bayer data to 16 bit sRGB
+
+    :param raw: RawImage
+    :param exposure: exposure correction in EV
+    :param settings: CameraRawSettings of the color card, None for none
+    :return: 3D uint16 array (height, width, RGB)
+    """
+    wb = raw.wb
+    matrix = raw.matrix if raw.matrix is not None else np.identity(3)
+    if settings is not None:
+        # A custom white balance starts from daylight, the card's matrix adapts from there
+        if settings.custom_white_balance and raw.daylight is not None:
+            wb = raw.daylight
+        matrix = settings.matrix() @ matrix
+
+    cfa = (raw.bayer.astype(np.float32) - raw.black) / (raw.white - raw.black)
+
+    # White balance on the mosaic, so the interpolation works on neutral data
+    for i, color in enumerate(raw.pattern):
+        cfa[i // 2::2, i % 2::2] *= wb['RGB'.index(color)] * 2.0 ** exposure
+    np.clip(cfa, 0.0, 1.0, out=cfa)
+
+    rgb = demosaic(cfa, raw.pattern)
+    rgb = rgb @ np.asarray(matrix, dtype=np.float32).T
+    np.clip(rgb, 0.0, 1.0, out=rgb)
+
+    rgb = np.rint(srgb_gamma(rgb) * 65535).astype(np.uint16)
+    if settings is not None:
+        rgb = settings.lut()[np.arange(3), rgb]
+
+    # Rotate like the camera was held
+    return np.rot90(rgb, {3: 2, 6: 3, 8: 1}.get(raw.orientation, 0))
+
+
+def develop_cr2(raw_image, tif_image, exposure=0.0, encoding=None):
+    """Convert a CR2 to a 16 bit TIFF without any external application
+
+    The color card XMP next to the CR2 is applied, if there is one.
+
+    :param raw_image: CR2 file
+    :param tif_image: TIFF file to write
+    :param exposure: exposure correction in EV
+    :param encoding: TiffEncoding of the TIFF, uncompressed by default
+    :return: None
+    """
+    xmp = os.path.splitext(raw_image)[0] + '.xmp'
+    settings = camera_raw_settings(xmp) if os.path.exists(xmp) else None
+
+    rgb = develop(read_cr2(raw_image), exposure, settings)
+    # Write next to the target first, a half written TIFF never looks finished
+    write_tiff16(tif_image + '.tmp', rgb.shape[1], rgb.shape[0], np.ascontiguousarray(rgb), encoding)
+    os.replace(tif_image + '.tmp', tif_image)
+
+
+def read_tiff16(filename):
+    """Read a 16 bit RGB TIFF into an array
+
+    Strips and tiles, uncompressed, deflate, LZW (with imagecodecs) and zstd (with zstandard) with or
+    without predictor are read directly, everything else through Pillow (8 bit precision).
+
+    :param filename: TIFF file
+    :return: 3D uint16 array (height, width, RGB)
+    """
+    with open(filename, 'rb') as f:
+        order, tags = read_tiff_tags(f, {256, 257, 258, 259, 273, 277, 278, 279, 284, 317, 322, 323, 324, 325})
+        compression = tags.get(259, (1,))[0]
+        if (tags.get(258) == (16, 16, 16) and tags.get(277) == (3,) and tags.get(284, (1,)) == (1,)
+                and compression in (1, 8, 32946) + ((5,) if imagecodecs is not None else ())
+                + ((50000,) if zstandard is not None else ())):
+            width, height = tags[256][0], tags[257][0]
+            if 322 in tags:
+                chunk_width, chunk_height = tags[322][0], tags[323][0]
+                offsets, counts = tags[324], tags[325]
+            else:
+                chunk_width, chunk_height = width, tags.get(278, (height,))[0]
+                offsets, counts = tags[273], tags[279]
+
+            columns = -(-width // chunk_width)
+            image = np.empty((-(-height // chunk_height) * chunk_height, columns * chunk_width, 3), dtype=np.uint16)
+            for i, (offset, count) in enumerate(zip(offsets, counts)):
+                f.seek(offset)
+                data = decompress(f.read(count), compression)
+                chunk = np.frombuffer(data, dtype=order + 'u2')
+                rows = min(chunk_height, len(chunk) // (chunk_width * 3))
+                chunk = chunk[:rows * chunk_width * 3].reshape(rows, chunk_width, 3)
+                if tags.get(317, (1,))[0] == 2:
+                    chunk = np.cumsum(chunk, axis=1, dtype=np.uint16)
+                r, c = divmod(i, columns)
+                image[r * chunk_height:r * chunk_height + rows, c * chunk_width:(c + 1) * chunk_width] = chunk
+
+            return image[:height, :width]
+
+    from PIL import Image
+    with Image.open(filename) as image:
+        return np.asarray(image.convert('RGB'), dtype=np.uint16) * 257
+
+
+def compare_tiffs(tif_image, reference, tolerance=512):
+    """Compare a TIFF with a reference, i.e. of Photoshop
+
+    :param tif_image: TIFF file
+    :param reference: reference TIFF file
+    :param tolerance: largest accepted mean difference, in 16 bit values
+    :return: (True if within the tolerance, mean difference, largest difference)
+    """
+    a, b = read_tiff16(tif_image), read_tiff16(reference)
+    if a.shape != b.shape:
+        return False, None, None
+
+    difference = np.abs(a.astype(np.int32) - b.astype(np.int32))
+
+    return float(difference.mean()) <= tolerance, float(difference.mean()), int(difference.max())
+
+
+def benchmark_encodings(tif_images, encodings):
+    """Write and read frames with every encoding and measure size and time
+
+    :param tif_images: TIFF files to use as frames
+    :param encodings: list of TiffEncoding
+    :return: list of dictionaries with encoding, bytes, ratio, encode and decode seconds
+    """
+    frames = [read_tiff16(tif_image) for tif_image in tif_images]
+    raw_size = sum(frame.nbytes for frame in frames)
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        filename = os.path.join(scratch, 'benchmark.tif')
+        for encoding in encodings:
+            size = encode = decode = 0
+            for frame in frames:
+                start = time.perf_counter()
+                write_tiff16(filename, frame.shape[1], frame.shape[0], frame, encoding)
+                encode += time.perf_counter() - start
+                size += os.path.getsize(filename)
+
+                start = time.perf_counter()
+                decoded = read_tiff16(filename)
+                decode += time.perf_counter() - start
+                if not np.array_equal(decoded, frame):
+                    raise ValueError('{} does not read back the same'.format(encoding))
+
+            results.append({'encoding': repr(encoding), 'bytes': size, 'ratio': raw_size / size,
+                            'encode': encode, 'decode': decode})
+
+    return results
+
+
+class ConverterBackend:
+    """Base class of all CR2 to TIFF converters
+
+    A backend gets batches of (raw, tiff) jobs and decides itself how many of them
+    it takes per invocation of the converting application.
+    """
+
+    name = None
+    version = '1'
+    # Number of jobs handed over per invocation
+    batch_size = 1
+    # Number of invocations which may run at the same time, None for one per core
+    max_workers = None
+    # Compressions the converter can write and the TiffEncoding it uses, None for its own default
+    compressions = ('none', 'lzw', 'deflate', 'zstd')
+    # Which of --predictor and --tile the converter follows
+    encoding_options = ('predictor', 'tile')
+    encoding = None
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        """Convert a batch of images
+
+        :param jobs: list of (CR2 file, TIFF file) tuples
+        :param scratch: private config/scratch directory of the calling worker
+        :param encoding: TiffEncoding of this batch, the backend's encoding if None
+        :return: None
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release what the backend keeps between batches, i.e. worker processes"""
+        pass
+
+
+class PhotoshopBackend(ConverterBackend):
+    """Adobe Photoshop via osascript, a whole batch per Photoshop call"""
+
+    name = 'photoshop'
+    batch_size = 50
+    compressions = ('none', 'lzw', 'deflate')
+    encoding_options = ()
+    # TIFFEncoding of Photoshop, it picks the predictor itself
+    formats = {'none': 'NONE', 'lzw': 'TIFFLZW', 'deflate': 'TIFFZIP'}
+    # There is only one Photoshop
+    max_workers = 1
+    app = '/usr/bin/osascript'
+    photoshop = 'Adobe Photoshop CC 2019'
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'convert_batch.js')
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        encoding = encoding or self.encoding
+        # Hand the jobs to convert_batch.js via a file, one job per line
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as job_file:
+            job_file.write('\n'.join('%s\t%s' % job for job in jobs))
+
+        cmd = [self.app,
+               '-e', 'on run argv',
+               '-e', 'tell application "%s" to do javascript file (POSIX file (item 1 of argv)) '
+                     'with arguments {item 2 of argv, item 3 of argv}' % self.photoshop,
+               '-e', 'end run',
+               self.script, job_file.name, self.formats[encoding.compression if encoding else 'lzw']]
+        try:
+            # Using the call function to wait for command to complete
+            subprocess.call(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+            os.remove(job_file.name)
+
+
+class DarktableBackend(ConverterBackend):
+    """darktable-cli, all images of a batch which share an output directory in one call"""
+
+    name = 'darktable'
+    batch_size = 25
+    if platform.system() == 'Darwin':
+        app = '/Applications/darktable.app/Contents/MacOS/darktable-cli'
+    else:
+        app = 'darktable-cli'
+    options = ['--core', '--conf', 'plugins/imageio/format/tiff/bpp=16']
+    compressions = ('none', 'deflate')
+    encoding_options = ('predictor',)
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        encoding = encoding or self.encoding
+        outputs = {}
+        for raw_image, tif_image in jobs:
+            outputs.setdefault(os.path.dirname(tif_image), []).append(raw_image)
+
+        options = list(self.options)
+        if encoding is not None:
+            # 0: none, 1: deflate, 2: deflate with predictor
+            compress = 0 if encoding.compression == 'none' else 2 if encoding.predictor else 1
+            options += ['--conf', 'plugins/imageio/format/tiff/compress=%d' % compress]
+
+        for tiff_dir, raw_images in outputs.items():
+            cmd = [self.app] + raw_images + [tiff_dir + '/$(FILE_NAME)', '--out-ext', 'tif'] + options
+            # darktable locks its library, every worker needs a config directory of its own
+            if scratch is not None:
+                cmd += ['--configdir', scratch]
+            subprocess.call(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class StubBackend(ConverterBackend):
+    """Writes a small grey TIFF for every job, to run the conversion on any machine without a converter"""
+
+    name = 'stub'
+    batch_size = 100
+    size = 8
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        pixels = struct.pack('<H', 32768) * (self.size * self.size * 3)
+        for _, tif_image in jobs:
+            write_tiff16(tif_image, self.size, self.size, pixels, encoding or self.encoding)
+
+
+class NativeBackend(ConverterBackend):
+    """Develops the CR2s with LibRaw (rawpy) and NumPy, runs on every machine of the farm
+
+    The images of a batch are spread over a process pool. LibRaw decodes the CR2s, the developing
+    (white balance, demosaic, color card) is ours.
+    """
+
+    name = 'native'
+    batch_size = 4
+    exposure = 0.0
+
+    def __init__(self):
+        if rawpy is None:
+            raise RuntimeError('The native backend needs rawpy: pip install rawpy')
+        self._pool = None
+        self._lock = threading.Lock()
+        self.encoding = TiffEncoding('deflate', predictor=True)
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        with self._lock:
+            if self._pool is None:
+                # Spawned, forking while the scheduler threads run can deadlock the children
+                self._pool = get_context('spawn').Pool(processes=cpu_count())
+        results = [self._pool.apply_async(develop_cr2, job, {'exposure': self.exposure,
+                                                             'encoding': encoding or self.encoding})
+                   for job in jobs]
+        for (raw_image, _), result in zip(jobs, results):
+            try:
+                result.get()
+            except (OSError, ValueError, rawpy.LibRawError) as exc:
+                # Leave it to the TIFF validation, the job gets retried or reported. The image
+                # is <player>/_acquisition/<take>/<image>.CR2
+                log = player_log(raw_image.split('/')[-4])
+                log.info("{} failed to develop: {}".format(raw_image.split('/')[-1], exc))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+# All available converters by name
+BACKENDS = {backend.name: backend for backend in (PhotoshopBackend, DarktableBackend, NativeBackend, StubBackend)}
+
+
+class ConversionScheduler:
+    """Fixed pool of long-lived worker slots feeding batches to a backend
+
+    Every slot owns a scratch directory (i.e. the darktable config directory) which is created once
+    and reused for all of its batches. The batches of a pose are queued on one slot to keep them together,
+    a slot which runs dry steals from the back of the longest queue.
+    """
+
+    def __init__(self, backend, workers=None, scratch=None):
+        self.backend = backend
+        if not workers:
+            workers = backend.max_workers or cpu_count()
+        if backend.max_workers:
+            workers = min(workers, backend.max_workers)
+        self.workers = workers
+        self.scratch = scratch or os.path.join(tempfile.gettempdir(), 'pxconvert')
+        self.queues = [deque() for _ in range(self.workers)]
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def slot_dir(self, slot):
+        """Return the scratch directory of a slot, created on first use
+
+        :param slot: number of the slot
+        :return: path of the directory
+        """
+        path = os.path.join(self.scratch, 'slot%02d' % slot)
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        return path
+
+    def submit(self, poses):
+        """Queue the batches of all poses, round robin over the slots
+
+        :param poses: list of lists of batches, one list per pose
+        :return: None
+        """
+        with self._lock:
+            for counter, batches in enumerate(poses):
+                self.queues[counter % self.workers].extend(batches)
+
+    def _next(self, slot):
+        with self._lock:
+            if self.queues[slot]:
+                return self.queues[slot].popleft()
+
+            # Steal from the back of the busiest slot
+            victim = max(self.queues, key=len)
+            if victim:
+                return victim.pop()
+
+        return None
+
+    def _work(self, slot, callback):
+        scratch = self.slot_dir(slot)
+        while True:
+            batch = self._next(slot)
+            if batch is None:
+                return
+
+            try:
+                self.backend.convert(batch, scratch=scratch)
+            except Exception as exc:
+                with self._lock:
+                    self.failures.append((batch, exc))
+            if callback is not None:
+                callback(batch)
+
+    def run(self, callback=None):
+        """Work through all queued batches and wait until they are done
+
+        :param callback: optional function called with every finished batch
+        :return: list of (batch, exception) of batches the backend raised on
+        """
+        threads = [threading.Thread(target=self._work, args=(slot, callback), daemon=True)
+                   for slot in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        failures, self.failures = self.failures, []
+
+        return failures
+
+
+class FarmScheduler:
+    """Distribute the batches over the farm, a drop in for the ConversionScheduler
+
+    The coordinator serves the batches over HTTP, workers (pxconvert --worker) lease one batch at a time
+    and send heartbeats while converting. A lease without heartbeat expires and its batch goes back
+    to the queue. Paths travel relative to the projects directory, every machine mounts Bigfoot elsewhere.
+    """
+
+    def __init__(self, backend, port=8765, timeout=60, reassign=3, root=None, local_workers=0, idle=600):
+        """
+        :param backend: ConverterBackend the workers use, only its name travels
+        :param port: port of the coordinator
+        :param timeout: seconds without heartbeat until a lease expires
+        :param reassign: how often a batch of a lost worker is handed out again
+        :param idle: seconds without any worker activity until the remaining batches fail, i.e. no worker running
+        :param root: projects directory the paths are relative to
+        :param local_workers: number of worker processes to start on this machine
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.reassign = reassign
+        self.idle = idle
+        self.root = root or GlobalDirs.projects
+        self.pending = deque()
+        self.leases = {}
+        self.failures = []
+        self.stats = {}
+        self._counter = 0
+        self._callback = None
+        self._activity = time.monotonic()
+        self._done = threading.Condition()
+
+        self.server = ThreadingHTTPServer(('', port), FarmHandler)
+        self.server.scheduler = self
+        self.url = 'http://{}:{}'.format(socket.gethostname(), self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._reap, daemon=True).start()
+
+        local_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.processes = [subprocess.Popen([sys.executable, os.path.realpath(__file__), '--worker', local_url,
+                                            '--root', self.root, '--workers', '1'],
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                          for _ in range(local_workers)]
+        self.workers = len(GlobalDirs.machines) + local_workers
+
+    def submit(self, poses):
+        """Queue the batches of all poses
+
+        :param poses: list of lists of batches, one list per pose
+        :return: None
+        """
+        with self._done:
+            for batches in poses:
+                self.pending.extend((batch, 0) for batch in batches)
+
+    def lease(self, worker, refused=()):
+        """Hand the next batch to a worker
+
+        :param worker: name of the worker
+        :param refused: names of the backends the worker can't run
+        :return: dictionary of the lease, 'wait' if nothing is left right now or nothing for this worker
+        """
+        with self._done:
+            self.stats.setdefault(worker, {'batches': 0, 'images': 0, 'failed': 0, 'lost': 0})
+            if self.backend.name in refused:
+                return {'wait': 60}
+            if not self.pending:
+                return {'wait': 1}
+
+            self._activity = time.monotonic()
+
+            batch, reassigned = self.pending.popleft()
+            self._counter += 1
+            self.leases[self._counter] = {'batch': batch, 'worker': worker, 'reassigned': reassigned,
+                                          'deadline': time.monotonic() + self.timeout}
+
+            encoding = self.backend.encoding
+            return {'lease': self._counter, 'backend': self.backend.name, 'timeout': self.timeout,
+                    'encoding': None if encoding is None else {'compression': encoding.compression,
+                                                               'predictor': encoding.predictor,
+                                                               'tile': encoding.tile},
+                    'jobs': [[os.path.relpath(path, self.root) for path in job] for job in batch]}
+
+    def heartbeat(self, worker, lease):
+        with self._done:
+            if lease in self.leases and self.leases[lease]['worker'] == worker:
+                self._activity = time.monotonic()
+                self.leases[lease]['deadline'] = time.monotonic() + self.timeout
+                return {'ok': True}
+
+        # Expired and handed to someone else, the worker should drop it
+        return {'ok': False}
+
+    def result(self, worker, lease, error=None):
+        """Take the result of a lease, a late result of an expired lease is ignored"""
+        with self._done:
+            entry = self.leases.get(lease)
+            if entry is None or entry['worker'] != worker:
+                return {'ok': False}
+            del self.leases[lease]
+            self._activity = time.monotonic()
+
+            stats = self.stats[worker]
+            stats['batches'] += 1
+            stats['images'] += len(entry['batch'])
+            if error is not None:
+                stats['failed'] += 1
+                self.failures.append((entry['batch'], RuntimeError('{}: {}'.format(worker, error))))
+            self._done.notify_all()
+
+        if self._callback is not None:
+            self._callback(entry['batch'])
+
+        return {'ok': True}
+
+    def release(self, worker, lease):
+        """Take a batch back which a worker can't convert, it goes to the next worker without counting as failed"""
+        with self._done:
+            entry = self.leases.get(lease)
+            if entry is None or entry['worker'] != worker:
+                return {'ok': False}
+            del self.leases[lease]
+
+            self.pending.appendleft((entry['batch'], entry['reassigned']))
+            self._done.notify_all()
+
+        return {'ok': True}
+
+    def _reap(self):
+        # Requeue the batches of workers which stopped sending heartbeats
+        while True:
+            time.sleep(1)
+            with self._done:
+                now = time.monotonic()
+                for lease, entry in list(self.leases.items()):
+                    if entry['deadline'] > now:
+                        continue
+
+                    del self.leases[lease]
+                    self.stats[entry['worker']]['lost'] += 1
+                    if entry['reassigned'] < self.reassign:
+                        self.pending.appendleft((entry['batch'], entry['reassigned'] + 1))
+                    else:
+                        self.failures.append((entry['batch'], RuntimeError('lost {} workers'.format(self.reassign + 1))))
+                self._done.notify_all()
+
+    def run(self, callback=None):
+        """Wait until the farm converted all queued batches or no worker showed up for idle seconds
+
+        :param callback: optional function called with every finished batch
+        :return: list of (batch, exception) of batches which failed on a worker or were never converted
+        """
+        self._callback = callback
+        with self._done:
+            self._activity = time.monotonic()
+            while self.pending or self.leases:
+                if time.monotonic() - self._activity > self.idle:
+                    # Nobody leases or reports anymore, give up on what is left, late results are ignored
+                    error = RuntimeError('no farm worker activity for {} seconds'.format(self.idle))
+                    self.failures.extend((batch, error) for batch, _ in self.pending)
+                    self.failures.extend((entry['batch'], error) for entry in self.leases.values())
+                    self.pending.clear()
+                    self.leases.clear()
+                    break
+                self._done.wait(1)
+            failures, self.failures = self.failures, []
+
+        return failures
+
+    def close(self):
+        """Stop the coordinator and the local workers"""
+        self.server.shutdown()
+        self.server.server_close()
+        for process in self.processes:
+            process.terminate()
+            process.wait()
+
+
+class FarmHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: POST /lease, /heartbeat, /result and /release, GET /status"""
+
+    def _reply(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        with scheduler._done:
+            self._reply({'pending': len(scheduler.pending), 'leased': len(scheduler.leases),
+                         'workers': scheduler.stats})
+
+    def do_POST(self):
+        scheduler = self.server.scheduler
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/lease':
+            self._reply(scheduler.lease(request['worker'], request.get('refused', ())))
+        elif self.path == '/heartbeat':
+            self._reply(scheduler.heartbeat(request['worker'], request['lease']))
+        elif self.path == '/result':
+            self._reply(scheduler.result(request['worker'], request['lease'], request.get('error')))
+        elif self.path == '/release':
+            self._reply(scheduler.release(request['worker'], request['lease']))
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def farm_request(url, path, data):
+    """POST a JSON request to the coordinator and return its JSON reply"""
+    request = urllib.request.Request(url + path, data=json.dumps(data).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def farm_worker(url, root=None, workers=None):
+    """Convert batches of a coordinator until stopped, run on every machine of the farm
+
+    :param url: URL of the coordinator, i.e. http://px10:8765
+    :param root: projects directory of this machine
+    :param workers: number of batches converted at the same time, None for one per core
+    :return: None
+    """
+    root = root or GlobalDirs.projects
+    backends = {}
+    # Backends which can't run on this machine, i.e. native without rawpy
+    refused = {}
+    lock = threading.Lock()
+
+    def backend(name):
+        with lock:
+            if name not in backends and name not in refused:
+                try:
+                    backends[name] = BACKENDS[name]()
+                except RuntimeError as exc:
+                    refused[name] = str(exc)
+                    print(Fore.RED + 'Not converting with {}: {}'.format(name, exc))
+            return backends.get(name)
+
+    def work(slot):
+        name = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), slot)
+        scratch = os.path.join(tempfile.gettempdir(), 'pxconvert', 'farm%02d' % slot)
+        Path(scratch).mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                lease = farm_request(url, '/lease', {'worker': name, 'refused': sorted(refused)})
+            except (OSError, ValueError):
+                # Coordinator not there (yet), keep asking
+                time.sleep(5)
+                continue
+            if 'wait' in lease:
+                time.sleep(lease['wait'])
+                continue
+
+            converter = backend(lease['backend'])
+            if converter is None:
+                # Hand the batch back to a worker which can convert it, this one asks for no more of them
+                try:
+                    farm_request(url, '/release', {'worker': name, 'lease': lease['lease']})
+                except (OSError, ValueError):
+                    pass
+                continue
+
+            # Every lease brings its own encoding, the backend is shared by all slots and stays untouched
+            encoding = TiffEncoding(**lease['encoding']) if lease.get('encoding') else None
+            jobs = [tuple(os.path.join(root, path) for path in job) for job in lease['jobs']]
+
+            result = {}
+            thread = threading.Thread(target=convert, args=(converter, jobs, scratch, encoding, result))
+            thread.start()
+            # Heartbeats while the backend is busy
+            expired = False
+            while thread.is_alive():
+                thread.join(lease['timeout'] / 3)
+                if thread.is_alive() and not expired:
+                    try:
+                        expired = not farm_request(url, '/heartbeat', {'worker': name, 'lease': lease['lease']})['ok']
+                    except (OSError, ValueError):
+                        pass
+                    if expired:
+                        print(Fore.YELLOW + '{}: lease {} expired, the batch went to another worker'.format(
+                            name, lease['lease']))
+
+            # The batch of an expired lease belongs to another worker now, it reports the result
+            if expired:
+                continue
+            try:
+                farm_request(url, '/result', {'worker': name, 'lease': lease['lease'], 'error': result.get('error')})
+            except (OSError, ValueError):
+                pass
+
+    def convert(converter, jobs, scratch, encoding, result):
+        try:
+            converter.convert(jobs, scratch=scratch, encoding=encoding)
+        except Exception as exc:
+            result['error'] = str(exc)
+
+    threads = [threading.Thread(target=work, args=(slot,), daemon=True) for slot in range(workers or cpu_count())]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ConversionCache:
+    """Remember which TIFF was converted from which CR2, color card and backend
+
+    An entry is up to date as long as the size/mtime of the CR2, the content of its XMP color card,
+    the backend version and the TIFF encoding match. Changing a color card only invalidates the images using it.
+    """
+
+    filename = '.pxconvert_cache.json'
+
+    def __init__(self, tiff_dir, backend, xmps=None):
+        self.path = os.path.join(tiff_dir, self.filename)
+        # The encoding is part of the output, a different compression, predictor or tiling converts again
+        self.backend = '%s:%s:%r' % (backend.name, backend.version, backend.encoding)
+        self.cards = {}
+        for xmp in xmps or []:
+            with open(xmp, 'rb') as f:
+                self.cards[os.path.basename(xmp)] = hashlib.blake2b(f.read()).hexdigest()
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def card(self, raw_image):
+        """Return the digest of the color card used for a CR2
+
+        A single XMP is used for every image, otherwise the one named after the image.
+        """
+        if len(self.cards) == 1:
+            return next(iter(self.cards.values()))
+
+        return self.cards.get(os.path.splitext(os.path.basename(raw_image))[0] + '.xmp')
+
+    def key(self, raw_image, tif_image):
+        stat = os.stat(raw_image)
+        return {'raw': [stat.st_size, stat.st_mtime_ns], 'card': self.card(raw_image), 'backend': self.backend}
+
+    def is_fresh(self, raw_image, tif_image):
+        """Check if the TIFF exists and was made from the current CR2, color card and backend
+
+        :param raw_image: CR2 file
+        :param tif_image: TIFF file
+        :return: True or False
+        """
+        # Relative names keep the cache valid on every mount point of Bigfoot
+        entry = self.entries.get(os.path.relpath(tif_image, os.path.dirname(self.path)))
+        return entry is not None and entry == self.key(raw_image, tif_image) and os.path.isfile(tif_image)
+
+    def update(self, raw_image, tif_image):
+        key = self.key(raw_image, tif_image)
+        with self._lock:
+            self.entries[os.path.relpath(tif_image, os.path.dirname(self.path))] = key
+
+    def save(self):
+        with self._lock:
+            Path(os.path.dirname(self.path)).mkdir(parents=True, exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + '.tmp', self.path)
+
+
+class XmpSidecars:
+    """Place the color card XMP next to the CR2 images and remove exactly those again
+
+    Sidecars are hardlinked ('link'), symlinked ('symlink') or copied ('copy') from the color card,
+    links fall back to copies where the filesystem has none. The converters only read the sidecars.
+    Every created sidecar is recorded in a manifest in _acquisition, cleaning up only removes
+    recorded sidecars which are still the ones we created, so hand-tuned XMPs are never touched.
+    """
+
+    filename = '.pxconvert_sidecars.json'
+
+    def __init__(self, acquisition_dir, mode='link'):
+        self.path = os.path.join(acquisition_dir, self.filename)
+        self.mode = mode
+
+        # Sidecars left behind by an interrupted run are cleaned up with ours
+        try:
+            with open(self.path, 'r') as f:
+                self.created = json.load(f)
+        except (OSError, ValueError):
+            self.created = []
+
+    def _place(self, src, dst):
+        if os.path.lexists(dst):
+            return False
+
+        mode = self.mode
+        if mode == 'link':
+            try:
+                os.link(src, dst)
+            except OSError:
+                # i.e. SMB shares without hardlinks
+                mode = 'copy'
+                copyfile(src, dst)
+        elif mode == 'symlink':
+            try:
+                os.symlink(src, dst)
+            except OSError:
+                mode = 'copy'
+                copyfile(src, dst)
+        else:
+            copyfile(src, dst)
+
+        stat = os.lstat(dst)
+        self.created.append([dst, src, mode, stat.st_ino, stat.st_mtime_ns])
+
+        return True
+
+    def materialize(self, raw_images, poses, xmps):
+        """Place the sidecars
+
+        :param raw_images: all CR2 images of the player
+        :param poses: all take directories of the player
+        :param xmps: one XMP for all images or one XMP per image name
+        :return: number of created sidecars
+        """
+        count = 0
+        try:
+            if len(xmps) == 1:
+                for raw_image in raw_images:
+                    count += self._place(xmps[0], os.path.splitext(raw_image)[0] + '.xmp')
+            else:
+                for pose in poses:
+                    for xmp in xmps:
+                        count += self._place(xmp, pose + '/' + os.path.basename(xmp))
+        finally:
+            self.save()
+
+        return count
+
+    def _is_ours(self, dst, src, mode, ino, mtime):
+        try:
+            stat = os.lstat(dst)
+        except FileNotFoundError:
+            return False
+
+        if mode == 'symlink':
+            return os.path.islink(dst) and os.readlink(dst) == src
+        if mode == 'link':
+            return stat.st_ino == ino
+        return stat.st_ino == ino and stat.st_mtime_ns == mtime
+
+    def cleanup(self):
+        """Remove all sidecars we created in one pass over the manifest
+
+        :return: number of removed sidecars
+        """
+        count = 0
+        for entry in self.created:
+            if self._is_ours(*entry):
+                os.remove(entry[0])
+                count += 1
+
+        self.created = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        return count
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.created, f)
+
+
+def copy_xmp(directory, player, xmps, task, mode='link'):
+    """Place XMP template along side every Camera RAW image so that
     the conversion process in Adobe PS does the right thing
 
     :param directory: path to the team
     :param player: name of a player
-    :param xmps: XMP file(s) to be copied
+    :param xmps: XMP file(s) to be placed
+    :param task: True to place the XMPs, False to remove them again
+    :param mode: 'link', 'symlink' or 'copy', see XmpSidecars
     :return: None
     """
+    sidecars = XmpSidecars(directory + '/' + player + '/_acquisition', mode=mode)
 
     if task:
-        print(Fore.YELLOW + 'Copying XMP...')
+        print(Fore.YELLOW + 'Placing XMP...')
+
+        # Only take directories, skips _thumbs and tiff
+        poses = [p for p in glob(directory + '/' + player + '/_acquisition/*') if parse_take(p) is not None]
+        raw_images = [r for r in glob(directory + '/' + player + '/_acquisition/*/*')
+                      if parse_take(os.path.dirname(r)) is not None and os.path.splitext(r)[1].lower() == '.cr2']
+        count = sidecars.materialize(raw_images, poses, xmps)
     else:
         print(Fore.YELLOW + 'Cleaning XMP...')
+        count = sidecars.cleanup()
 
-    poses = glob(directory + '/' + player + '/_acquisition/*')
-    check = ['_thumbs', 'tiff']
-    poses = [p for p in poses if p.split('/')[-1] not in check]
+    print(Fore.GREEN + 'DONE ({} XMPs)'.format(count))
 
-    if task:
-        if len(xmps) == 1:
-            raw_images = glob(directory + '/' + player + '/_acquisition/*/*')
-
-            for raw_image in raw_images:
-                name, suffix = os.path.splitext(raw_image)
-                if suffix and re.match(suffix, '.CR2', re.IGNORECASE):
-                    # Copy XMP template to be side by side with the CR2 images
-                    k = name.rfind('/')
-                    new_name = name[:k] + '/' + name[k + 1:]
-                    dst_xmp = new_name + '.xmp'
-                    copyfile(xmps[0], dst_xmp)
-        else:
-            for pose in poses:
-                for xmp in xmps:
-                    _ = '/'.join(xmp.split('/')[:-1])
-                    dst = xmp.replace(_, pose)
-                    copyfile(xmp, dst)
-    else:
-        for pose in poses:
-            for xmp in glob(pose + '/*.xmp'):
-                os.remove(xmp)
 
-    print(Fore.GREEN + 'DONE')
+_log_lock = threading.Lock()
+
+
+def player_log(player):
+    """Logger writing into /tmp/<player>.log
 
+    :param player: name of a player
+    :return: logging.Logger
+    """
+    log = logging.getLogger('pxconvert.' + player)
+    with _log_lock:
+        if not log.handlers:
+            handler = logging.FileHandler('/tmp/' + player + '.log')
+            handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            log.addHandler(handler)
+            log.setLevel(logging.INFO)
+            log.propagate = False
+
+    return log
 
-def convert_to_tiff(directory, player, *args, **kwargs):
+
+def convert_to_tiff(directory, player, backend=None, workers=None, xmps=None, force=False, retries=2,
+                    scheduler=None, take=None, write_report=True, **kwargs):
     """Convert CR2 to TIFF 16bit
-    Create a TIFF sub-directory and run Adobe Photoshop to convert the images
+    Create a TIFF sub-directory and let the backend convert the images pose by pose,
+    TIFFs which are up to date with their CR2 and color card are skipped
 
     :param directory: directory name of the team
     :param  player: either the name of a player
-    :return: None
+    :param backend: ConverterBackend to use, Adobe Photoshop by default
+    :param workers: number of parallel conversions, defaults to what the backend allows
+    :param xmps: XMP color card file(s) used for the conversion
+    :param force: convert everything, even if up to date
+    :param retries: how often an invalid TIFF gets converted again
+    :param scheduler: scheduler to run the conversions on, i.e. a FarmScheduler, a local one by default
+    :param take: convert exactly this take, i.e. 01_12_2020_king_louis_neutral_tk1 (not ..._tk10)
+    :param write_report: write the failed conversions to /tmp/<player>_failures.json
+    :return: list of failed conversions
     """
-    print(Fore.YELLOW + 'Converting CR2 to TIFF16...')
+    if scheduler is not None:
+        backend = scheduler.backend
+    elif backend is None:
+        backend = PhotoshopBackend()
+    if scheduler is None:
+        scheduler = ConversionScheduler(backend, workers=workers)
 
-    # Execute Adobe PS via osascript to convert CR2 to TIFF16 with javascript
-    app = '/usr/bin/osascript'
-    scpt = '/Users/px/Projects/pxconvert/convert_img.scpt'
+    print(Fore.YELLOW + 'Converting CR2 to TIFF16 ({}, {} workers)...'.format(backend.name, scheduler.workers))
 
     # Get Camera RAW images
     pose = kwargs.get('pose', None)
-    if pose is None:
+    if take is not None:
+        raw_images = glob(directory + '/' + player + '/_acquisition/' + take + '/*')
+    elif pose is None:
         raw_images = glob(directory + '/' + player + '/_acquisition/*/*')
     else:
-        poses = glob(directory + '/' + player + '/_acquisition/*')
-        poses = [s for s in poses if pose in s]
-        if len(poses) > 1:
-            pose = poses[0].split('/')[-1][:-4]
+        takes = [parse_take(p) for p in glob(directory + '/' + player + '/_acquisition/*')]
+        takes = [t for t in takes if t is not None and pose in t.name]
+        # Several takes of the same pose, convert all of them
+        if len(takes) > 1:
+            pose = takes[0].base
         else:
-            pose = poses[0].split('/')[-1]
+            pose = takes[0].name
 
         raw_images = glob(directory + '/' + player + '/_acquisition/' + pose + '*/*')
+    # Only images inside of takes, skips the tiff and _thumbs directories
+    raw_images = [r for r in raw_images if parse_take(os.path.dirname(r)) is not None]
 
-    # Get all poses
-    poses = glob(directory + '/' + player + '/_acquisition/*')
-    # Drop tiff from list if already exists
-    item = [x for x in poses if 'tiff' in x]
-    if len(item) != 0:
-        idx = poses.index(item[0])
-        poses.pop(idx)
+    # Get all poses, skips tiff and _thumbs
+    poses = [p for p in glob(directory + '/' + player + '/_acquisition/*') if parse_take(p) is not None]
     # Create tiff directory
     for pose in poses:
         dir_list = pose.split('/')
         tiff_dir = Path('/'.join(dir_list[:-1]) + '/tiff/' + dir_list[-1])
         tiff_dir.mkdir(parents=True, exist_ok=True)
 
-    # Create log
-    log_file = '/tmp/' + player + '.log'
-    logging.basicConfig(filename=log_file, filemode='a', level=logging.INFO)
+    # Create log, a handler per player, several players get converted by one process
+    log = player_log(player)
 
-    # Build a list with all image conversion commands to be executed
-    for raw_image in tqdm(raw_images):
+    cache = ConversionCache(directory + '/' + player + '/_acquisition/tiff', backend, xmps)
+
+    # Build a list with all conversion jobs per pose
+    jobs = {}
+    skipped = 0
+    for raw_image in sorted(raw_images):
         name, suffix = os.path.splitext(raw_image)
 
         if suffix and re.match(suffix, '.CR2', re.IGNORECASE):
             # Insert TIFF name into directory and set tif file name
-            dir_list = raw_image.split('/')
-            tiff_dir = '/'.join(dir_list[:-2]) + '/tiff'
-            if not os.path.isdir(tiff_dir):
-                os.mkdir(tiff_dir)
+            dir_list = name.split('/')
+            tif_image = '/'.join(dir_list[:-2]) + '/tiff/' + '/'.join(dir_list[-2:]) + '.tif'
+            if not force and cache.is_fresh(raw_image, tif_image):
+                skipped += 1
+                continue
+            jobs.setdefault(dir_list[-2], []).append((raw_image, tif_image))
 
-            tif_image = tiff_dir + '/' + '/'.join(dir_list[-2:])
-            tif_image = tif_image.split('.')[0] + '.tif'
+    if skipped:
+        print(Fore.LIGHTBLACK_EX + '{} TIFFs are up to date'.format(skipped))
 
-            cmd = app + ' ' + scpt + ' ' + raw_image + ' ' + tif_image
-            # Using the call function to wait for command to complete
-            subprocess.call(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def batches(pose_jobs):
+        return [pose_jobs[i:i + backend.batch_size] for i in range(0, len(pose_jobs), backend.batch_size)]
+
+    pending = [job for pose_jobs in jobs.values() for job in pose_jobs]
+    attempts = {}
+    errors = {}
+
+    # Outdated TIFFs are kept aside until their conversion succeeded, only a TIFF written by this run validates
+    for _, tif_image in pending:
+        if os.path.isfile(tif_image):
+            os.replace(tif_image, tif_image + '.prev')
+    with tqdm(total=len(pending)) as progress:
+        lock = threading.Lock()
+
+        def done(batch):
+            with lock:
+                progress.update(len(batch))
+
+        try:
+            for attempt in range(retries + 1):
+                # Hand the jobs of every pose in batches to the workers
+                by_pose = {}
+                for job in pending:
+                    by_pose.setdefault(os.path.dirname(job[1]), []).append(job)
+                    attempts[job] = attempt + 1
+                scheduler.submit([batches(pose_jobs) for pose_jobs in by_pose.values()])
 
-            # Create log file for all failed conversion
-            if imghdr.what(tif_image) != 'tiff':
-                logging.info("{} did NOT convert".format(raw_image.split('/')[-1]))
+                raised = set()
+                for batch, exc in scheduler.run(callback=done):
+                    for job in batch:
+                        errors.setdefault(job, []).append(str(exc))
+                        raised.add(job)
+
+                # Check every TIFF structurally, the broken ones and the failed batches go into the next round
+                failed = dict(validate_tiffs([job for job in pending if job not in raised]))
+                for job in pending:
+                    if job not in failed and job not in raised:
+                        cache.update(*job)
+                        errors.pop(job, None)
+                    elif job in failed:
+                        errors.setdefault(job, []).append(failed[job])
+
+                # A TIFF left over from this round must not validate in the next one
+                pending = [job for job in pending if job in failed or job in raised]
+                for _, tif_image in pending:
+                    if os.path.isfile(tif_image):
+                        os.remove(tif_image)
+                if not pending:
+                    break
+                if attempt < retries:
+                    progress.total += len(pending)
+                    progress.refresh()
+        finally:
+            # Whatever got converted stays converted for the next run
+            cache.save()
+
+            # A failed conversion gets its previous TIFF back, the cache still marks it outdated
+            for pose_jobs in jobs.values():
+                for job in pose_jobs:
+                    previous = job[1] + '.prev'
+                    if not os.path.isfile(previous):
+                        continue
+                    if job in pending or not os.path.isfile(job[1]):
+                        os.replace(previous, job[1])
+                    else:
+                        os.remove(previous)
+
+    # Create log file and report for all failed conversion
+    report = []
+    for raw_image, tif_image in pending:
+        log.info("{} did NOT convert".format(raw_image.split('/')[-1]))
+        report.append({'raw': raw_image, 'tiff': tif_image, 'reason': '; '.join(errors[(raw_image, tif_image)]),
+                       'attempts': attempts[(raw_image, tif_image)]})
+    if write_report:
+        with open('/tmp/' + player + '_failures.json', 'w') as f:
+            json.dump(report, f, indent=1)
 
     print(Fore.GREEN + 'DONE')
 
+    return report
+
 
 def clear_screen():
     _ = subprocess.run('clear' if os.name == 'posix' else 'cls')
@@ -223,11 +1826,29 @@ def clear_screen():
 
 @command()
 @option('--game', '-g', default='2K_1018_NBA2K21', help='Game name', type=str, required=True)
-@option('--team', '-t', help='Team name', type=str, required=True)
-@option('--player', '-p', help='Player name', type=str, required=True)
+@option('--team', '-t', help='Team name', type=str)
+@option('--player', '-p', help='Player name', type=str)
 @option('--directory', '-d', default=None, help='Directory of a pose', type=str)
 @option('--card', '-c', help='Color Card', type=str)
-def main(game, team, player, directory, card):
+@option('--backend', '-b', default='photoshop', help='Converter', type=Choice(sorted(BACKENDS)))
+@option('--workers', '-w', default=0, help='Parallel conversions, 0 for one per core', type=int)
+@option('--force', '-f', is_flag=True, help='Convert all images, even if the TIFF is up to date')
+@option('--retries', '-r', default=2, help='Conversions of an invalid TIFF before giving up', type=int)
+@option('--xmp-mode', default='link', help='How to place the color card XMPs',
+        type=Choice(['link', 'symlink', 'copy']))
+@option('--compression', default=None, help='TIFF compression, the converter\'s default if not given',
+        type=Choice(sorted(COMPRESSIONS)))
+@option('--predictor', is_flag=True, help='Horizontal predictor before compressing')
+@option('--tile', default=0, help='Tile size of the TIFFs (multiple of 16), 0 for strips', type=int)
+@option('--benchmark', default=0, help='Compare all encodings on this many TIFFs of the player, nothing gets converted',
+        type=int)
+@option('--farm', is_flag=True, help='Distribute the conversions over the farm')
+@option('--local-workers', default=0, help='Farm workers to start on this machine', type=int)
+@option('--port', default=8765, help='Port of the farm coordinator', type=int)
+@option('--worker', default=None, help='Run as farm worker of the coordinator at this URL', type=str)
+@option('--root', default=None, help='Projects directory of this machine', type=str)
+def main(game, team, player, directory, card, backend, workers, force, retries, xmp_mode,
+         compression, predictor, tile, benchmark, farm, local_workers, port, worker, root):
     """
     Converting the images from CR2 to TIFF16 using Adobe Photoshop CC 2019.
 
@@ -238,15 +1859,66 @@ def main(game, team, player, directory, card):
     directory: Directory name of a pose, either as full name or pose name,
                i.e.: 01_12_2020_jefferson_amile_yell_angry_tk2 OR yell_angry
     card:      To use color card, pass in the date of the shoot, i.e. 01_03_2020
+    backend:   Converter to use, photoshop [Default], darktable, native (rawpy and NumPy) or stub
+    workers:   Number of parallel conversions, 0 [Default] for one per core (Photoshop always uses one)
+    force:     Convert all images, otherwise only the ones with a missing or outdated TIFF
+    retries:   How often an invalid TIFF gets converted again, 2 [Default]; failures end up in /tmp/<player>_failures.json
+    xmp_mode:  Place the color card XMP next to the CR2s as hardlink [Default], symlink or copy,
+               links become copies where the filesystem has none
+    compression: none, lzw, deflate or zstd, by default Photoshop uses LZW and native deflate with predictor,
+               lzw needs imagecodecs except for Photoshop
+    predictor: Horizontal predictor, for lzw, deflate and zstd, needs --compression (not Photoshop)
+    tile:      Tile size of the TIFFs, 0 [Default] for strips, needs --compression (native and stub only)
+    benchmark: Write and read this many of the player's TIFFs with every encoding, print size and times
+    farm:      Coordinate the conversion on this machine, the farm machines run 'pxconvert --worker URL'
+    local_workers: Number of farm workers started on this machine, i.e. to test on 127.0.0.1
+    port:      Port of the farm coordinator, 8765 [Default]
+    worker:    Run as farm worker of the coordinator at this URL, i.e. http://px10:8765
+    root:      Projects directory of this machine, if Bigfoot is mounted somewhere else
     """
 
+    # A farm worker needs nothing but its coordinator
+    if worker:
+        print(Fore.YELLOW + 'Converting for {} (Ctrl-C to stop)...'.format(worker))
+        try:
+            farm_worker(worker, root=root, workers=workers)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if not team or not player:
+        raise UsageError('Missing option --team and/or --player')
+
+    try:
+        converter = BACKENDS[backend]()
+    except RuntimeError as exc:
+        raise UsageError(str(exc))
+    if (predictor or tile) and compression is None:
+        raise UsageError('--predictor and --tile need --compression')
+    if predictor and compression == 'none':
+        raise UsageError('--predictor needs a compression other than none')
+    for name, value in (('predictor', predictor), ('tile', tile)):
+        if value and name not in converter.encoding_options:
+            raise UsageError('{} does not support --{}'.format(backend, name))
+    if compression is not None:
+        if compression not in converter.compressions:
+            raise UsageError('{} can not write {} TIFFs'.format(backend, compression))
+        # Photoshop writes its own LZW, the other backends through imagecodecs
+        if compression == 'lzw' and backend != 'photoshop' and imagecodecs is None:
+            raise UsageError('lzw needs the imagecodecs module')
+        try:
+            converter.encoding = TiffEncoding(compression, predictor=predictor, tile=tile)
+        except ValueError as exc:
+            raise UsageError(str(exc))
+
     # Call function to clear screen
     clear_screen()
 
     # If Photoshop runs already kill it
-    process = subprocess.Popen('pgrep Photoshop', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    pid, err = process.communicate()
-    if pid: os.kill(int(pid.decode("utf-8")), signal.SIGKILL)
+    if backend == 'photoshop' and not farm:
+        process = subprocess.Popen('pgrep Photoshop', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        pid, err = process.communicate()
+        if pid: os.kill(int(pid.decode("utf-8")), signal.SIGKILL)
 
     # Check if given directory is valid, i.e.: /Pixelgun_Projects/2K_1018_NBA2K21/Sections/orl/birch_khem
     path = os.path.realpath(GlobalDirs.projects + "/" + game + "/Sections/" + team)
@@ -257,6 +1929,25 @@ def main(game, team, player, directory, card):
     if len(player.split()) == 1:
         player_name = ' '.join(map(str, player.split('_')[::-1])).title()
 
+    if benchmark:
+        tif_images = sorted(glob(path + '/' + player + '/_acquisition/tiff/*/*.tif'))
+        tif_images = tif_images[::max(1, len(tif_images) // benchmark)][:benchmark]
+        encodings = [TiffEncoding(), TiffEncoding('deflate'), TiffEncoding('deflate', True),
+                     TiffEncoding('deflate', True, tile=256)]
+        if imagecodecs is not None:
+            encodings += [TiffEncoding('lzw'), TiffEncoding('lzw', True)]
+        if zstandard is not None:
+            encodings += [TiffEncoding('zstd', True), TiffEncoding('zstd', True, tile=256)]
+
+        print(Fore.YELLOW + 'Benchmarking {} TIFFs of {}...'.format(len(tif_images), player_name))
+        results = benchmark_encodings(tif_images, encodings)
+        for result in results:
+            print('{encoding:<34} {ratio:5.2f}x {bytes:>14,} bytes   encode {encode:7.2f}s   '
+                  'decode {decode:7.2f}s'.format(**result))
+        with open('/tmp/' + player + '_benchmark.json', 'w') as f:
+            json.dump(results, f, indent=1)
+        return
+
     # Define Color Card
     if card:
         color_cards = glob(f'{GlobalDirs.projects}/{game}/Source_Pixelgun/Color_Correction/{card}/*')
@@ -276,12 +1967,27 @@ def main(game, team, player, directory, card):
     print(Fore.BLUE + "Player:\t\t{}".format(player_name))
     print('\n')
 
-    # Copy XMP function
-    q.put(1, copy_xmp(path, player, color_cards, True))
-    # Convert Camera RAW to TIFF
-    q.put(2, convert_to_tiff(path, player, pose=directory))
-    # Remove XMP function
-    q.put(3, copy_xmp(path, player, color_cards, False))
+    scheduler = None
+    if farm:
+        scheduler = FarmScheduler(converter, port=port, root=root, local_workers=local_workers)
+        print(Fore.BLUE + "Farm:\t\tpxconvert --worker {}".format(scheduler.url))
+
+    try:
+        # Copy XMP function
+        q.put(1, copy_xmp(path, player, color_cards, True, mode=xmp_mode))
+        # Convert Camera RAW to TIFF
+        q.put(2, convert_to_tiff(path, player, backend=converter, workers=workers,
+                                 xmps=color_cards, force=force, retries=retries, scheduler=scheduler,
+                                 pose=directory))
+        # Remove XMP function
+        q.put(3, copy_xmp(path, player, color_cards, False, mode=xmp_mode))
+    finally:
+        converter.close()
+        if scheduler is not None:
+            for name, stats in sorted(scheduler.stats.items()):
+                print(Fore.LIGHTBLACK_EX + '{}: {images} images in {batches} batches, '
+                                           '{failed} failed, {lost} lost'.format(name, **stats))
+            scheduler.close()
 
     while not q.empty():
         q.get()
@@ -8,23 +8,30 @@ and fixes the naming (simplify) in the process
 import os
 import re
 import sys
+import json
+import datetime
 import glob
 import time
 import shlex
-import errno
 import shutil
+import hashlib
+import sqlite3
+import ctypes
+import fcntl
 import colorama  # https://pypi.org/project/colorama/
 import platform
+import threading
 import subprocess
 import multiprocessing as mp
 
 from pathlib import Path
-from multiprocessing import Pool
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from multiprocessing.pool import ThreadPool
 from tqdm import tqdm
 from queue import PriorityQueue
-from click import argument, command
+from click import argument, command, option, Choice
 from colorama import Fore, Style
-from dateutil.parser import *  # python-dateutil
 
 __author__ = "Stephan Osterburg"
 __copyright__ = "Copyright 2020, Pixelgun Studio"
@@ -59,6 +66,18 @@ class ValidationError(ValueError):
     pass
 
 
+class ChecksumError(IOError):
+    pass
+
+
+class RenameCollisionError(ValueError):
+    pass
+
+
+class TakeCollisionError(ValueError):
+    pass
+
+
 class GlobalDirs:
     """Global default directories"""
 
@@ -114,43 +133,305 @@ class GlobalDirs:
                 'px14': '10.0.53.114'}
 
 
-def is_date(directory, fuzzy=False):
+# Camera RAW and JPEG images get a checksum while they are copied
+RAW_SUFFIXES = ('.cr2', '.jpg')
+# Large buffers keep the NAS busy with few round trips
+COPY_BUFFER = 8 * 1024 * 1024
+
+
+class ByteBudget:
+    """Cap the number of bytes being moved at the same time across all ingest workers"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        # Bytes which were really copied and the wall clock time any copy was running, renames don't count
+        self.copied = 0
+        self.copy_seconds = 0.0
+        self._copies = 0
+        self._copy_start = None
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """Block until `size` bytes fit into the budget
+
+        A take bigger than the whole budget is let through once nothing else is in flight.
+        """
+        with self._cond:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self._cond.wait()
+            self.in_flight += size
+
+    def release(self, size):
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, size):
+        self.acquire(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    @contextmanager
+    def copying(self, size):
+        """Account a copy of `size` bytes, copies running at the same time count their time once"""
+        with self._cond:
+            if not self._copies:
+                self._copy_start = time.monotonic()
+            self._copies += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._copies -= 1
+                self.copied += size
+                if not self._copies:
+                    self.copy_seconds += time.monotonic() - self._copy_start
+
+
+class IngestJournal:
+    """Append-only journal of every move and rename of a shoot
+
+    Each line records one step ('move' or 'rename') of a take together with its state ('planned' or 'done').
+    The journal lives in the dated _incoming folder, so rerunning pxingest on the same shoot picks up
+    exactly where the previous run stopped.
+    """
+
+    filename = '.pxingest_journal'
+
+    def __init__(self, path):
+        self.path = os.path.join(path, self.filename)
+        self.takes = {}
+        self._lock = threading.Lock()
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash can leave a truncated last line behind
+                        continue
+                    self._apply(entry)
+
+    def _apply(self, entry):
+        take = self.takes.setdefault(entry['take'], {})
+        take[entry['step']] = entry['state']
+        for key in ('player', 'target'):
+            if key in entry:
+                take[key] = entry[key]
+
+    def record(self, take, step, state, **info):
+        """
+        Write a step of a take to disk before returning
+
+        Args:
+            take: take name in _incoming
+            step: 'move' or 'rename'
+            state: 'planned' or 'done'
+            info: additional fields, i.e. player and target
+
+        Returns: None
+        """
+        entry = dict(take=take, step=step, state=state, time=time.time(), **info)
+        with self._lock:
+            with open(self.path, 'a') as journal:
+                journal.write(json.dumps(entry) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._apply(entry)
+
+    def state(self, take, step):
+        with self._lock:
+            return self.takes.get(take, {}).get(step)
+
+    def is_done(self, take, step):
+        return self.state(take, step) == 'done'
+
+    def pending(self):
+        """Return a dictionary of player and takes which were moved but never finished"""
+        players = {}
+        with self._lock:
+            for take, steps in self.takes.items():
+                if steps.get('move') == 'done' and steps.get('rename') != 'done':
+                    players.setdefault(steps['player'], []).append(take)
+
+        return players
+
+
+# Shoot dates, i.e. 12_10_2019 or 12-10-2019
+DATE_PATTERN = re.compile(r'^(\d{1,2})[-_](\d{1,2})[-_](\d{4})$')
+
+
+# Take names: <date or index>_<first>_<last>_<pose>_<take>
+# i.e. 01_12_2020_jefferson_amile_yell_angry_tk2 (project) or 4_carbonel_ray_neutral_tk3 (_incoming)
+TAKE_PATTERN = re.compile(r'^(?:(?P<date>\d{2}_\d{2}_\d{4})|(?P<index>\d+))_'
+                          r'(?P<player>[^_]+_[^_]+)_(?P<pose>.+)_(?P<take>[^_]+)$')
+
+
+class TakeName:
+    """Parsed take name"""
+
+    __slots__ = ('name', 'date', 'index', 'player', 'pose', 'take')
+
+    def __init__(self, name, date, index, player, pose, take):
+        self.name = name
+        self.date = date
+        self.index = index
+        self.player = player
+        self.pose = pose
+        self.take = take
+
+    @property
+    def prefix(self):
+        """Date and player, i.e. 01_12_2020_jefferson_amile"""
+        return '%s_%s' % (self.date or self.index, self.player)
+
+    @property
+    def base(self):
+        """Take name without the take number, i.e. 01_12_2020_jefferson_amile_yell_angry"""
+        return '%s_%s' % (self.prefix, self.pose)
+
+    def __repr__(self):
+        return 'TakeName(%r)' % self.name
+
+
+@lru_cache(maxsize=4096)
+def _parse_take_name(name):
+    match = TAKE_PATTERN.match(name)
+    if match is None:
+        return None
+
+    return TakeName(name, **match.groupdict())
+
+
+def parse_take(path):
+    """Parse the take name of a path (memoized), None if it isn't a take"""
+    return _parse_take_name(os.path.basename(path.rstrip('/')))
+
+
+def is_date(directory):
     """
-    Return True or False if the string can be interpreted as a date.
+    Return True or False if the string is a valid date, month or day first
 
     Args:
-        directory: str, string to check for date
-        fuzzy: bool, ignore unknown tokens in string if True
+        directory: str, string to check for date, i.e. 12-10-2019
 
     Returns: True or False
     """
-    try:
-        parse(directory, fuzzy=fuzzy)
-        return True
-    except ValueError:
+    match = DATE_PATTERN.match(directory)
+    if match is None:
         return False
 
+    a, b, year = map(int, match.groups())
+    for month, day in ((a, b), (b, a)):
+        try:
+            datetime.date(year, month, day)
+            return True
+        except ValueError:
+            pass
+
+    return False
+
+
+def camera_name(filename):
+    """
+    Return the simplified camera name of an image, i.e. A000_POLO_0123.CR2 -> A000_POLO.CR2
+
+    Args:
+        filename: file name of an image
+
+    Returns: simplified file name
+    """
+    name, suffix = os.path.splitext(filename)
+    name = "_".join(name.split("_", 2)[:2])  # grep base name
+
+    return name + suffix
+
+
+def plan_renames(filenames):
+    """
+    Build the complete old -> new mapping of a take before anything is touched
+
+    Names are compared case insensitive since Bigfoot is mounted via SMB.
+
+    Args:
+        filenames: all file names of a take
+
+    Returns:
+        plan: list of (old, new) tuples, files which already have the right name are left out
+
+    Raises:
+        RenameCollisionError: if two files would end up with the same name
+    """
+    plan = []
+    claimed = {}
+
+    # Files which keep their name claim it first
+    for filename in filenames:
+        if camera_name(filename) == filename:
+            claimed[filename.casefold()] = filename
+
+    for filename in filenames:
+        dst = camera_name(filename)
+        if dst == filename:
+            continue
+
+        key = dst.casefold()
+        if key in claimed:
+            raise RenameCollisionError("{} and {} would both be renamed to {}".format(claimed[key], filename, dst))
+
+        claimed[key] = filename
+        plan.append((filename, dst))
+
+    return plan
+
+
+def apply_renames(directory, plan):
+    """
+    Apply a rename plan in one pass over an open directory handle
+
+    Args:
+        directory: take directory
+        plan: list of (old, new) tuples from plan_renames
+
+    Returns: None
+    """
+    if not plan:
+        return
+
+    if os.rename in os.supports_dir_fd:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            for src, dst in plan:
+                os.rename(src, dst, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+    else:
+        for src, dst in plan:
+            os.rename(directory + '/' + src, directory + '/' + dst)
+
 
 def clean_cameras(directory):
     """
     Rename given file names
     Args:
-        directory: base directory with all pose directories
+        directory: take directory with all camera images
 
-    Returns: None
+    Returns:
+        plan: list of (old, new) tuples which got renamed
     """
+    with os.scandir(directory) as entries:
+        filenames = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
 
-    for _, _, filenames in os.walk(directory):
-        for filename in filenames:
-            name, suffix = os.path.splitext(filename)
-            name = "_".join(name.split("_", 2)[:2])  # grep base name
-            dst = name + suffix
+    # A bad plan is rejected before a single file is touched
+    plan = plan_renames(filenames)
+    apply_renames(directory, plan)
 
-            try:
-                # rename filename
-                os.rename(directory + '/' + filename, directory + '/' + dst)
-            except ValueError:
-                print(Fore.RED + "Couldn't rename {}".format(filename))
+    return plan
 
 
 def get_user_input(prompt, cast=str, cond=(lambda x: True), onerror=None):
@@ -184,7 +465,594 @@ def get_user_input(prompt, cast=str, cond=(lambda x: True), onerror=None):
             print(onerror[type(e)])
 
 
-def ingest_player(player, team_dir, player_dict, path, date_stamp):
+def take_size(directory):
+    """
+    Return the number of bytes of all files in a take
+
+    Args:
+        directory: take directory
+
+    Returns: size in bytes
+    """
+    size = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+            elif entry.is_dir(follow_symlinks=False):
+                size += take_size(entry.path)
+
+    return size
+
+
+def file_checksum(filename):
+    """
+    Return the checksum of a file
+
+    Args:
+        filename: file to read
+
+    Returns: hex digest
+    """
+    digest = hashlib.blake2b()
+    buffer = bytearray(COPY_BUFFER)
+    view = memoryview(buffer)
+    with open(filename, 'rb') as src:
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+
+    return digest.hexdigest()
+
+
+def copy_file(src, dst, checksum=False):
+    """
+    Copy a file and optionally compute the checksum of the data on the way through
+
+    Without a checksum the copy is left to shutil, which uses the kernel (sendfile/fcopyfile) where available.
+    With a checksum every block is hashed and written in the same pass, so the source is only read once.
+
+    Args:
+        src: source file
+        dst: destination file
+        checksum: compute a checksum of the copied data
+
+    Returns: hex digest or None
+    """
+    if not checksum:
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+        return None
+
+    digest = hashlib.blake2b()
+    buffer = bytearray(COPY_BUFFER)
+    view = memoryview(buffer)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            fdst.write(view[:n])
+
+        fdst.flush()
+        os.fsync(fdst.fileno())
+        # Drop the written pages so the verify pass reads back from the NAS and not from our cache
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    shutil.copystat(src, dst)
+
+    return digest.hexdigest()
+
+
+def prefix_checksum(filename, size=64 * 1024):
+    """
+    Return the checksum of the first bytes of a file, a cheap precheck before hashing all of it
+
+    Args:
+        filename: file to read
+        size: number of bytes to read
+
+    Returns: hex digest
+    """
+    with open(filename, 'rb') as src:
+        return hashlib.blake2b(src.read(size)).hexdigest()
+
+
+class HashIndex:
+    """Persistent index of every ingested CR2/JPG of a project
+
+    Rows are keyed by path and carry the size of the image. The prefix and full checksum are filled in
+    lazily, only when another image of the same size shows up, so indexing a take costs a single scandir.
+    """
+
+    def __init__(self, filename, link=True):
+        Path(os.path.dirname(filename)).mkdir(parents=True, exist_ok=True)
+        self.link = link
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS files '
+                             '(path TEXT PRIMARY KEY, size INTEGER, prefix TEXT, digest TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS files_size ON files (size)')
+
+    @classmethod
+    def for_project(cls, job, link=True):
+        return cls('%s/%s/Source_Pixelgun/Settings/ingest_index.sqlite' % (GlobalDirs.projects, job), link=link)
+
+    def _update(self, path, column, value):
+        with self._lock, self._db:
+            self._db.execute('UPDATE files SET %s = ? WHERE path = ?' % column, (value, path))
+
+    def _forget(self, path):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def lookup(self, filename):
+        """
+        Find an already ingested copy of an image
+
+        Args:
+            filename: image to check
+
+        Returns: path of the ingested copy or None
+        """
+        size = os.path.getsize(filename)
+        with self._lock:
+            rows = self._db.execute('SELECT path, prefix, digest FROM files WHERE size = ?', (size,)).fetchall()
+        if not rows:
+            return None
+
+        prefix = prefix_checksum(filename)
+        digest = None
+        for path, row_prefix, row_digest in rows:
+            if path == filename:
+                continue
+
+            try:
+                if row_prefix is None:
+                    row_prefix = prefix_checksum(path)
+                    self._update(path, 'prefix', row_prefix)
+                if row_prefix != prefix:
+                    continue
+
+                if digest is None:
+                    digest = file_checksum(filename)
+                if row_digest is None:
+                    row_digest = file_checksum(path)
+                    self._update(path, 'digest', row_digest)
+            except FileNotFoundError:
+                self._forget(path)
+                continue
+
+            if row_digest == digest:
+                return path
+
+        return None
+
+    def add_take(self, directory, checksums=None):
+        """
+        Add all images of a take to the index
+
+        Args:
+            directory: take directory in _acquisition
+            checksums: optional dictionary of file name and already known checksum
+
+        Returns: None
+        """
+        checksums = checksums or {}
+        rows = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in RAW_SUFFIXES:
+                    rows.append((entry.path, entry.stat().st_size, None, checksums.get(entry.name)))
+
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def link_duplicate(existing, dst):
+    """
+    Hardlink an already ingested image instead of storing it again
+
+    Args:
+        existing: ingested copy of the image
+        dst: new location
+
+    Returns: True if linked, False if the filesystem doesn't support it
+    """
+    try:
+        os.link(existing, dst)
+    except OSError:
+        return False
+
+    return True
+
+
+def dedupe_take(directory, index):
+    """
+    Replace or drop images of an already moved take which are known to the index
+
+    Args:
+        directory: take directory in _acquisition
+        index: HashIndex of the project
+
+    Returns:
+        duplicates: number of duplicated images
+    """
+    duplicates = 0
+    with os.scandir(directory) as entries:
+        images = [entry.path for entry in entries
+                  if entry.is_file() and os.path.splitext(entry.name)[1].lower() in RAW_SUFFIXES]
+
+    for image in images:
+        existing = index.lookup(image)
+        if existing is None:
+            continue
+
+        if index.link:
+            tmp = image + '.pxlink'
+            if not link_duplicate(existing, tmp):
+                continue
+            os.replace(tmp, image)
+        else:
+            os.remove(image)
+        duplicates += 1
+
+    return duplicates
+
+
+def same_device(source, target):
+    """
+    Check if a take moves with a rename, the target or its closest existing parent is on the source's device
+
+    Args:
+        source: take directory in _incoming
+        target: take directory in _acquisition, see take_target
+
+    Returns: True for a rename, False for a copy
+    """
+    parent = os.path.dirname(target)
+    while not os.path.exists(parent) and os.path.dirname(parent) != parent:
+        parent = os.path.dirname(parent)
+
+    return os.stat(source).st_dev == os.stat(parent).st_dev
+
+
+def move_take(source, target, index=None, budget=None):
+    """
+    Move a take directory into the pipeline
+
+    On the same device this is a plain rename. Across devices every file is copied, CR2/JPG images
+    are verified against the checksum taken while copying and the source is removed only
+    once everything has arrived intact. Files which already exist in the target are simply
+    copied again, so an interrupted move can be rerun.
+
+    With an index, images which were already ingested are hardlinked (or skipped) instead of stored again.
+    With a budget, the copied bytes and the time spent copying them are added to it.
+
+    Args:
+        source: take directory in _incoming
+        target: take directory in _acquisition
+        index: optional HashIndex of the project
+        budget: optional ByteBudget which measures the copies
+
+    Returns:
+        checksums: dictionary of target file and checksum of all verified images
+    """
+    checksums = {}
+    rename = same_device(source, target)
+
+    if rename and not os.path.exists(target):
+        os.rename(source, target)
+        if index is not None:
+            duplicates = dedupe_take(target, index)
+            if duplicates:
+                print(Fore.LIGHTBLACK_EX + '\t\t{} duplicated images'.format(duplicates))
+        return checksums
+
+    duplicates = 0
+    for root, dirs, filenames in os.walk(source):
+        target_root = os.path.normpath(os.path.join(target, os.path.relpath(root, source)))
+        Path(target_root).mkdir(parents=True, exist_ok=True)
+
+        for filename in filenames:
+            src = os.path.join(root, filename)
+            dst = os.path.join(target_root, filename)
+            is_image = os.path.splitext(filename)[1].lower() in RAW_SUFFIXES
+
+            if is_image and index is not None:
+                existing = index.lookup(src)
+                if existing is not None and (not index.link or link_duplicate(existing, dst)):
+                    duplicates += 1
+                    continue
+
+            if rename:
+                os.replace(src, dst)
+                continue
+
+            with budget.copying(os.path.getsize(src)) if budget is not None else nullcontext():
+                if is_image:
+                    digest = copy_file(src, dst, checksum=True)
+                    if file_checksum(dst) != digest:
+                        raise ChecksumError('Checksum mismatch: {}'.format(dst))
+                    checksums[dst] = digest
+                else:
+                    copy_file(src, dst)
+                    if os.path.getsize(dst) != os.path.getsize(src):
+                        raise ChecksumError('Size mismatch: {}'.format(dst))
+
+    if duplicates:
+        print(Fore.LIGHTBLACK_EX + '\t\t{} duplicated images'.format(duplicates))
+
+    # Everything arrived, now it is safe to remove the source
+    shutil.rmtree(source)
+
+    return checksums
+
+
+def take_target(player_dir, take, date_stamp):
+    """
+    Take directory in _acquisition: 4_carbonel_ray_neutral_tk3 -> 12_10_2019_carbonel_ray_neutral_tk3
+
+    Args:
+        player_dir: player directory in the project
+        take: take name in _incoming
+        date_stamp: date of the shoot, i.e. 12_10_2019
+
+    Returns: target directory
+    """
+    parsed = parse_take(take)
+
+    return '%s/_acquisition/%s' % (player_dir, '_'.join((date_stamp, parsed.player, parsed.pose, parsed.take)))
+
+
+def target_collision(take, target, journal, claimed):
+    """
+    Check if a take can be moved into its target without merging it into another take
+
+    Args:
+        take: take name in _incoming
+        target: take directory in _acquisition, see take_target
+        journal: IngestJournal of the shoot
+        claimed: dictionary of target and take of the takes checked so far, gets updated
+
+    Returns: the reason it can't, None if it can
+    """
+    if target in claimed:
+        return '{} and {} would both be moved to {}'.format(claimed[target], take, os.path.basename(target))
+    claimed[target] = take
+
+    # Moved already, or an interrupted move of this take which gets resumed
+    if journal.is_done(take, 'move') or journal.state(take, 'move') == 'planned':
+        return None
+    if os.path.exists(target):
+        return '{} already exists'.format(target)
+
+    return None
+
+
+def ingest_take(take, player, player_dir, path, date_stamp, journal, budget, index=None):
+    """
+    Move a single take into _acquisition and clean up its naming
+
+    Steps which are already done according to the journal are skipped.
+
+    Args:
+        take: take name in _incoming, i.e. 4_carbonel_ray_neutral_tk3
+        player: player name
+        player_dir: player directory in the project
+        path: dated _incoming folder
+        date_stamp: date of the shoot, i.e. 12_10_2019
+        journal: IngestJournal of the shoot
+        budget: ByteBudget shared by all ingest workers
+        index: optional HashIndex of the project
+
+    Returns: None
+    """
+    source = '%s/%s' % (path, take)
+    target = take_target(player_dir, take, date_stamp)
+    target_take = os.path.basename(target)
+
+    if journal.is_done(take, 'rename'):
+        print(Fore.LIGHTBLACK_EX + '\t%s (done)' % target_take)
+        return
+
+    print(Fore.YELLOW + '\t%s' % target_take)
+
+    checksums = {}
+    if not journal.is_done(take, 'move'):
+        if not os.path.isdir(source) and os.path.isdir(target):
+            # The move finished but the run died before the journal was written
+            journal.record(take, 'move', 'done', player=player, target=target)
+        else:
+            # Only a move of this very take gets resumed, anything else in the target would be overwritten
+            if os.path.exists(target) and journal.state(take, 'move') != 'planned':
+                raise TakeCollisionError('{} already exists, {} would be merged into it'.format(target, take))
+
+            # An interrupted move is simply run again, the source is only removed once everything arrived
+            journal.record(take, 'move', 'planned', player=player, target=target)
+            with budget.reserve(take_size(source)):
+                checksums = move_take(source, target, index=index, budget=budget)
+            journal.record(take, 'move', 'done', player=player, target=target)
+
+    # Renaming is idempotent, so a planned rename is simply run again
+    journal.record(take, 'rename', 'planned')
+    plan = clean_cameras(target)
+    if index is not None:
+        renamed = dict(plan)
+        index.add_take(target, {renamed.get(os.path.basename(k), os.path.basename(k)): v
+                                for k, v in checksums.items()})
+    journal.record(take, 'rename', 'done', renamed=len(plan))
+
+
+# Linux ioctl to share the data blocks of two files (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Manifests of the template trees, keyed by template path
+_template_manifests = {}
+
+
+def template_manifest(template):
+    """
+    Return the directories and files of a template, cached until any directory of the template changes
+
+    Adding, removing or renaming an entry only touches the mtime of its own directory, so every
+    directory of the cached manifest is checked, not just the template root.
+
+    Args:
+        template: template directory
+
+    Returns:
+        manifest: tuple of (relative directories, relative files)
+    """
+    cached = _template_manifests.get(template)
+    if cached is not None:
+        try:
+            mtime = max(os.stat(os.path.join(template, d)).st_mtime for d in ('.',) + tuple(cached[1][0]))
+        except OSError:
+            # A cached directory is gone
+            mtime = None
+        if mtime == cached[0]:
+            return cached[1]
+
+    dirs, files = [], []
+    mtime = 0
+    for root, dirnames, filenames in os.walk(template):
+        mtime = max(mtime, os.stat(root).st_mtime)
+        rel = os.path.relpath(root, template)
+        dirs.extend(os.path.normpath(os.path.join(rel, d)) for d in dirnames)
+        files.extend(os.path.normpath(os.path.join(rel, f)) for f in filenames)
+
+    manifest = (sorted(dirs), files)
+    _template_manifests[template] = (mtime, manifest)
+
+    return manifest
+
+
+# Whether reflinks work on a device, probed with the first file cloned onto it
+_reflink_devices = {}
+
+
+def reflink_supported(src, dst):
+    """
+    Clone the first file onto the device of dst and remember if it worked, i.e. never on SMB shares
+
+    Args:
+        src: source file
+        dst: destination file
+
+    Returns: True if dst got cloned or reflinks work on its device, False if dst has to be copied
+    """
+    device = os.stat(os.path.dirname(dst)).st_dev
+    supported = _reflink_devices.get(device)
+    if supported is None:
+        supported = _reflink_devices[device] = reflink(src, dst)
+        return supported
+
+    return supported and reflink(src, dst)
+
+
+def reflink(src, dst):
+    """
+    Clone a file without copying its data, if the filesystem supports it
+
+    Args:
+        src: source file
+        dst: destination file
+
+    Returns: True if cloned, False otherwise
+    """
+    if platform.system() == 'Darwin':
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            return libc.clonefile(src.encode(), dst.encode(), 0) == 0
+        except (OSError, AttributeError):
+            return False
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+    return True
+
+
+def materialize_template(dst, template=None, subdirs=(), link='reflink'):
+    """
+    Create a copy of the template tree, linking its files instead of copying them where possible
+
+    All directories are created first in one pass, then every file is cloned ('reflink') or
+    hardlinked ('hardlink') and only copied if the filesystem can't do either. Whether a device
+    can clone is probed once, on the SMB shares every file is copied right away. Hardlinks share
+    the file with the template, so they should only be used for templates nobody edits in place.
+
+    Args:
+        dst: directory to create
+        template: template directory, defaults to GlobalDirs.template
+        subdirs: additional directories to create
+        link: 'reflink', 'hardlink' or 'copy'
+
+    Returns: None
+    """
+    template = template or GlobalDirs.template
+    if os.path.isfile(template):
+        shutil.copy(template, dst)
+        return
+
+    dirs, files = template_manifest(template)
+
+    os.makedirs(dst, exist_ok=True)
+    for d in list(dirs) + list(subdirs):
+        os.makedirs(os.path.join(dst, d), exist_ok=True)
+
+    for f in files:
+        src_file, dst_file = os.path.join(template, f), os.path.join(dst, f)
+        if os.path.exists(dst_file):
+            continue
+        if link == 'reflink' and reflink_supported(src_file, dst_file):
+            continue
+        if link == 'hardlink' and link_duplicate(src_file, dst_file):
+            continue
+        shutil.copy2(src_file, dst_file)
+
+
+def make_player_dir(team_dir, player, link='reflink'):
+    """
+    Create the player directory from the template if it doesn't exist yet
+
+    Args:
+        team_dir: team directory in the project
+        player: player name
+        link: how to create the template files, 'reflink', 'hardlink' or 'copy'
+
+    Returns:
+        player_dir: player directory
+    """
+    subdirs = ['Agisoft', 'Mudbox', 'Wrap', '_deliverables', '_settings',
+               'Maya', 'Photoshop', '_acquisition', '_scratch', '_staging']
+
+    player_dir = '%s/%s' % (team_dir, player)
+
+    if not os.path.isdir(player_dir):
+        # Template and default sub-directories in one go
+        materialize_template(player_dir, subdirs=subdirs, link=link)
+
+    return player_dir
+
+
+def ingest_player(player, team_dir, player_dict, path, date_stamp, budget=None, journal=None, index=None,
+                  template_link='reflink'):
     """Main ingest call
 
     Args:
@@ -193,46 +1061,303 @@ def ingest_player(player, team_dir, player_dict, path, date_stamp):
         player_dict: dictionary of all player and the taken poses
         path: where the project is located
         date_stamp:
+        budget: optional ByteBudget shared by all ingest workers
+        journal: optional IngestJournal of the shoot
+        index: optional HashIndex of the project
+        template_link: how to create the template files, 'reflink', 'hardlink' or 'copy'
 
     Returns: None
 
     """
-    subdirs = ['Agisoft', 'Mudbox', 'Wrap', '_deliverables', '_settings',
-               'Maya', 'Photoshop', '_acquisition', '_scratch', '_staging']
+    player_dir = make_player_dir(team_dir, player, link=template_link)
 
-    player_dir = '%s/%s' % (team_dir, player)
+    if budget is None:
+        budget = ByteBudget(0)
+    if journal is None:
+        journal = IngestJournal(path)
 
-    if not os.path.isdir(player_dir):
-        # shutil.copytree(GlobalDirs.template, player_dir)
+    for take in player_dict[player]:
+        # moving the data has to finish first before we clean up the naming
+        ingest_take(take, player, player_dir, path, date_stamp, journal, budget, index=index)
+
+
+def ingest_players(players, team_dir, player_dict, path, date_stamp, workers=1, max_inflight=2048, index=None,
+                   template_link='reflink'):
+    """Ingest several players at once
+
+    Moving data is I/O bound, so the players are handed to a pool of threads which all share
+    one ByteBudget. That way we keep the NAS link busy without flooding it with every take at once.
+
+    Args:
+        players: list of player names to ingest
+        team_dir: team name
+        player_dict: dictionary of all player and the taken poses
+        path: where the project is located
+        date_stamp: date of the shoot, i.e. 12_10_2019
+        workers: number of players to ingest in parallel
+        max_inflight: maximum of MB being moved at the same time
+        index: optional HashIndex of the project
+        template_link: how to create the template files, 'reflink', 'hardlink' or 'copy'
+
+    Returns:
+        failures: dictionary of player name and the error which stopped the ingest
+    """
+    budget = ByteBudget(max_inflight * 1024 * 1024)
+    journal = IngestJournal(path)
+    failures = {}
+
+    def _ingest(player):
+        try:
+            ingest_player(player, team_dir, player_dict, path, date_stamp,
+                          budget=budget, journal=journal, index=index, template_link=template_link)
+        except Exception as exc:
+            return player, exc
+
+        return player, None
+
+    start_time = time.time()
+    pool = ThreadPool(processes=max(1, min(workers, len(players))))
+    for player, exc in pool.imap_unordered(_ingest, players):
+        if exc is None:
+            print(Fore.GREEN + 'Ingested {}'.format(player))
+        else:
+            print(Fore.RED + 'Failed to ingest {}: {}'.format(player, exc))
+            failures[player] = exc
+    pool.close()
+    pool.join()
+
+    elapsed = time.time() - start_time
+    # Same device moves are renames, only what was copied says something about the NAS
+    record_throughput(budget.copied, budget.copy_seconds)
+    t = int(elapsed / 60)
+    print(Fore.LIGHTYELLOW_EX + 'Ingest took: {} min'.format(t))
+
+    if failures:
+        print(Fore.RED + '{} of {} players failed:'.format(len(failures), len(players)))
+        for player, exc in failures.items():
+            print(Fore.RED + '\t{}: {}'.format(player, exc))
+
+    return failures
+
+
+def throughput_file():
+    """Return the file with the measured throughput of the recent ingests, shared by all machines"""
+    return os.path.join(GlobalDirs.incoming, '.pxingest_throughput.json')
+
+
+def record_throughput(nbytes, seconds, keep=20):
+    """
+    Remember how fast an ingest moved its data, used to estimate the next ones
+
+    Args:
+        nbytes: number of bytes copied
+        seconds: wall clock time spent copying them
+        keep: number of runs to remember
+
+    Returns: None
+    """
+    if nbytes <= 0 or seconds <= 0:
+        return
+
+    runs = load_throughput()
+    runs.append({'time': time.time(), 'bytes': nbytes, 'seconds': seconds})
+    try:
+        with open(throughput_file(), 'w') as f:
+            json.dump(runs[-keep:], f)
+    except OSError:
+        pass
+
+
+def load_throughput():
+    """Return the list of recent ingest runs"""
+    try:
+        with open(throughput_file(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def format_bytes(nbytes):
+    """Human readable size, i.e. 1.2 GB"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024:
+            return '%.1f %s' % (nbytes, unit)
+        nbytes /= 1024.0
+
+    return '%.1f TB' % nbytes
+
+
+def scan_shoot(path):
+    """
+    Scan a dated _incoming folder once
+
+    Args:
+        path: dated _incoming folder
+
+    Returns:
+        takes: dictionary of take name and list of (file path relative to the take, size), like move_take
+            files of subdirectories are included
+    """
+    takes = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_dir() or take_player(entry.name) is None:
+                continue
+            takes[entry.name] = files = []
+            for root, _, filenames in os.walk(entry.path):
+                rel = os.path.relpath(root, entry.path)
+                for filename in filenames:
+                    stat = os.lstat(os.path.join(root, filename))
+                    files.append((os.path.normpath(os.path.join(rel, filename)), stat.st_size))
+
+    return takes
+
+
+def plan_ingest(job, team, path):
+    """
+    Work out what an ingest would do without touching anything
+
+    Args:
+        job: project name
+        team: team name
+        path: dated _incoming folder
+
+    Returns:
+        plan: dictionary with the color card takes, players, takes and totals
+    """
+    date_stamp = os.path.basename(path)
+    team_dir = '%s/%s/Sections/%s' % (GlobalDirs.projects, job, team)
+    plan = {'team_dir': team_dir, 'color_card': [], 'players': {}, 'files': 0, 'bytes': 0, 'copy': 0}
+    journal = IngestJournal(path)
+    claimed = {}
+
+    for take, files in sorted(scan_shoot(path).items()):
+        player = take_player(take)
+        if player == 'color_card':
+            images = len([name for name, _ in files if 'AR008_POLO' in name])
+            plan['color_card'].append((take, images))
+            continue
+
+        target = take_target('%s/%s' % (team_dir, player), take, date_stamp)
         try:
-            shutil.copytree(GlobalDirs.template, player_dir)
-        except OSError as exc:  # python >2.5
-            if exc.errno == errno.ENOTDIR:
-                shutil.copy(GlobalDirs.template, player_dir)
+            # Only the files directly in the take get renamed, see clean_cameras
+            plan_renames([name for name, _ in files if os.sep not in name])
+            collision = None
+        except RenameCollisionError as exc:
+            collision = str(exc)
+
+        nbytes = sum(size for _, size in files)
+        # Same device moves are renames, only the copies take time
+        copy = not same_device('%s/%s' % (path, take), target)
+        plan['players'].setdefault(player, []).append({'take': take, 'target': target, 'files': len(files),
+                                                       'bytes': nbytes, 'copy': copy,
+                                                       'conflict': target_collision(take, target, journal, claimed),
+                                                       'collision': collision})
+        plan['files'] += len(files)
+        plan['bytes'] += nbytes
+        plan['copy'] += nbytes if copy else 0
+
+    runs = load_throughput()
+    seconds = sum(run['seconds'] for run in runs)
+    plan['rate'] = sum(run['bytes'] for run in runs) / seconds if seconds else None
+    plan['runs'] = len(runs)
+
+    return plan
+
+
+def print_plan(plan):
+    """Print the result of plan_ingest"""
+    print(Fore.BLUE + 'Destination:\t{}'.format(plan['team_dir']))
+
+    if not plan['color_card']:
+        print(Fore.YELLOW + 'Color Card:\tnot found')
+    for counter, (take, images) in enumerate(plan['color_card']):
+        picked = ' (picked)' if counter == 0 and len(plan['color_card']) == 1 else ''
+        print('Color Card:\t{} ({} of 2 images){}'.format(take, images, picked))
+
+    takes = 0
+    for player, entries in plan['players'].items():
+        nbytes = sum(entry['bytes'] for entry in entries)
+        print(Fore.YELLOW + '{} ({} takes, {})'.format(player, len(entries), format_bytes(nbytes)))
+        for entry in entries:
+            print('\t{} -> {}\t{} files\t{}{}'.format(entry['take'], os.path.basename(entry['target']),
+                                                    entry['files'], format_bytes(entry['bytes']),
+                                                    '' if entry['copy'] else '\t(rename)'))
+            if entry['conflict']:
+                print(Fore.RED + '\t\t{}'.format(entry['conflict']))
+            if entry['collision']:
+                print(Fore.RED + '\t\t{}'.format(entry['collision']))
+        takes += len(entries)
+
+    print('\n')
+    print(Fore.BLUE + 'Total:\t\t{} players, {} takes, {} files, {}, {} to copy'.format(
+        len(plan['players']), takes, plan['files'], format_bytes(plan['bytes']), format_bytes(plan['copy'])))
+    if not plan['copy']:
+        print(Fore.BLUE + 'Estimate:\tonly renames')
+    elif plan['rate']:
+        eta = int(plan['copy'] / plan['rate'])
+        print(Fore.BLUE + 'Estimate:\t{}:{:02d}:{:02d} at {}/s (last {} runs)'.format(
+            eta // 3600, eta % 3600 // 60, eta % 60, format_bytes(plan['rate']), plan['runs']))
+    else:
+        print(Fore.BLUE + 'Estimate:\tno recent runs to estimate from')
+
+
+def copy_color_card(job, color_card, date_stamp):
+    """
+    Copy the color card images of a shoot into the project
+
+    Args:
+        job: project name
+        color_card: color card take directory in _incoming
+        date_stamp: date of the shoot, i.e. 12_10_2019
+
+    Returns:
+        color_card_images: number of copied images
+    """
+    # move it to the right place
+    color_card_path = '%s/%s/Source_Pixelgun/Color Charts/%s' % (GlobalDirs.projects, job, date_stamp)
+    if not os.path.isdir(color_card_path):
+        Path(color_card_path).mkdir(parents=True, exist_ok=True)
+
+    # Find and copy color card
+    color_card_images = 0
+    filenames = os.listdir(color_card)
+    for filename in filenames:
+        if 'AR008_POLO' in filename:
+            name, suffix = filename.split('.')
+            filename = color_card + '/' + filename
+
+            # JPEG
+            if re.match(suffix, 'JPG', re.IGNORECASE):
+                shutil.copy(filename, '%s/px_color_card_%s.jpg' % (color_card_path, date_stamp))
+                color_card_images += 1
+            # CR2
+            elif re.match(suffix, 'CR2', re.IGNORECASE):
+                shutil.copy(filename, '%s/px_color_card_%s.cr2' % (color_card_path, date_stamp))
+                color_card_images += 1
             else:
-                raise
+                print(Fore.YELLOW + 'Color Card %s not found!' % color_card)
 
-        # Create default sub-directories
-        for d in subdirs:
-            subdir = player_dir + '/' + d
-            if not os.path.exists(subdir):
-                Path(subdir).mkdir(parents=True, exist_ok=True)
+    return color_card_images
 
-    for take in player_dict[player]:
-        source = '%s/%s' % (path, take)
-        target_take = '%s_%s' % (date_stamp, '_'.join(take.split('_')[1:]))
-        print(Fore.YELLOW + '\t%s' % target_take)
 
-        # put the next two steps into a PriorityQueue to make sure that moving the data
-        # has finished first before we clean up the naming
-        q.put(1, shutil.move(source, '%s/_acquisition/%s' % (player_dir, target_take)))
-        q.put(2, clean_cameras('%s/_acquisition/%s' % (player_dir, target_take)))
+def take_player(take):
+    """
+    Extract the player name of a take in _incoming: 4_carbonel_ray_neutral_tk3 -> carbonel_ray
+
+    Args:
+        take: take directory name
+
+    Returns: player name or None
+    """
+    parsed = parse_take(take)
+    if parsed is None:
+        return None
 
-        while not q.empty():
-            q.get()
+    return parsed.player
 
 
-def ingest_data(job, team, path, color_card):
+def ingest_data(job, team, path, color_card, workers=1, max_inflight=2048, dedup='link', template_link='reflink'):
     """
     Main process to get all data into the correct place and clean it at the same time
 
@@ -241,6 +1366,10 @@ def ingest_data(job, team, path, color_card):
         team: team name
         path: where the project is located
         color_card: color card to be used for image conversion
+        workers: number of players to ingest in parallel
+        max_inflight: maximum of MB being moved at the same time
+        dedup: 'link' or 'skip' images which were already ingested, 'off' to store everything
+        template_link: how to create the template files, 'reflink', 'hardlink' or 'copy'
 
     Returns: None
     """
@@ -261,19 +1390,24 @@ def ingest_data(job, team, path, color_card):
         if os.path.isdir(dir_path):
 
             # extract player name: 4_carbonel_ray_neutral_tk3 -> carbonel_ray
-            temp = directory.split('_')
-            if len(temp) >= 5:
-                player = '_'.join(temp[1: 3])
-
+            player = take_player(directory)
+            if player is not None:
                 if player not in player_dict:
                     player_dict[player] = []
 
                 player_dict[player].append(directory)
 
+    # Takes which got moved by an interrupted run but never finished are not in _incoming anymore
+    for player, takes in IngestJournal(path).pending().items():
+        for take in takes:
+            if take not in player_dict.setdefault(player, []):
+                player_dict[player].append(take)
+                print(Fore.YELLOW + 'Resuming {}'.format(take))
+
     # Create new project based on template
     team_dir = '%s/%s/Sections/%s' % (GlobalDirs.projects, job, team)
     if not os.path.isdir(team_dir):
-        shutil.copytree(GlobalDirs.template, team_dir)
+        materialize_template(team_dir, link=template_link)
 
     # Find a color card for the player
     if 'color_card' in player_dict:
@@ -294,31 +1428,7 @@ def ingest_data(job, team, path, color_card):
         else:
             print('Color Card: {}'.format(color_card))
 
-            # move it to the right place
-            color_card_path = '%s/%s/Source_Pixelgun/Color Charts/%s' % (GlobalDirs.projects, job, date_stamp)
-            if not os.path.isdir(color_card_path):
-                # os.mkdir(color_card_path)
-                Path(color_card_path).mkdir(parents=True, exist_ok=True)
-
-            # Find and copy color card
-            color_card_images = 0
-            filenames = os.listdir(color_card)
-            for filename in filenames:
-                if 'AR008_POLO' in filename:
-                    name, suffix = filename.split('.')
-                    filename = color_card + '/' + filename
-
-                    # JPEG
-                    if re.match(suffix, 'JPG', re.IGNORECASE):
-                        shutil.copy(filename, '%s/px_color_card_%s.jpg' % (color_card_path, date_stamp))
-                        color_card_images += 1
-                    # CR2
-                    elif re.match(suffix, 'CR2', re.IGNORECASE):
-                        shutil.copy(filename, '%s/px_color_card_%s.cr2' % (color_card_path, date_stamp))
-                        color_card_images += 1
-                    else:
-                        print(Fore.YELLOW + 'Color Card %s not found!' % color_card)
-
+            color_card_images = copy_color_card(job, color_card, date_stamp)
             if color_card_images < 2:
                 print(Fore.GREEN + 'Found %s of 2 Color Card images' % color_card_images)
                 user_input = get_user_input('Continue Anyways? [y/n] ', cond=lambda x: x in 'yn',
@@ -332,20 +1442,225 @@ def ingest_data(job, team, path, color_card):
     prompt = 'Do you want to ingest all players of the team at once? [y/n] '
     user_input = get_user_input(prompt, cond=lambda x: x in 'yn',
                                 onerror={ValidationError: "Must be either y or n", ValueError: "Not a letter"})
-    if user_input == 'y':
-        for player in player_dict:
-            if player != 'color_card':
-                ingest_player(player, team_dir, player_dict, path, date_stamp)
-    else:
-        for player in player_dict:
-            if player != 'color_card':
-                prompt = 'Ingest [' + Fore.YELLOW + player + Style.RESET_ALL + ']? [y/n] '
-                user_input = get_user_input(prompt, cond=lambda x: x in 'yn',
-                                            onerror={ValidationError: "Must be either y or n",
-                                                     ValueError: "Not a letter"})
+    players = [player for player in player_dict if player != 'color_card']
+    if user_input != 'y':
+        selected = []
+        for player in players:
+            prompt = 'Ingest [' + Fore.YELLOW + player + Style.RESET_ALL + ']? [y/n] '
+            user_input = get_user_input(prompt, cond=lambda x: x in 'yn',
+                                        onerror={ValidationError: "Must be either y or n",
+                                                 ValueError: "Not a letter"})
 
             if user_input == 'y':
-                ingest_player(player, team_dir, player_dict, path, date_stamp)
+                selected.append(player)
+        players = selected
+
+    # Refuse to merge a take into another one, see plan_ingest
+    journal = IngestJournal(path)
+    claimed = {}
+    conflicts = [target_collision(take, take_target('%s/%s' % (team_dir, player), take, date_stamp), journal, claimed)
+                 for player in players for take in player_dict[player]]
+    conflicts = [conflict for conflict in conflicts if conflict is not None]
+    if conflicts:
+        for conflict in conflicts:
+            print(Fore.RED + 'Error: {}'.format(conflict))
+        sys.exit(1)
+
+    # Ask all questions first, then let the workers move the data
+    index = None if dedup == 'off' else HashIndex.for_project(job, link=dedup == 'link')
+    failures = ingest_players(players, team_dir, player_dict, path, date_stamp,
+                              workers=workers, max_inflight=max_inflight, index=index, template_link=template_link)
+    if index is not None:
+        index.close()
+    if failures:
+        sys.exit(1)
+
+
+def load_watch_mapping(mapping_file):
+    """
+    Read the project/team mapping for the watch mode
+
+    The JSON file maps the date of a shoot to its project and team, the optional 'default' entry
+    is used for every other shoot, i.e.:
+        {"01_12_2020": {"project": "2K_1018_NBA2K21", "team": "det"},
+         "default": {"project": "2K_1018_NBA2K21", "team": "default"}}
+
+    Args:
+        mapping_file: path to the JSON file
+
+    Returns:
+        mapping: dictionary of shoot date and (project, team)
+    """
+    with open(mapping_file, 'r') as f:
+        data = json.load(f)
+
+    mapping = {}
+    for shoot, entry in data.items():
+        if 'project' not in entry:
+            raise ValidationError('No project defined for {}'.format(shoot))
+        mapping[shoot] = (entry['project'], entry.get('team', 'default'))
+
+    return mapping
+
+
+def take_signature(directory):
+    """
+    Return a cheap fingerprint of a take to tell if it is still being written
+
+    Args:
+        directory: take directory
+
+    Returns: tuple of number of files, total size and latest modification time
+    """
+    count, size, mtime = 0, 0, 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                count += 1
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+
+    return count, size, mtime
+
+
+class IncomingWatcher:
+    """Poll _incoming and ingest every take as soon as the trailer finished writing it
+
+    A take counts as complete once its signature (files, bytes, mtime) did not change for `settle` seconds.
+    Complete takes are handed to a pool of threads, so the transfer of the remaining takes and
+    the ingest overlap.
+    """
+
+    def __init__(self, mapping, interval=30, settle=120, workers=1, max_inflight=2048, dedup='link',
+                 template_link='reflink'):
+        self.mapping = mapping
+        self.dedup = dedup
+        self.template_link = template_link
+        self.indices = {}
+        self.interval = interval
+        self.settle = settle
+        self.budget = ByteBudget(max_inflight * 1024 * 1024)
+        self.pool = ThreadPool(processes=max(1, workers))
+        self.journals = {}
+        self.seen = {}
+        self.active = set()
+        self.failed = {}
+        # Target and take of every submitted take, so two takes never get moved into the same target
+        self.claimed = {}
+        self._lock = threading.Lock()
+        self._dir_lock = threading.Lock()
+
+    def shoots(self):
+        """Yield the path, date, project and team of every mapped shoot in _incoming"""
+        with os.scandir(GlobalDirs.incoming) as entries:
+            for entry in entries:
+                if not entry.is_dir() or not is_date(entry.name.replace('_', '-')):
+                    continue
+                job_team = self.mapping.get(entry.name, self.mapping.get('default'))
+                if job_team is not None:
+                    yield (entry.path, entry.name) + job_team
+
+    def poll(self):
+        """Check all takes once and submit the ones which stopped growing
+
+        Returns: number of submitted takes
+        """
+        now = time.time()
+        submitted = 0
+
+        for path, date_stamp, job, team in self.shoots():
+            if path not in self.journals:
+                self.journals[path] = IngestJournal(path)
+
+            with os.scandir(path) as entries:
+                takes = [entry.name for entry in entries if entry.is_dir()]
+
+            for take in takes:
+                player = take_player(take)
+                source = '%s/%s' % (path, take)
+                if player is None or source in self.active or self.journals[path].is_done(take, 'color_card'):
+                    continue
+
+                try:
+                    signature = take_signature(source)
+                except FileNotFoundError:
+                    continue
+
+                previous = self.seen.get(source)
+                if previous is None or previous[0] != signature:
+                    self.seen[source] = (signature, now)
+                    continue
+
+                if now - previous[1] < self.settle or self.failed.get(source) == signature:
+                    continue
+
+                target = None
+                with self._lock:
+                    if player != 'color_card':
+                        player_dir = '%s/%s/Sections/%s/%s' % (GlobalDirs.projects, job, team, player)
+                        target = take_target(player_dir, take, date_stamp)
+                        conflict = target_collision(take, target, self.journals[path], self.claimed)
+                        if conflict is not None:
+                            if self.claimed.get(target) == take:
+                                del self.claimed[target]
+                            print(Fore.RED + 'Not ingesting {}: {}'.format(take, conflict))
+                            # Only try again once the take changes
+                            self.failed[source] = signature
+                            continue
+                    self.active.add(source)
+                self.pool.apply_async(self.ingest, (source, take, player, path, date_stamp, job, team, signature,
+                                                    target))
+                submitted += 1
+
+        return submitted
+
+    def ingest(self, source, take, player, path, date_stamp, job, team, signature, target=None):
+        """Ingest a single complete take, called from the worker threads, target is the one claimed by poll"""
+        journal = self.journals[path]
+        try:
+            if player == 'color_card':
+                if not journal.is_done(take, 'color_card'):
+                    color_card_images = copy_color_card(job, source, date_stamp)
+                    print(Fore.GREEN + 'Color Card: {} ({} of 2 images)'.format(take, color_card_images))
+                    journal.record(take, 'color_card', 'done')
+            else:
+                team_dir = '%s/%s/Sections/%s' % (GlobalDirs.projects, job, team)
+                # Several takes of the same player may arrive at once
+                with self._dir_lock:
+                    if not os.path.isdir(team_dir):
+                        materialize_template(team_dir, link=self.template_link)
+                    player_dir = make_player_dir(team_dir, player, link=self.template_link)
+                    if self.dedup != 'off' and job not in self.indices:
+                        self.indices[job] = HashIndex.for_project(job, link=self.dedup == 'link')
+
+                ingest_take(take, player, player_dir, path, date_stamp, journal, self.budget,
+                            index=self.indices.get(job))
+            self.seen.pop(source, None)
+        except Exception as exc:
+            print(Fore.RED + 'Failed to ingest {}: {}'.format(take, exc))
+            # Only try again once the take changes
+            self.failed[source] = signature
+        finally:
+            with self._lock:
+                self.active.discard(source)
+                if target is not None and self.claimed.get(target) == take:
+                    del self.claimed[target]
+
+    def run(self):
+        """Poll forever, stop with Ctrl-C"""
+        print(Fore.BLUE + 'Watching {} every {}s'.format(GlobalDirs.incoming, self.interval))
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print(Fore.YELLOW + 'Waiting for running ingests...')
+        finally:
+            self.pool.close()
+            self.pool.join()
+            for index in self.indices.values():
+                index.close()
 
 
 def list_projects():
@@ -387,16 +1702,47 @@ def clear_screen():
 
 
 @command()
-@argument('directory')
-def main(directory):
+@argument('directory', required=False)
+@option('--workers', '-w', default=1, help='Number of players to ingest in parallel', type=int)
+@option('--max-inflight', '-m', default=2048, help='Maximum of MB being moved at the same time', type=int)
+@option('--watch', default=None, help='Watch _incoming, JSON file mapping shoot dates to project and team', type=str)
+@option('--interval', default=30, help='Seconds between two polls in watch mode', type=int)
+@option('--settle', default=120, help='Seconds a take has to stay unchanged in watch mode', type=int)
+@option('--dedup', default='link', help='Hardlink or skip images which were already ingested',
+        type=Choice(['link', 'skip', 'off']))
+@option('--template-link', default='reflink', help='How to create the files of the project template',
+        type=Choice(['reflink', 'hardlink', 'copy']))
+@option('--plan', is_flag=True, help='Only print what would be ingested, nothing gets moved')
+def main(directory, workers, max_inflight, watch, interval, settle, dedup, template_link, plan):
     """
     Getting incoming data from T2, gather all information's, like project, team and player name
     then fix naming and moving the data to a
 
     Args:
         directory: Directory Name, i.e.: 12_10_2019 or /Volumes/Bigfoot/_incoming/12_10_2019
+        workers: Number of players to ingest in parallel
+        max_inflight: Maximum of MB being moved at the same time
+        watch: JSON file mapping shoot dates to project and team, runs pxingest as a daemon
+        interval: Seconds between two polls in watch mode
+        settle: Seconds a take has to stay unchanged before it gets ingested in watch mode
+        dedup: Hardlink (link) or drop (skip) images which were already ingested, or store everything (off)
+        template_link: Clone (reflink), hardlink or copy the files of the template, reflinks fall back to copies
+            on filesystems without them, hardlinks share the files with the template
+        plan: Print the players, takes, sizes and estimated time of the ingest without moving anything
     """
 
+    if watch:
+        watcher = IncomingWatcher(load_watch_mapping(watch), interval=interval, settle=settle,
+                                  workers=workers, max_inflight=max_inflight, dedup=dedup,
+                                  template_link=template_link)
+        watcher.run()
+        colorama.deinit()
+        return
+
+    if directory is None:
+        print(Fore.RED + 'Error: Either a directory or --watch is required!')
+        sys.exit(1)
+
     # Call function to clear screen
     clear_screen()
 
@@ -434,8 +1780,14 @@ def main(directory):
     print(Fore.BLUE + "CCard:\t\t{}".format(directory + '_cc.xmp'))
     print('\n')
 
+    if plan:
+        print_plan(plan_ingest(project, team, path))
+        colorama.deinit()
+        return
+
     # Finally, working on the data
-    ingest_data(project, team, path, color_card)
+    ingest_data(project, team, path, color_card, workers=workers, max_inflight=max_inflight, dedup=dedup,
+                template_link=template_link)
 
     # Stop using colorama to restore 'stdout' and 'stderr' to their original values.
     colorama.deinit()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+"""
+Run ingest, conversion and proofs of a shoot as one pipeline
+
+Every take moves through the three stages on its own: it gets converted as soon as it is ingested
+and its proof gets rendered as soon as its three proof TIFFs exist. The stages are connected by
+bounded queues, a slow stage holds back the ones in front of it instead of piling up work.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import colorama  # https://pypi.org/project/colorama/
+import platform
+import subprocess
+
+from glob import glob
+from queue import Queue
+from click import command, option, Choice, UsageError
+from colorama import Fore
+
+# Import the other pixelgun tools, they live next to this one
+for tool in ('pxingest', 'pxconvert', 'pxproofs'):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), tool))
+
+import pxingest  # noqa: E402
+import pxconvert  # noqa: E402
+import pxproofs  # noqa: E402
+
+__author__ = "Stephan Osterburg"
+__copyright__ = "Copyright 2020, Pixelgun Studio"
+__credits__ = ["Stephan Osterburg", "Mauricio Baiocchi"]
+__license__ = "MIT"
+__version__ = "0.1.0"
+__maintainer__ = ""
+__email__ = "info@pixelgunstudio.com"
+__status__ = "Production"
+
+# Initialise Colorama
+colorama.init(autoreset=True)
+
+
+class GlobalDirs:
+    """Global default directories"""
+
+    def __init__(self):
+        pass
+
+    if platform.system() == 'Darwin':
+        incoming = '/Volumes/Bigfoot/_incoming/'
+        projects = '/Volumes/Bigfoot/Pixelgun_Projects'
+    elif platform.system() == 'Linux':
+        incoming = '/mnt/bigfoot/_incoming/'
+        projects = '/mnt/bigfoot/Pixelgun_Projects'
+
+
+class TakeStatus:
+    """Where a take is in the pipeline and how long it spent in every stage"""
+
+    __slots__ = ('take', 'player', 'target', 'times', 'error')
+
+    def __init__(self, take, player):
+        self.take = take
+        self.player = player
+        self.target = None
+        self.times = {'queued': time.time()}
+        self.error = None
+
+
+class Pipeline:
+    """Ingest, convert and proof the takes of a shoot, every take as soon as it is ready
+
+    The ingest stage runs a pool of threads sharing a ByteBudget, the conversion stage converts one take
+    per player at a time (the TIFF cache of a player is not shared), the proof stage renders several
+    takes at once. A player's PDF and CSV are created once all of its takes went through.
+    """
+
+    def __init__(self, job, team, path, xmps, backend, depth=8, ingest_workers=2, convert_workers=2,
+                 proof_workers=2, convert_threads=None, max_inflight=2048, dedup='link', renderer=None,
+                 template_link='reflink'):
+        """
+        :param job: project name
+        :param team: team name
+        :param path: dated _incoming folder
+        :param xmps: XMP color card file(s) used for the conversion
+        :param backend: ConverterBackend
+        :param depth: maximum of takes waiting in front of the conversion and the proof stage
+        :param ingest_workers: number of takes ingested at the same time
+        :param convert_workers: number of players converted at the same time, at most backend.max_workers
+        :param proof_workers: number of proofs rendered at the same time
+        :param convert_threads: parallel conversions of a take, None for what the backend allows
+        :param max_inflight: maximum of MB being moved at the same time
+        :param dedup: 'link' or 'skip' images which were already ingested, 'off' to store everything
+        :param renderer: pxproofs.ProofRenderer, the native compositor by default
+        :param template_link: how to create the template files, 'reflink', 'hardlink' or 'copy'
+        """
+        self.job = job
+        self.team = team
+        self.path = path
+        self.date_stamp = os.path.basename(path)
+        self.xmps = xmps
+        self.backend = backend
+        self.convert_threads = convert_threads
+        self.template_link = template_link
+        self.renderer = renderer or pxproofs.ProofCompositor()
+        self.team_dir = '%s/%s/Sections/%s' % (GlobalDirs.projects, job, team)
+
+        self.journal = pxingest.IngestJournal(path)
+        self.budget = pxingest.ByteBudget(max_inflight * 1024 * 1024)
+        self.index = None if dedup == 'off' else pxingest.HashIndex.for_project(job, link=dedup == 'link')
+
+        self.ingest_queue = Queue()
+        self.convert_queue = Queue(maxsize=depth)
+        self.proof_queue = Queue(maxsize=depth)
+        # Every player gets a scheduler of its own, so the players together must not exceed the backend,
+        # i.e. one Photoshop
+        if backend.max_workers is not None:
+            convert_workers = min(convert_workers, backend.max_workers)
+        self.workers = {'ingest': ingest_workers, 'convert': convert_workers, 'proof': proof_workers}
+
+        self.takes = []
+        self.remaining = {}
+        self.proofs = {}
+        self.conversion_failures = {}
+        self._lock = threading.Lock()
+        self._player_locks = {}
+
+    def scan(self):
+        """Queue all takes of the shoot, the color card gets copied right away
+
+        :return: number of queued takes
+        """
+        for take in sorted(pxingest.scan_shoot(self.path)):
+            player = pxingest.take_player(take)
+            if player == 'color_card':
+                if not self.journal.is_done(take, 'color_card'):
+                    pxingest.copy_color_card(self.job, '%s/%s' % (self.path, take), self.date_stamp)
+                    self.journal.record(take, 'color_card', 'done')
+                continue
+
+            self.takes.append(TakeStatus(take, player))
+
+        # Takes which got moved by an interrupted run but never finished are not in _incoming anymore
+        known = {status.take for status in self.takes}
+        for player, takes in self.journal.pending().items():
+            self.takes.extend(TakeStatus(take, player) for take in takes if take not in known)
+
+        # A take is never merged into the directory of another one
+        claimed = {}
+        queued = 0
+        for status in self.takes:
+            target = pxingest.take_target('%s/%s' % (self.team_dir, status.player), status.take, self.date_stamp)
+            conflict = pxingest.target_collision(status.take, target, self.journal, claimed)
+            if conflict is not None:
+                status.error = 'ingest: ' + conflict
+                print(Fore.RED + 'Skipping {}: {}'.format(status.take, conflict))
+                continue
+
+            self.remaining[status.player] = self.remaining.get(status.player, 0) + 1
+            self.ingest_queue.put(status)
+            queued += 1
+
+        return queued
+
+    def player_lock(self, player):
+        with self._lock:
+            return self._player_locks.setdefault(player, threading.Lock())
+
+    def _stage(self, name, queue, work, output):
+        # Every stage takes its input until it finds the end marker
+        while True:
+            status = queue.get()
+            if status is None:
+                return
+
+            try:
+                status.times['start_' + name] = time.time()
+                ready = work(status)
+                status.times[name] = time.time()
+            except Exception as exc:
+                status.error = '{}: {}'.format(name, exc)
+                ready = False
+                print(Fore.RED + 'Failed to {} {}: {}'.format(name, status.take, exc))
+
+            if ready and output is not None:
+                # Blocks while the next stage is busy
+                output.put(status)
+            else:
+                self.finish(status)
+
+    def ingest(self, status):
+        """Move a take into _acquisition and clean up its naming"""
+        with self._lock:
+            if not os.path.isdir(self.team_dir):
+                pxingest.materialize_template(self.team_dir, link=self.template_link)
+        with self.player_lock(status.player):
+            player_dir = pxingest.make_player_dir(self.team_dir, status.player, link=self.template_link)
+
+        pxingest.ingest_take(status.take, status.player, player_dir, self.path, self.date_stamp,
+                             self.journal, self.budget, index=self.index)
+        status.target = pxingest.take_target(player_dir, status.take, self.date_stamp)
+
+        return self.journal.is_done(status.take, 'rename')
+
+    def convert(self, status):
+        """Convert the CR2s of a take, ready for its proof once the three proof TIFFs exist"""
+        take = pxconvert.parse_take(status.target)
+        acquisition = os.path.dirname(status.target)
+        with self.player_lock(status.player):
+            raw_images = [r for r in glob(status.target + '/*') if r.upper().endswith('.CR2')]
+            pxconvert.XmpSidecars(acquisition).materialize(raw_images, [status.target], self.xmps)
+            report = pxconvert.convert_to_tiff(self.team_dir, status.player, backend=self.backend,
+                                               workers=self.convert_threads, xmps=self.xmps, take=take.name,
+                                               write_report=False)
+            self.conversion_failures.setdefault(status.player, []).extend(report)
+
+        tiff_dir = acquisition + '/tiff/' + take.name
+        return all(os.path.isfile(tiff_dir + '/' + image + '.tif') for image in pxproofs.PROOF_IMAGES)
+
+    def proof(self, status):
+        """Render the proof JPEG of a take"""
+        pose_name = pxproofs.get_placeholder(status.target, pxproofs.ChunkMappings.for_game(self.job))
+
+        row = pxproofs.proof_pose(status.target, self.team_dir + '/' + status.player, pose_name, self.renderer)
+        if row is None:
+            raise RuntimeError('no proof JPEG rendered')
+        with self.player_lock(status.player):
+            self.proofs.setdefault(status.player, []).append(row)
+
+        return True
+
+    def finish(self, status):
+        """Count a take as through, the last take of a player creates its PDF and CSV"""
+        with self._lock:
+            self.remaining[status.player] -= 1
+            last = self.remaining[status.player] == 0
+
+        if last and status.player in self.proofs:
+            first = self.proofs[status.player][0]['px take name']
+            out_csv = pxproofs.define_proof_name(first, self.job, self.team) + '.csv'
+            pxproofs.write_proof_csv(self.proofs[status.player], out_csv)
+            pxproofs.create_pdf(self.job, self.team, status.player)
+            pxproofs.cleanup(self.job, self.team, status.player)
+            print(Fore.GREEN + 'Proofs of {} done'.format(status.player))
+
+        # The failed conversions of all takes of the player, after the cleanup of its tmp files
+        if last and status.player in self.conversion_failures:
+            with open('/tmp/' + status.player + '_failures.json', 'w') as f:
+                json.dump(self.conversion_failures[status.player], f, indent=1)
+
+    def run(self):
+        """Run all takes through the pipeline and wait for the last one
+
+        :return: list of TakeStatus of the takes which failed
+        """
+        stages = [('ingest', self.ingest_queue, self.ingest, self.convert_queue),
+                  ('convert', self.convert_queue, self.convert, self.proof_queue),
+                  ('proof', self.proof_queue, self.proof, None)]
+
+        start_time = time.time()
+        threads = []
+        try:
+            for name, queue, work, output in stages:
+                stage_threads = [threading.Thread(target=self._stage, args=(name, queue, work, output), daemon=True)
+                                 for _ in range(self.workers[name])]
+                for thread in stage_threads:
+                    thread.start()
+                threads.append((queue, stage_threads))
+
+            # Shut the stages down front to back, every thread gets its end marker
+            for queue, stage_threads in threads:
+                for _ in stage_threads:
+                    queue.put(None)
+                for thread in stage_threads:
+                    thread.join()
+        finally:
+            # The color card XMPs are only needed during the conversion
+            for player in self.remaining:
+                pxconvert.copy_xmp(self.team_dir, player, self.xmps, False)
+            if self.index is not None:
+                self.index.close()
+            self.backend.close()
+            if self.renderer.failures:
+                self.renderer.write_failures('/tmp/' + self.team + '_proof_failures.json')
+
+        self.report(time.time() - start_time)
+
+        return [status for status in self.takes if status.error is not None]
+
+    def report(self, elapsed):
+        """Print the time every stage was busy, next to the time the whole pipeline took"""
+        busy = {'ingest': 0.0, 'convert': 0.0, 'proof': 0.0}
+        for status in self.takes:
+            for name in busy:
+                if name in status.times:
+                    busy[name] += status.times[name] - status.times['start_' + name]
+
+        print(Fore.LIGHTYELLOW_EX + 'Pipeline took: {:.1f} min'.format(elapsed / 60))
+        for name, seconds in busy.items():
+            print(Fore.LIGHTBLACK_EX + '\t{}: {:.1f} min in total'.format(name, seconds / 60))
+        for status in self.takes:
+            if status.error is not None:
+                print(Fore.RED + '\t{} failed in {}'.format(status.take, status.error))
+
+
+@command()
+@option('--game', '-g', default='2K_1018_NBA2K21', help='Game name', type=str, required=True)
+@option('--team', '-t', help='Team name', type=str, required=True)
+@option('--directory', '-d', help='Shoot in _incoming, i.e. 12_10_2019', type=str, required=True)
+@option('--card', '-c', help='Color Card', type=str)
+@option('--backend', '-b', default='photoshop', help='Converter', type=Choice(sorted(pxconvert.BACKENDS)))
+@option('--depth', default=8, help='Takes waiting in front of a stage at most', type=int)
+@option('--ingest-workers', default=2, help='Takes ingested in parallel', type=int)
+@option('--convert-workers', default=2, help='Players converted in parallel', type=int)
+@option('--proof-workers', default=2, help='Proofs rendered in parallel', type=int)
+@option('--renderer', default='native', help='Proof compositor',
+        type=Choice(['native'] + sorted(pxproofs.RENDERERS)))
+@option('--source', '-s', default='preview', help='Images of the proofs', type=Choice(['preview', 'tiff']))
+@option('--licences', '-l', default=2, help='Nuke renders at the same time', type=int)
+@option('--max-inflight', '-m', default=2048, help='Maximum of MB being moved at the same time', type=int)
+@option('--dedup', default='link', help='Hardlink or skip images which were already ingested',
+        type=Choice(['link', 'skip', 'off']))
+@option('--template-link', default='reflink', help='How to create the files of the project template',
+        type=Choice(['reflink', 'hardlink', 'copy']))
+def main(game, team, directory, card, backend, depth, ingest_workers, convert_workers, proof_workers,
+         renderer, source, licences, max_inflight, dedup, template_link):
+    """
+    Ingest, convert and proof a shoot, every take as soon as the stage before is done with it.
+
+    \b
+    game:      Game name, i.e. 2K_1018_NBA2K21 [Default]
+    team:      Team name, i.e. 'det' for the 'Detroit Pistons'
+    directory: Shoot in _incoming, i.e. 12_10_2019 or /Volumes/Bigfoot/_incoming/12_10_2019
+    card:      To use color card, pass in the date of the shoot, i.e. 01_03_2020, the latest one by default
+    backend:   Converter to use, photoshop [Default], darktable, native or stub
+    depth:     Takes waiting in front of the conversion and the proof stage at most, 8 [Default]
+    renderer:  native [Default] composites the proofs in process, nuke renders the template, stub is for testing
+    source:    preview [Default] proofs the JPEG previews of the CR2s, tiff the converted TIFFs
+    licences:  Number of Nuke licences, as many proofs render at the same time, 2 [Default]
+    template_link: Clone (reflink) [Default], hardlink or copy the files of the project template
+    """
+
+    # Call function to clear screen
+    _ = subprocess.run('clear' if os.name == 'posix' else 'cls')
+
+    path = os.path.realpath(directory if os.path.isabs(directory) else GlobalDirs.incoming + directory)
+    if not os.path.isdir(path) or not pxingest.is_date(os.path.basename(path).replace('_', '-')):
+        print(Fore.RED + 'Error: Path is invalid!')
+        sys.exit(1)
+
+    # Define Color Card
+    cards = GlobalDirs.projects + '/' + game + '/Source_Pixelgun/Color_Correction/'
+    if card is None:
+        dates = glob(cards + '*')
+        card = os.path.basename(max(dates, key=os.path.getctime)) if dates else ''
+    color_cards = glob(cards + card + '/*') if card else []
+
+    print(Fore.BLUE + "Project:\t{}".format(game))
+    print(Fore.BLUE + "Team:\t\t{}".format(pxconvert.GlobalDirs.teams.get(team, team)))
+    print(Fore.BLUE + "Shoot:\t\t{}".format(os.path.basename(path)))
+
+    try:
+        converter = pxconvert.BACKENDS[backend]()
+    except RuntimeError as exc:
+        raise UsageError(str(exc))
+
+    pipeline = Pipeline(game, team, path, color_cards, converter, depth=depth,
+                        ingest_workers=ingest_workers, convert_workers=convert_workers,
+                        proof_workers=proof_workers, max_inflight=max_inflight, dedup=dedup,
+                        template_link=template_link,
+                        renderer=pxproofs.proof_renderer(renderer, licences, source=source))
+    print(Fore.BLUE + "Takes:\t\t{}".format(pipeline.scan()))
+
+    failures = pipeline.run()
+
+    # Stop using colorama to restore 'stdout' and 'stderr' to their original values.
+    colorama.deinit()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
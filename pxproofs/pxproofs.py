@@ -5,11 +5,18 @@ Create a PDF file (proof) of three predefined images of the head (left, front, r
 alongside create a CSV file with all pose names by client and px to deliver to the client
 """
 
+import io
 import os
+import re
 import sys
+import json
+import mmap
 import time
 import shlex
+import signal
+import struct
 import shutil
+import threading
 import logging
 import colorama  # https://pypi.org/project/colorama/
 import platform
@@ -19,11 +26,14 @@ import numpy as np
 import multiprocessing as mp
 
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from functools import lru_cache
 from glob import glob
-from click import option, command
+from click import option, command, Choice
 from colorama import Fore
 from queue import PriorityQueue
 from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFont
 
 __author__ = "Stephan Osterburg"
 __copyright__ = "Copyright 2020, Pixelgun Studio"
@@ -46,6 +56,35 @@ class ValidationError(ValueError):
     pass
 
 
+# The three views of the head on a proof
+PROOF_IMAGES = ['A000_POLO', 'AL010_POLO', 'AR010_POLO']
+
+# Nuke and the proof template
+NUKE = '/Applications/Nuke12.0v3/Nuke12.0v3.app/Contents/MacOS/Nuke12.0'
+NUKE_TEMPLATE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'proof_comp_template.nk')
+
+# Layout of the template, in pixels from the top left of the proof
+PROOF_SIZE = (1920, 1080)
+PROOF_VIEWS = {'A000_POLO': 100, 'AL010_POLO': 700, 'AR010_POLO': 1300}  # Left edge of every view
+PROOF_VIEW_SIZE = (500, 750)  # The template scales the 4000x6000 TIFFs by 1/8
+PROOF_VIEW_BOTTOM = 855
+PROOF_SHOT_INFO = (1867, 963, 30)  # Right, bottom and size of the text
+PROOF_PLACEHOLDER = (1868, 1039, 55)
+PROOF_BORDER_SCALE = 0.99
+PROOF_FONTS = ('Arial.ttf', 'DejaVuSans.ttf')
+
+# Tags of the first IFD of a CR2: StripOffsets, StripByteCounts and Orientation of the preview
+PREVIEW_TAGS = (0x111, 0x117, 0x112)
+ORIENTATIONS = {2: Image.FLIP_LEFT_RIGHT, 3: Image.ROTATE_180, 4: Image.FLIP_TOP_BOTTOM, 5: Image.TRANSPOSE,
+                6: Image.ROTATE_270, 7: Image.TRANSVERSE, 8: Image.ROTATE_90}
+
+# Placeholders of the template together with the rest of their knob value
+TEMPLATE_KEYS = re.compile(r'\S*(PATH_TO_PLAYERS_HEAD|PATH_TO_PLAYERS_PROOF|##_##_####_########_########_####|'
+                           r'SHOTINFORMATIONSTRING|PROOF_OUTPUT)\S*')
+# Read node whose file knob is a per_frame expression, up to the end of that line
+READ_PER_FRAME = re.compile(r'^(Read \{\n(?: .*\n)*? file "[^\n]*lindex[^\n]*\n)', re.MULTILINE)
+
+
 class GlobalDirs:
     """Global default directories"""
 
@@ -94,6 +133,53 @@ class GlobalDirs:
              'was': 'Washington Wizards'}
 
 
+# Take names: <date or index>_<first>_<last>_<pose>_<take>
+# i.e. 01_12_2020_jefferson_amile_yell_angry_tk2 (project) or 4_carbonel_ray_neutral_tk3 (_incoming)
+TAKE_PATTERN = re.compile(r'^(?:(?P<date>\d{2}_\d{2}_\d{4})|(?P<index>\d+))_'
+                          r'(?P<player>[^_]+_[^_]+)_(?P<pose>.+)_(?P<take>[^_]+)$')
+
+
+class TakeName:
+    """Parsed take name"""
+
+    __slots__ = ('name', 'date', 'index', 'player', 'pose', 'take')
+
+    def __init__(self, name, date, index, player, pose, take):
+        self.name = name
+        self.date = date
+        self.index = index
+        self.player = player
+        self.pose = pose
+        self.take = take
+
+    @property
+    def prefix(self):
+        """Date and player, i.e. 01_12_2020_jefferson_amile"""
+        return '%s_%s' % (self.date or self.index, self.player)
+
+    @property
+    def base(self):
+        """Take name without the take number, i.e. 01_12_2020_jefferson_amile_yell_angry"""
+        return '%s_%s' % (self.prefix, self.pose)
+
+    def __repr__(self):
+        return 'TakeName(%r)' % self.name
+
+
+@lru_cache(maxsize=4096)
+def _parse_take_name(name):
+    match = TAKE_PATTERN.match(name)
+    if match is None:
+        return None
+
+    return TakeName(name, **match.groupdict())
+
+
+def parse_take(path):
+    """Parse the take name of a path (memoized), None if it isn't a take"""
+    return _parse_take_name(os.path.basename(path.rstrip('/')))
+
+
 def clear_screen():
     """Clear shell"""
     _ = subprocess.run('clear' if os.name == 'posix' else 'cls')
@@ -122,45 +208,93 @@ def define_proof_name(pose, game, team):
     output_dir = os.path.realpath(GlobalDirs.projects + "/" + game + "/Source_Pixelgun/Proof Sheets/" + team)
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
-    proof_name = '_'.join(pose.split('/')[-1].split('_')[0:5])
+    proof_name = parse_take(pose).prefix
 
     return output_dir + '/' + proof_name + '_selects'
 
 
-def get_placeholder(player_pose, df):
+class ChunkMappings:
+    """Index of chunk_mappings.csv: px acquisition name -> client (chunk) name
+
+    Built once per game and shared by all players, rebuilt when the CSV changes. Poses which are not
+    in the CSV keep their px name and are written to chunk_mappings_unknown.csv next to it, so they stick
+    across runs and production sees what is missing.
+    """
+
+    _games = {}
+    _games_lock = threading.Lock()
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.unknown_file = os.path.splitext(csv_file)[0] + '_unknown.csv'
+        self.mtime = os.stat(csv_file).st_mtime_ns
+        self._lock = threading.Lock()
+
+        # 'CHUNKS' is the client shape name, or the px name where the client has none
+        df = pd.read_csv(csv_file)
+        chunks = np.where(df['CLIENT SHAPE NAMES'].isnull(), df['PX AQUISITION'], df['CLIENT SHAPE NAMES'])
+        self.names = {}
+        for px_pose, chunk in zip(df['PX AQUISITION'], chunks):
+            self.names.setdefault(px_pose, chunk)
+
+        self.unknown = set()
+        if os.path.isfile(self.unknown_file):
+            with open(self.unknown_file, 'r') as f:
+                self.unknown = {line.strip() for line in f if line.strip() and line.strip() != 'PX AQUISITION'}
+        self.unknown -= set(self.names)
+
+    @classmethod
+    def for_game(cls, game):
+        """Return the index of a game, cached as long as its CSV does not change
+
+        Args:
+            game: name of the game
+
+        Returns: ChunkMappings
+        """
+        csv_file = GlobalDirs.projects + '/' + game + '/Source_Pixelgun/Settings/chunk_mappings.csv'
+        with cls._games_lock:
+            mappings = cls._games.get(game)
+            if mappings is None or mappings.mtime != os.stat(csv_file).st_mtime_ns:
+                mappings = cls._games[game] = cls(csv_file)
+
+        return mappings
+
+    def lookup(self, px_pose):
+        """Return the client name of a pose, unknown poses keep their px name
+
+        Args:
+            px_pose: px acquisition name, i.e. 'yell_angry'
+
+        Returns: client name
+        """
+        name = self.names.get(px_pose)
+        if name is not None:
+            return name
+
+        with self._lock:
+            if px_pose not in self.unknown:
+                self.unknown.add(px_pose)
+                with open(self.unknown_file, 'w') as f:
+                    f.write('\n'.join(['PX AQUISITION'] + sorted(self.unknown)) + '\n')
+
+        return px_pose
+
+
+def get_placeholder(player_pose, mappings):
     """Get placeholder string for the images
-    Write out PROOF.csv
 
     Args:
-        df: template dataframe
+        mappings: ChunkMappings of the game
         player_pose: name of players pose
 
     Returns: Base name of pose, i.e. 'smile'
     """
-
-    # Create "CHUNKS' column by getting all values from 'PX AQUISITION' where there are
-    # NaN in 'CLIENT SHAPE NAMES' and combine them
-    df['CHUNKS'] = np.where(df['CLIENT SHAPE NAMES'].isnull(), df['PX AQUISITION'], df['CLIENT SHAPE NAMES'])
-
-    try:
-        px_pose = '_'.join(player_pose.split('/')[-1].split('_')[5:-1])
-        if px_pose not in df['PX AQUISITION'].values:
-            _ = pd.DataFrame([[px_pose, px_pose, px_pose]],
-                             columns=('PX AQUISITION', 'CLIENT SHAPE NAMES', 'CHUNKS'))
-            df = pd.concat([df, _], ignore_index=True)
-
-        # Get pose name
-        pose_name = df.loc[df['PX AQUISITION'] == px_pose, 'CHUNKS'].iloc[0]
-    except ValueError:
-        print(Fore.RED + "Failed to read XLS file")
-        return
-
-    return pose_name
+    return mappings.lookup(parse_take(player_pose).pose)
 
 
 def check_tiff_exists(directory, player):
-    """Check if the Camera RAW are already converted
-       and copy it into the tmp directory
+    """Check if the Camera RAW are already converted, the TIFFs get used where they are
 
     Args:
         directory: directory name of the team
@@ -170,22 +304,15 @@ def check_tiff_exists(directory, player):
     """
     print(Fore.YELLOW + "Checking if TIFF's exists...")
 
-    exists = False
-    images = ['A000_POLO', 'AL010_POLO', 'AR010_POLO']
-
     # Backward compatibility
     if os.path.isdir(directory + '/' + player + '/_acquisition/tiff'):
-        poses = glob(directory + '/' + player + '/_acquisition/tiff/*')
+        poses = [p for p in glob(directory + '/' + player + '/_acquisition/tiff/*') if parse_take(p) is not None]
 
         for pose in poses:
-            for image in images:
-                tif_image = pose + '/' + image + '.tif'
-                if os.path.isfile(tif_image):
-                    exists = True
-                    tmp_image = '/tmp/' + pose.split('/')[-1] + '_' + image + '.tif'
-                    shutil.copyfile(tif_image, tmp_image)
+            if any(os.path.isfile(pose + '/' + image + '.tif') for image in PROOF_IMAGES):
+                return True
 
-    return exists
+    return False
 
 
 def convert_images(directory, player):
@@ -204,13 +331,13 @@ def convert_images(directory, player):
     app = '/Applications/darktable.app/Contents/MacOS/darktable-cli'
     opt = ' --core --conf plugins/imageio/format/tiff/bpp=16'
 
-    images = ['A000_POLO', 'AL010_POLO', 'AR010_POLO']
-    poses = glob(directory + '/' + player + '/_acquisition/*')
+    images = PROOF_IMAGES
+    poses = [p for p in glob(directory + '/' + player + '/_acquisition/*') if parse_take(p) is not None]
 
     # HACK/WORKAROUND: Create tmp directories for darktable to e able to run in parallel
     for pose in poses:
         for image in images:
-            base_tmp_dir = pose.split('/')[-1]
+            base_tmp_dir = parse_take(pose).name
             if not os.path.isdir('/tmp/' + base_tmp_dir):
                 os.mkdir('/tmp/' + base_tmp_dir)
 
@@ -220,9 +347,9 @@ def convert_images(directory, player):
     cmd_list = []
     for pose in poses:
         for image in images:
-            base_tmp_dir = pose.split('/')[-1]
+            base_tmp_dir = parse_take(pose).name
             in_image = pose + '/' + image + '.CR2'
-            out_image = '/tmp/' + pose.split('/')[-1] + '_' + image + '.tif'
+            out_image = '/tmp/' + base_tmp_dir + '_' + image + '.tif'
             cmd = app + ' ' + in_image + ' ' + out_image + opt + \
                   ' --configdir /tmp/' + str(base_tmp_dir) + '/' + str(image)
             cmd_list.append(cmd)
@@ -241,87 +368,528 @@ def convert_images(directory, player):
     # Cleaning up - removing temp directories
     if results:
         for pose in poses:
-            base_tmp_dir = pose.split('/')[-1]
+            base_tmp_dir = parse_take(pose).name
             if os.path.isdir('/tmp/' + base_tmp_dir):
                 shutil.rmtree('/tmp/' + base_tmp_dir)
 
 
-def create_proof(directory, team, player):
-    """Create a proof of a given player using Nuke
+@lru_cache(maxsize=4)
+def _read_template(filename, mtime):
+    with open(filename, 'r') as f:
+        return f.read()
+
+
+def per_frame(values):
+    """Nuke (TCL) expression with the value of the current frame, frame 1 is the first value
+
+    Brackets are escaped, so Nuke evaluates the expression while rendering instead of while loading.
+    """
+    if len(values) == 1:
+        return values[0]
+
+    return '\\[lindex {%s} \\[expr \\[frame]-1]]' % ' '.join('{%s}' % value for value in values)
+
+
+def nuke_script(poses, proof_output, pose_names):
+    """Fill the Nuke template for a batch of poses, one pose per frame
+
+    All placeholders are replaced in a single pass over the template.
+
+    Args:
+        poses: pose directories
+        proof_output: player directory
+        pose_names: client name of every pose, see get_placeholder
+
+    Returns: Nuke script
+    """
+    takes = [parse_take(pose) for pose in poses]
+    values = {'PATH_TO_PLAYERS_PROOF': [proof_output] * len(takes),
+              '##_##_####_########_########_####': [name + ' ' + take.take for name, take in zip(pose_names, takes)],
+              'SHOTINFORMATIONSTRING': ['Px: ' + take.name for take in takes],
+              'PROOF_OUTPUT': [take.name for take in takes]}
+
+    def substitute(match):
+        # Leave comments alone, i.e. #write_info
+        if match.string[match.string.rfind('\n', 0, match.start()) + 1] == '#':
+            return match.group(0)
+
+        # The whole knob value, so it can be quoted, i.e. PATH_TO_PLAYERS_HEAD/A000_POLO.tif
+        token = match.group(0)
+        quoted = len(token) > 1 and token[0] == token[-1] == '"'
+        if quoted:
+            token = token[1:-1]
+        if match.group(1) == 'PATH_TO_PLAYERS_HEAD':
+            # Read the TIFFs where they are
+            image = os.path.splitext(os.path.basename(token))[0]
+            frames = [proof_image(pose, image) for pose in poses]
+        else:
+            frames = [token.replace(match.group(1), value) for value in values[match.group(1)]]
+
+        if quoted or len(frames) > 1 or ' ' in frames[0]:
+            return '"%s"' % per_frame(frames)
+
+        return frames[0]
+
+    template = _read_template(NUKE_TEMPLATE, os.stat(NUKE_TEMPLATE).st_mtime_ns)
+    script = TEMPLATE_KEYS.sub(substitute, template)
+    if len(poses) == 1:
+        return script
+
+    # A Read node covers frame 1 only by default, the ones switching files per frame need all of them
+    frames = ' first 1\n last %d\n origfirst 1\n origlast %d\n' % (len(poses), len(poses))
+
+    return READ_PER_FRAME.sub(lambda match: match.group(1) + frames, script)
+
+
+def frame_value(value, frame):
+    """Value of a knob written by nuke_script at a given frame, stands in for TCL in the stub renderer"""
+    value = value.strip('"')
+    if 'lindex' not in value:
+        return value
+
+    return re.findall(r'\{([^{}]*)\}', value)[frame - 1]
+
+
+def stub_render(args):
+    """Render command for testing without Nuke, writes a grey JPEG for every frame of the Write node
+
+    Takes the same arguments as Nuke, i.e. -x -F 1-3 /tmp/king_louis.nk, and waits PX_STUB_RENDER_SECONDS
+    per frame to act like a slow (or hung) render.
+    """
+    first, last = map(int, args[args.index('-F') + 1].split('-'))
+    with open(args[-1], 'r') as f:
+        write = re.search(r'^Write \{\n(?:.*\n)*? file (.+)$', f.read(), re.MULTILINE).group(1)
+
+    for frame in range(first, last + 1):
+        time.sleep(float(os.environ.get('PX_STUB_RENDER_SECONDS', 0)))
+        Image.new('RGB', (192, 108), (128, 128, 128)).save(frame_value(write, frame), 'JPEG')
+
+
+# Commands rendering a Nuke script, they are called with -x -F <first>-<last> <script>
+RENDERERS = {'nuke': [NUKE],
+             'stub': [sys.executable, os.path.realpath(__file__), 'stub-render']}
+
+
+class ProofRenderer:
+    """Base class of the ways to render the proof JPEGs into the tmp directory"""
+
+    name = None
+    source = 'tiff'
+
+    def __init__(self):
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def render(self, poses, proof_output, pose_names, name):
+        """Render the proof JPEGs of a batch of poses
+
+        Args:
+            poses: pose directories
+            proof_output: player directory
+            pose_names: client name of every pose, see get_placeholder
+            name: name of the batch, i.e. the player
+
+        Returns: rows of the delivery CSV file of the rendered poses
+        """
+        raise NotImplementedError
+
+    def render_all(self, poses, proof_output, pose_names, name):
+        """Render all poses of a player, see render"""
+        return self.render(poses, proof_output, pose_names, name)
+
+    def failed(self, pose, reason, attempts):
+        with self._lock:
+            self.failures.append({'pose': pose, 'reason': reason, 'attempts': attempts})
+
+    def write_failures(self, filename):
+        """Write the poses which failed to render into a JSON file
+
+        Returns: number of failed poses
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.failures, f, indent=1)
+
+        for failure in self.failures:
+            print(Fore.RED + 'Failed to render {}: {}'.format(os.path.basename(failure['pose']), failure['reason']))
+
+        return len(self.failures)
+
+
+class RenderPool(ProofRenderer):
+    """Render proofs with as many renders at the same time as there are Nuke licences
+
+    A render which takes too long gets killed together with everything it started. Poses without a JPEG
+    afterwards get rendered again after a pause, which doubles with every round.
+    """
+
+    def __init__(self, licences=2, timeout=300, retries=2, backoff=10, renderer='nuke'):
+        """
+        Args:
+            licences: number of renders at the same time
+            timeout: seconds a render may take per pose
+            retries: how often a pose without a JPEG gets rendered again
+            backoff: seconds to wait before the first retry
+            renderer: key of RENDERERS
+        """
+        super().__init__()
+        self.name = renderer
+        self.licences = licences
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.command = RENDERERS[renderer]
+        self._slots = threading.BoundedSemaphore(licences)
+
+    def launch(self, script, frames):
+        """Render the frames 1 to frames of a Nuke script
+
+        Args:
+            script: Nuke script
+            frames: number of frames
+
+        Returns: None or the reason the render failed
+        """
+        cmd = self.command + ['-x', '-F', '1-%d' % frames, script]
+        with self._slots:
+            # In its own session, so a hung render can be killed with its children
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            try:
+                _, err = proc.communicate(timeout=self.timeout * frames)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                return 'timed out after {}s'.format(self.timeout * frames)
+
+        if proc.returncode != 0:
+            return 'exit code {}: {}'.format(proc.returncode, err.decode(errors='replace').strip()[-200:])
+
+        return None
+
+    def render(self, poses, proof_output, pose_names, name):
+        """Render a batch of poses with one render, poses without a JPEG afterwards get rendered again
+
+        Args:
+            poses: pose directories
+            proof_output: player directory
+            pose_names: client name of every pose, see get_placeholder
+            name: name of the Nuke script in the tmp directory, i.e. the player
+
+        Returns: rows of the delivery CSV file of the rendered poses
+        """
+        pending = list(zip(poses, pose_names))
+        render_filename = '/tmp/' + name + '.nk'
+        reason = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                print(Fore.LIGHTBLACK_EX + 'Rendering {} poses of {} again: {}'.format(len(pending), name, reason))
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            # A JPEG of an earlier render doesn't count
+            for pose, _ in pending:
+                if os.path.exists('/tmp/' + parse_take(pose).name + '.jpg'):
+                    os.remove('/tmp/' + parse_take(pose).name + '.jpg')
+
+            with open(render_filename, 'w') as f:
+                f.write(nuke_script([pose for pose, _ in pending], proof_output,
+                                    [pose_name for _, pose_name in pending]))
+
+            reason = self.launch(render_filename, len(pending))
+            pending = [(pose, pose_name) for pose, pose_name in pending
+                       if not os.path.isfile('/tmp/' + parse_take(pose).name + '.jpg')]
+            if not pending:
+                break
+
+        failed = {pose for pose, _ in pending}
+        for pose in sorted(failed):
+            self.failed(pose, reason or 'no JPEG written', self.retries + 1)
+
+        takes = [parse_take(pose) for pose in poses]
+        return [{'take name': pose_name, 'take': take.take, 'px take name': take.name}
+                for pose, pose_name, take in zip(poses, pose_names, takes) if pose not in failed]
+
+    def render_all(self, poses, proof_output, pose_names, name):
+        """Render the poses of a player split into one batch per licence
+
+        Returns: rows of the delivery CSV file of the rendered poses, in the order of the poses
+        """
+        if not poses:
+            return []
+
+        size = -(-len(poses) // self.licences)
+        batches = [(poses[i:i + size], proof_output, pose_names[i:i + size], '{}_{}'.format(name, i // size))
+                   for i in range(0, len(poses), size)]
+
+        with ThreadPool(len(batches)) as pool:
+            results = pool.starmap(self.render, batches)
+
+        return [row for rows in results for row in rows]
+
+
+def proof_image(pose, image):
+    """TIFF of a view of the head the proof is made of
+
+    Args:
+        pose: pose directory
+        image: view, see PROOF_IMAGES
+
+    Returns: the converted TIFF below _acquisition/tiff, the one darktable wrote into tmp if there is none
+    """
+    take = parse_take(pose)
+    tif_image = os.path.dirname(pose) + '/tiff/' + take.name + '/' + image + '.tif'
+    if os.path.isfile(tif_image):
+        return tif_image
+
+    return '/tmp/' + take.name + '_' + image + '.tif'
+
+
+@lru_cache(maxsize=8)
+def proof_font(size):
+    """Font of the proof texts, the one of the template if installed"""
+    for font in PROOF_FONTS:
+        try:
+            return ImageFont.truetype(font, size)
+        except OSError:
+            pass
+
+    return ImageFont.load_default()
+
+
+def read_cr2_preview(filename):
+    """Read the embedded full size JPEG preview of a CR2, without touching the raw data
+
+    The preview is the image of the first IFD, only that IFD and the JPEG get read from the memory mapped file.
+
+    Args:
+        filename: CR2 file
+
+    Returns: JPEG (bytes) and the orientation of the camera (EXIF)
+    """
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as cr2:
+        order = {b'II': '<', b'MM': '>'}.get(cr2[:2])
+        if order is None or struct.unpack(order + 'H', cr2[2:4])[0] != 42:
+            raise ValueError('{} is not a CR2'.format(filename))
+
+        ifd = struct.unpack(order + 'I', cr2[4:8])[0]
+        tags = {}
+        for i in range(struct.unpack(order + 'H', cr2[ifd:ifd + 2])[0]):
+            tag, kind, count, value = struct.unpack_from(order + 'HHI4s', cr2, ifd + 2 + 12 * i)
+            if tag in PREVIEW_TAGS and count == 1:
+                tags[tag] = struct.unpack_from(order + ('H' if kind == 3 else 'I'), value)[0]
+
+        if 0x111 not in tags or 0x117 not in tags:
+            raise ValueError('{} has no preview'.format(filename))
+        preview = cr2[tags[0x111]:tags[0x111] + tags[0x117]]
+
+    if preview[:2] != b'\xff\xd8':
+        raise ValueError('{} has no JPEG preview'.format(filename))
+
+    return preview, tags.get(0x112, 1)
+
+
+def load_view(source, box=PROOF_VIEW_SIZE, orientation=1):
+    """Load a view of the head scaled down to fit the proof
+
+    JPEGs get decoded at the reduced size right away, TIFFs get reduced by a whole factor first.
+
+    Args:
+        source: image file or file object of the view
+        box: width and height the view gets fit into
+        orientation: orientation of the camera (EXIF), i.e. 8 for a CR2 preview of a portrait
+
+    Returns: RGB array (uint8)
+    """
+    rotated = orientation in (5, 6, 7, 8)
+    with Image.open(source) as image:
+        width, height = image.size[::-1] if rotated else image.size
+        scale = min(box[0] / width, box[1] / height)
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+
+        # Size before the rotation
+        if rotated:
+            size = size[::-1]
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+
+    factor = image.width // size[0]
+    if factor > 1:
+        image = image.reduce(factor)
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+    if orientation in ORIENTATIONS:
+        image = image.transpose(ORIENTATIONS[orientation])
+
+    return np.asarray(image)
+
+
+def composite_proof(views, shot_info, placeholder):
+    """Lay out a proof like the Nuke template, the views side by side and the texts bottom right
+
+    Args:
+        views: RGB array of every view, see load_view
+        shot_info: text above the placeholder, i.e. Px: 01_12_2020_king_louis_neutral_tk1
+        placeholder: client name of the pose and take
+
+    Returns: proof (PIL Image)
+    """
+    width, height = PROOF_SIZE
+    sheet = np.zeros((height, width, 3), np.uint8)
+    for image, left in PROOF_VIEWS.items():
+        view = views[image]
+        top = PROOF_VIEW_BOTTOM - view.shape[0]
+        y0, y1 = max(top, 0), min(top + view.shape[0], height)
+        x0, x1 = max(left, 0), min(left + view.shape[1], width)
+        sheet[y0:y1, x0:x1] = view[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    proof = Image.fromarray(sheet)
+    draw = ImageDraw.Draw(proof)
+    for text, (right, bottom, size) in ((shot_info, PROOF_SHOT_INFO), (placeholder, PROOF_PLACEHOLDER)):
+        font = proof_font(size)
+        _, _, text_width, text_height = draw.textbbox((0, 0), text, font=font)
+        draw.text((right - text_width, bottom - text_height), text, font=font, fill=(255, 255, 255))
+
+    # Scale down around the center, leaving a white border
+    inner = (round(width * PROOF_BORDER_SCALE), round(height * PROOF_BORDER_SCALE))
+    bordered = Image.new('RGB', PROOF_SIZE, (255, 255, 255))
+    bordered.paste(proof.resize(inner, Image.BILINEAR), ((width - inner[0]) // 2, (height - inner[1]) // 2))
+
+    return bordered
+
+
+class ProofCompositor(ProofRenderer):
+    """Composite the proofs in process with NumPy and Pillow, every pose is a task of a thread pool
+
+    No Nuke needed, the layout is the one of proof_comp_template.nk. The views come from the JPEG previews
+    of the CR2s by default, or from the TIFFs when the colors matter.
+    """
+
+    name = 'native'
+
+    def __init__(self, threads=None, source='preview'):
+        """
+        Args:
+            threads: number of poses composited at the same time, one per core by default
+            source: 'preview' of the CR2s or 'tiff'
+        """
+        super().__init__()
+        self.threads = threads or mp.cpu_count()
+        self.source = source
+
+    def load_views(self, pose):
+        """Load the views of the head of a pose, see load_view"""
+        if self.source == 'tiff':
+            return {image: load_view(proof_image(pose, image)) for image in PROOF_IMAGES}
+
+        views = {}
+        for image in PROOF_IMAGES:
+            preview, orientation = read_cr2_preview(pose + '/' + image + '.CR2')
+            views[image] = load_view(io.BytesIO(preview), orientation=orientation)
+
+        return views
+
+    def composite(self, pose, pose_name):
+        """Composite the proof JPEG of a pose
+
+        Returns: row of the delivery CSV file, None if it failed
+        """
+        take = parse_take(pose)
+        try:
+            proof = composite_proof(self.load_views(pose), 'Px: ' + take.name, pose_name + ' ' + take.take)
+            proof.save('/tmp/' + take.name + '.jpg', 'JPEG')
+        except (OSError, ValueError) as exc:
+            self.failed(pose, str(exc), 1)
+            return None
+
+        return {'take name': pose_name, 'take': take.take, 'px take name': take.name}
+
+    def render(self, poses, proof_output, pose_names, name):
+        if not poses:
+            return []
+
+        with ThreadPool(min(self.threads, len(poses))) as pool:
+            rows = pool.starmap(self.composite, zip(poses, pose_names))
+
+        return [row for row in rows if row is not None]
+
+
+def proof_renderer(renderer='native', licences=2, timeout=300, retries=2, source='preview'):
+    """ProofCompositor for native, a RenderPool running Nuke (or the stub) otherwise
+
+    Args:
+        renderer: native or a key of RENDERERS
+        licences: number of Nuke renders at the same time
+        timeout: seconds a Nuke render may take per pose
+        retries: how often a pose gets rendered again by Nuke
+        source: 'preview' of the CR2s or 'tiff', Nuke always uses the TIFFs
+
+    Returns: ProofRenderer
+    """
+    if renderer == 'native':
+        return ProofCompositor(source=source)
+
+    return RenderPool(licences, timeout=timeout, retries=retries, renderer=renderer)
+
+
+def proof_pose(pose, proof_output, pose_name, renderer=None):
+    """Render the proof JPEG of a single pose
+
+    Args:
+        pose: pose directory
+        proof_output: player directory
+        pose_name: client name of the pose, see get_placeholder
+        renderer: ProofRenderer to render on, the native compositor by default
+
+    Returns: row of the delivery CSV file, None if it failed to render
+    """
+    renderer = renderer or ProofCompositor(1)
+    rows = renderer.render([pose], proof_output, [pose_name], parse_take(pose).name)
+
+    return rows[0] if rows else None
+
+
+def write_proof_csv(rows, out_csv):
+    """Write the delivery CSV file
+
+    Args:
+        rows: rows returned by proof_pose
+        out_csv: CSV file
+
+    Returns: None
+    """
+    out_df = pd.DataFrame(rows, columns=['take name', 'take', 'px take name', 'order'])
+    with open(out_csv, 'w') as f:
+        out_df.to_csv(f, index=False)
+
+
+def create_proof(directory, team, player, renderer=None):
+    """Create a proof of a given player
 
     Args:
         directory: directory name of the team
         team: Name of the team
         player: either the name of a player or "all"
+        renderer: ProofRenderer to render on, the native compositor by default
 
     Returns: None
     """
     print(Fore.YELLOW + "Creating JPEG's...")
 
-    # Location of Nuke
-    app = '/Applications/Nuke12.0v3/Nuke12.0v3.app/Contents/MacOS/Nuke12.0 -x -F 1 '
-
-    # List all poses
+    # List all poses, skips tiff and _thumbs
     proof_output = directory + '/' + player
-    poses = glob(proof_output + '/_acquisition/*')
-    item = [x for x in poses if 'tiff' in x]
-    if len(item) != 0:
-        idx = poses.index(item[0])
-        poses.pop(idx)
+    poses = [p for p in glob(proof_output + '/_acquisition/*') if parse_take(p) is not None]
 
-    # Open default CSV file (XLS)
+    # Client names of the poses, read once per game
     game = ''.join(directory.rsplit(GlobalDirs.projects)).split('/')[1]
-    csv_file = GlobalDirs.projects + '/' + game + '/Source_Pixelgun/Settings/chunk_mappings.csv'
-    in_df = pd.read_csv(csv_file)
+    mappings = ChunkMappings.for_game(game)
 
     # Create delivery CSV file
     out_csv = define_proof_name(poses[0], game, team) + '.csv'
-    out_df = pd.DataFrame(columns=['take name', 'take', 'px take name', 'order'])
 
-    for pose in poses:
-        # Define replacement text for shot string
-        shot_string = 'Px: ' + pose.split('/')[-1]
-
-        # Copy Nuke template file to tmp directory with player and pose name
-        nuke_template = '/Users/px/Projects/pxproofs/proof_comp_template.nk'
-        render_filename = '/tmp/' + pose.split('/')[-1] + '.nk'
-        if os.path.exists(render_filename):
-            os.remove(render_filename)
-        shutil.copy(nuke_template, render_filename)
-
-        # Get placeholder string and put it into a CSV file
-        pose_name = get_placeholder(pose, in_df)
-        placeholder = pose_name + ' ' + pose.split('/')[-1].split('_')[-1]
-
-        # Search and replace placeholder text in nuke template file
-        placeholder_text = ('PATH_TO_PLAYERS_HEAD', 'PATH_TO_PLAYERS_PROOF', '##_##_####_########_########_####',
-                            'SHOTINFORMATIONSTRING', 'PROOF_OUTPUT')
-        replace_text = ('/tmp/' + pose.split('/')[-1], proof_output, placeholder, shot_string, pose.split('/')[-1])
-
-        find_replace = dict(zip(placeholder_text, replace_text))
-        with open(nuke_template, 'r') as tmp_file:
-            with open(render_filename, 'w') as new_file:
-                for line in tmp_file:
-                    for key in find_replace:
-                        if key in line:
-                            line = line.replace(key, find_replace[key])
-                    new_file.write(line)
-
-        # Create command and submit it
-        cmd = app + render_filename
-        subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        # -----------------------------------
-        # CSV PART - should be somewhere else
-
-        # Put more stuff into the CSV file
-        tk_name = pose.split('/')[-1]
-        tk = tk_name.split('_')[-1]
-        out_df = out_df.append({'take name': pose_name, 'take': tk, 'px take name': tk_name}, ignore_index=True)
+    # Get placeholder strings and render the poses of the player, with Nuke one batch per licence
+    pose_names = [get_placeholder(pose, mappings) for pose in poses]
+    rows = (renderer or ProofCompositor()).render_all(poses, proof_output, pose_names, player)
 
     # Write csv file
-    with open(out_csv, 'w') as f:
-        out_df.to_csv(f, index=False)
+    write_proof_csv(rows, out_csv)
 
 
 def create_pdf(game, team, player):
@@ -358,17 +926,15 @@ def create_pdf(game, team, player):
     else:
         poses = glob(proof_input + '/_acquisition/*' + player + '*')
 
+    # Just in case - remove unwanted parts, i.e. Thumbs.db
+    poses = [p for p in poses if parse_take(p) is not None]
+
     # Move neutral into first place
-    item = [x for x in poses if 'neutral' in x]
+    item = [x for x in poses if 'neutral' in parse_take(x).pose]
     if len(item) != 0:
         idx = poses.index(item[0])
         poses.insert(0, poses.pop(idx))
 
-    # Just in case - remove unwanted parts
-    _ = [x for x in poses if 'Thumbs.db' in x]
-    if len(_) > 0:
-        poses.remove(_[0])
-
     # Create PDF
     pdf = FPDF('L', 'pt', (1080, 1920))
     pdf.set_margins(0, 0, 0)
@@ -378,7 +944,7 @@ def create_pdf(game, team, player):
     pdf.cell(1200, 800, title, 0, 0, 'C')
     pdf.ln()
     for pose in poses:
-        render_filename = '/tmp/' + pose.split('/')[-1] + '.jpg'
+        render_filename = '/tmp/' + parse_take(pose).name + '.jpg'
         # Bail/Write log if one of the images done exist
         if not os.path.isfile(render_filename):
             print(Fore.RED + f"Missing pose: {render_filename.split('/')[-1].split('.')[0]}")
@@ -423,8 +989,9 @@ def cleanup(game, team, player):
         os.remove(temp)
 
 
-def each_player(path, game, team, player):
+def each_player(path, game, team, player, renderer=None):
     """Iterate thur all or just the one player"""
+    renderer = renderer or ProofCompositor()
     if len(player.split()) == 1:
         player_name = ' '.join(map(str, player.split('_')[::-1])).title()
 
@@ -432,11 +999,11 @@ def each_player(path, game, team, player):
 
     # put the next three steps into a PriorityQueue to make sure that moving the data
     # has finished first before we clean up the naming
-    tiff_exists = check_tiff_exists(path, player)
-    if not tiff_exists:
+    # The CR2 previews need no conversion
+    if renderer.source == 'tiff' and not check_tiff_exists(path, player):
         qi.put(1, convert_images(path, player))
 
-    qi.put(2, create_proof(path, team, player))
+    qi.put(2, create_proof(path, team, player, renderer))
     qi.put(3, create_pdf(game, team, player))
     qi.put(4, cleanup(game, team, player))
 
@@ -448,14 +1015,25 @@ def each_player(path, game, team, player):
 @option('--game', '-g', default='2K_1018_NBA2K21', help='Game name', type=str, required=True)
 @option('--team', '-t', help='Team name', type=str, required=True)
 @option('--player', '-p', help='Player name or all', type=str, required=True)
-def main(game, team, player):
+@option('--licences', '-l', default=2, help='Renders at the same time', type=int)
+@option('--timeout', default=300, help='Seconds a render may take per pose', type=int)
+@option('--retries', '-r', default=2, help='How often a pose gets rendered again', type=int)
+@option('--renderer', default='native', help='Compositor', type=Choice(['native'] + sorted(RENDERERS)))
+@option('--source', '-s', default='preview', help='Images of the proof', type=Choice(['preview', 'tiff']))
+def main(game, team, player, licences, timeout, retries, renderer, source):
     """
-    Create a proof cheat of a given player using Nuke
+    Create a proof cheat of a given player
 
     \b
     game:      Game name, i.e. 2K_1018_NBA2K21 [Default]
     team:      Team name, i.e. 'det' for the 'Detroit Pistons'
     player:    A players name, i.e. 'king_louis' or you can pass in 'all' to run thru all players
+    licences:  Number of Nuke licences, as many renders run at the same time, 2 [Default]
+    timeout:   Seconds a render may take per pose before it gets killed, 300 [Default]
+    retries:   How often a pose gets rendered again, 2 [Default]; failures end up in /tmp/<team>_proof_failures.json
+    renderer:  native [Default] composites in process, nuke renders the template, stub writes grey JPEGs for testing
+    source:    preview [Default] uses the JPEG previews of the CR2s, tiff the TIFFs (darktable converts missing
+               ones) for accurate colors; nuke and stub always use the TIFFs
     """
 
     # Call function to clear screen
@@ -476,16 +1054,19 @@ def main(game, team, player):
     print(Fore.BLUE + "Project:\t{}".format(game))
     print(Fore.BLUE + "Team:\t\t{}".format(team_name))
 
+    renderer = proof_renderer(renderer, licences, timeout=timeout, retries=retries, source=source)
     if player.lower() == 'all':
         players = glob(path + '/*')
         for counter, value in enumerate(players):
             player = value.split('/')[-1]
-            qo.put(counter, each_player(path, game, team, player))
+            qo.put(counter, each_player(path, game, team, player, renderer))
 
         while not qo.empty():
             qo.get()
     else:
-        each_player(path, game, team, player)
+        each_player(path, game, team, player, renderer)
+
+    renderer.write_failures('/tmp/' + team + '_proof_failures.json')
 
     print(Fore.GREEN + 'DONE')
     print('\n')
@@ -495,4 +1076,7 @@ def main(game, team, player):
 
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['stub-render']:
+        stub_render(sys.argv[2:])
+    else:
+        main()
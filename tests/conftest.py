@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tools are standalone scripts, not packages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for tool in ('pxingest', 'pxconvert', 'pxproofs', 'pxpipeline'):
+    sys.path.insert(0, os.path.join(ROOT, tool))
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+
+import pytest
+
+import pxconvert
+
+PLAYER = 'pxtest_louis'
+TAKES = ('01_12_2020_pxtest_louis_neutral_tk1', '01_12_2020_pxtest_louis_neutral_tk10')
+IMAGES = ('A000_POLO', 'AL010_POLO', 'AR010_POLO')
+
+
+class FailingBackend(pxconvert.StubBackend):
+    """Raises on the batches of one take, writes broken TIFFs for another"""
+
+    name = 'failing'
+    batch_size = 1
+
+    def convert(self, jobs, scratch=None, encoding=None):
+        for raw_image, tif_image in jobs:
+            if '_tk10' in raw_image:
+                raise RuntimeError('converter crashed')
+            if 'AL010' in raw_image:
+                with open(tif_image, 'wb') as f:
+                    f.write(b'II*\x00broken')
+            else:
+                super().convert([(raw_image, tif_image)], scratch, encoding)
+
+
+@pytest.fixture
+def team(tmp_path):
+    for take in TAKES:
+        os.makedirs(str(tmp_path / PLAYER / '_acquisition' / take))
+        for image in IMAGES:
+            (tmp_path / PLAYER / '_acquisition' / take / (image + '.CR2')).write_bytes(image.encode())
+
+    return str(tmp_path)
+
+
+def tiff(team, take, image):
+    return os.path.join(team, PLAYER, '_acquisition', 'tiff', take, image + '.tif')
+
+
+def test_scheduler_runs_every_batch_and_steals(tmp_path):
+    seen = []
+
+    class Recorder(pxconvert.StubBackend):
+        def convert(self, jobs, scratch=None, encoding=None):
+            time.sleep(0.01)
+            seen.append((threading.current_thread().name, scratch, tuple(jobs)))
+
+    scheduler = pxconvert.ConversionScheduler(Recorder(), workers=2, scratch=str(tmp_path))
+    # A single pose, the second slot has to steal
+    batches = [[('a%d.CR2' % i, 'a%d.tif' % i)] for i in range(8)]
+    scheduler.submit([batches])
+    done = []
+
+    assert scheduler.run(callback=done.append) == []
+    assert sorted(jobs for _, _, jobs in seen) == sorted(tuple(batch) for batch in batches)
+    assert len(done) == 8
+    assert len({thread for thread, _, _ in seen}) == 2
+    assert {os.path.basename(scratch) for _, scratch, _ in seen} == {'slot00', 'slot01'}
+
+
+def test_scheduler_reports_raising_batches(tmp_path):
+    scheduler = pxconvert.ConversionScheduler(FailingBackend(), workers=2, scratch=str(tmp_path))
+    scheduler.submit([[[('x_tk10.CR2', str(tmp_path / 'x.tif'))]], [[('y_tk1.CR2', str(tmp_path / 'y.tif'))]]])
+    failures = scheduler.run()
+
+    assert [batch for batch, _ in failures] == [[('x_tk10.CR2', str(tmp_path / 'x.tif'))]]
+    assert isinstance(failures[0][1], RuntimeError)
+
+
+def test_photoshop_runs_alone():
+    assert pxconvert.ConversionScheduler(pxconvert.PhotoshopBackend(), workers=8).workers == 1
+
+
+def test_convert_skips_fresh_tiffs(team):
+    backend = pxconvert.StubBackend()
+    assert pxconvert.convert_to_tiff(team, PLAYER, backend=backend, workers=2, write_report=False) == []
+    for take in TAKES:
+        for image in IMAGES:
+            assert pxconvert.validate_tiff(tiff(team, take, image)) is None
+
+    converted = []
+
+    class Counting(pxconvert.StubBackend):
+        def convert(self, jobs, scratch=None, encoding=None):
+            converted.extend(jobs)
+            super().convert(jobs, scratch, encoding)
+
+    pxconvert.convert_to_tiff(team, PLAYER, backend=Counting(), write_report=False)
+    assert converted == []
+
+    # A changed CR2 converts again, just that one
+    raw_image = os.path.join(team, PLAYER, '_acquisition', TAKES[0], 'A000_POLO.CR2')
+    with open(raw_image, 'ab') as f:
+        f.write(b'more')
+    pxconvert.convert_to_tiff(team, PLAYER, backend=Counting(), write_report=False)
+    assert converted == [(raw_image, tiff(team, TAKES[0], 'A000_POLO'))]
+
+    # A different encoding converts everything again
+    del converted[:]
+    backend = Counting()
+    backend.encoding = pxconvert.TiffEncoding('deflate', predictor=True)
+    pxconvert.convert_to_tiff(team, PLAYER, backend=backend, write_report=False)
+    assert len(converted) == len(TAKES) * len(IMAGES)
+
+
+def test_convert_exactly_one_take(team):
+    pxconvert.convert_to_tiff(team, PLAYER, backend=pxconvert.StubBackend(), take=TAKES[0], write_report=False)
+
+    assert os.path.isfile(tiff(team, TAKES[0], 'A000_POLO'))
+    assert not os.path.exists(tiff(team, TAKES[1], 'A000_POLO'))
+
+
+def test_convert_reports_failures_and_keeps_them_stale(team):
+    report = pxconvert.convert_to_tiff(team, PLAYER, backend=FailingBackend(), retries=1, write_report=False)
+    reasons = {(os.path.basename(os.path.dirname(entry['tiff'])), os.path.basename(entry['tiff'])): entry
+               for entry in report}
+
+    # Every image of the crashing take and the broken TIFF of the other one, after two attempts each
+    assert len(report) == len(IMAGES) + 1
+    assert all(entry['attempts'] == 2 for entry in report)
+    assert 'converter crashed' in reasons[(TAKES[1], 'A000_POLO.tif')]['reason']
+    assert (TAKES[0], 'AL010_POLO.tif') in reasons
+
+    cache = pxconvert.ConversionCache(os.path.join(team, PLAYER, '_acquisition', 'tiff'), FailingBackend())
+    raw_image = os.path.join(team, PLAYER, '_acquisition', TAKES[0])
+    assert cache.is_fresh(os.path.join(raw_image, 'A000_POLO.CR2'), tiff(team, TAKES[0], 'A000_POLO'))
+    assert not cache.is_fresh(os.path.join(raw_image, 'AL010_POLO.CR2'), tiff(team, TAKES[0], 'AL010_POLO'))
+    assert not os.path.exists(tiff(team, TAKES[0], 'AL010_POLO'))
+    assert not os.path.exists(tiff(team, TAKES[0], 'AL010_POLO') + '.prev')
+
+
+def test_cache_follows_the_color_card(tmp_path):
+    raw_image, tif_image = tmp_path / 'A000_POLO.CR2', tmp_path / 'tiff' / 'A000_POLO.tif'
+    raw_image.write_bytes(b'raw')
+    tif_image.parent.mkdir()
+    tif_image.write_bytes(b'tif')
+    card = tmp_path / 'card.xmp'
+    card.write_text('<x:xmpmeta exposure="0"/>')
+
+    cache = pxconvert.ConversionCache(str(tmp_path / 'tiff'), pxconvert.StubBackend(), [str(card)])
+    assert not cache.is_fresh(str(raw_image), str(tif_image))
+    cache.update(str(raw_image), str(tif_image))
+    cache.save()
+
+    cache = pxconvert.ConversionCache(str(tmp_path / 'tiff'), pxconvert.StubBackend(), [str(card)])
+    assert cache.is_fresh(str(raw_image), str(tif_image))
+
+    card.write_text('<x:xmpmeta exposure="1"/>')
+    cache = pxconvert.ConversionCache(str(tmp_path / 'tiff'), pxconvert.StubBackend(), [str(card)])
+    assert not cache.is_fresh(str(raw_image), str(tif_image))
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+
+import pytest
+
+import pxconvert
+
+
+@pytest.fixture
+def farm(tmp_path):
+    schedulers = []
+
+    def make(backend=None, **kwargs):
+        scheduler = pxconvert.FarmScheduler(backend or pxconvert.StubBackend(), port=0, root=str(tmp_path), **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+
+    for scheduler in schedulers:
+        scheduler.close()
+
+
+def batch(root, *names):
+    return [(os.path.join(root, name + '.CR2'), os.path.join(root, name + '.tif')) for name in names]
+
+
+def test_lease_travels_relative(farm, tmp_path):
+    scheduler = farm()
+    scheduler.submit([[batch(str(tmp_path), 'a', 'b')]])
+
+    lease = scheduler.lease('px10-1')
+    assert lease['backend'] == 'stub'
+    assert lease['jobs'] == [['a.CR2', 'a.tif'], ['b.CR2', 'b.tif']]
+    assert scheduler.lease('px10-1') == {'wait': 1}
+
+
+def test_release_requeues_without_failing(farm, tmp_path):
+    scheduler = farm()
+    scheduler.submit([[batch(str(tmp_path), 'a')]])
+
+    lease = scheduler.lease('px10-1')
+    assert scheduler.release('px11-1', lease['lease']) == {'ok': False}
+    assert scheduler.release('px10-1', lease['lease']) == {'ok': True}
+    assert scheduler.lease('px10-1', refused=['stub']) == {'wait': 60}
+
+    lease = scheduler.lease('px11-1')
+    assert lease['jobs'] == [['a.CR2', 'a.tif']]
+    assert scheduler.result('px11-1', lease['lease']) == {'ok': True}
+    assert scheduler.run() == []
+    assert scheduler.stats['px10-1']['failed'] == 0
+
+
+def test_result_with_error_fails_the_batch(farm, tmp_path):
+    scheduler = farm()
+    scheduler.submit([[batch(str(tmp_path), 'a')]])
+
+    lease = scheduler.lease('px10-1')
+    scheduler.result('px10-1', lease['lease'], 'darktable crashed')
+    failures = scheduler.run()
+
+    assert [failed for failed, _ in failures] == [batch(str(tmp_path), 'a')]
+    assert 'darktable crashed' in str(failures[0][1])
+    assert scheduler.stats['px10-1']['failed'] == 1
+
+
+def test_expired_lease_goes_to_another_worker(farm, tmp_path):
+    scheduler = farm(timeout=0.1)
+    scheduler.submit([[batch(str(tmp_path), 'a')]])
+
+    lost = scheduler.lease('px10-1')
+    time.sleep(1.5)
+    assert scheduler.heartbeat('px10-1', lost['lease']) == {'ok': False}
+
+    lease = scheduler.lease('px11-1')
+    assert lease['jobs'] == lost['jobs']
+    # The late result of the lost worker is ignored
+    assert scheduler.result('px10-1', lost['lease'], 'killed') == {'ok': False}
+    assert scheduler.result('px11-1', lease['lease']) == {'ok': True}
+    assert scheduler.run() == []
+    assert scheduler.stats['px10-1']['lost'] == 1
+
+
+def test_batch_fails_after_reassigning(farm, tmp_path):
+    scheduler = farm(timeout=0.1, reassign=0)
+    scheduler.submit([[batch(str(tmp_path), 'a')]])
+    scheduler.lease('px10-1')
+    failures = scheduler.run()
+
+    assert [failed for failed, _ in failures] == [batch(str(tmp_path), 'a')]
+    assert 'lost 1 workers' in str(failures[0][1])
+
+
+def test_idle_farm_gives_up(farm, tmp_path):
+    scheduler = farm(idle=1)
+    scheduler.submit([[batch(str(tmp_path), 'a')], [batch(str(tmp_path), 'b')]])
+    scheduler.lease('px10-1')
+    failures = scheduler.run()
+
+    assert sorted(failed[0][0] for failed, _ in failures) == [str(tmp_path / 'a.CR2'), str(tmp_path / 'b.CR2')]
+    assert all('no farm worker activity' in str(exc) for _, exc in failures)
+
+
+def test_workers_convert_with_the_lease_encoding(farm, tmp_path):
+    backend = pxconvert.StubBackend()
+    backend.encoding = pxconvert.TiffEncoding('deflate', predictor=True)
+    scheduler = farm(backend)
+    names = ['pose%d' % i for i in range(6)]
+    scheduler.submit([[batch(str(tmp_path), name)] for name in names])
+
+    url = 'http://127.0.0.1:{}'.format(scheduler.server.server_address[1])
+    threading.Thread(target=pxconvert.farm_worker, args=(url, str(tmp_path), 2), daemon=True).start()
+    done = []
+
+    assert scheduler.run(callback=done.append) == []
+    assert len(done) == len(names)
+    for name in names:
+        with open(str(tmp_path / (name + '.tif')), 'rb') as f:
+            _, tags = pxconvert.read_tiff_tags(f, {259, 317})
+        assert tags[259] == (8,) and tags[317] == (2,)
+
+
+@pytest.mark.skipif(pxconvert.rawpy is not None, reason='this machine can convert natively')
+def test_worker_hands_back_what_it_cannot_convert(farm, tmp_path):
+    class Native(pxconvert.StubBackend):
+        name = 'native'
+
+    scheduler = farm(Native(), idle=2)
+    scheduler.submit([[batch(str(tmp_path), 'a')]])
+
+    url = 'http://127.0.0.1:{}'.format(scheduler.server.server_address[1])
+    threading.Thread(target=pxconvert.farm_worker, args=(url, str(tmp_path), 1), daemon=True).start()
+    failures = scheduler.run()
+
+    # Released, not failed by the worker, nobody else picked it up
+    assert [failed for failed, _ in failures] == [batch(str(tmp_path), 'a')]
+    assert 'no farm worker activity' in str(failures[0][1])
+    assert all(stats['failed'] == 0 for stats in scheduler.stats.values())
+    assert not os.path.exists(str(tmp_path / 'a.tif'))
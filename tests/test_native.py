@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import pxconvert
+
+# Linear RGB of the synthetic scene
+SCENE = (0.5, 0.25, 0.125)
+
+
+def mosaic(height=8, width=12, pattern='RGGB', black=512.0, white=16383.0):
+    """Bayer data of a uniformly colored scene"""
+    bayer = np.empty((height, width), dtype=np.uint16)
+    for i, color in enumerate(pattern):
+        bayer[i // 2::2, i % 2::2] = black + SCENE['RGB'.index(color)] * (white - black)
+
+    return bayer
+
+
+def expected(height=8, width=12):
+    srgb = pxconvert.srgb_gamma(np.array(SCENE))
+    return np.tile(np.rint(srgb * 65535).astype(np.uint16), (height, width, 1))
+
+
+@pytest.mark.parametrize('pattern', ['RGGB', 'GRBG', 'BGGR'])
+def test_develop_synthetic_raw(tmp_path, pattern):
+    raw = pxconvert.RawImage(mosaic(pattern=pattern), 512.0, 16383.0, pattern=pattern)
+    rgb = pxconvert.develop(raw)
+
+    developed, reference = str(tmp_path / 'developed.tif'), str(tmp_path / 'reference.tif')
+    pxconvert.write_tiff16(developed, rgb.shape[1], rgb.shape[0], np.ascontiguousarray(rgb),
+                           pxconvert.TiffEncoding('deflate', predictor=True))
+    pxconvert.write_tiff16(reference, 12, 8, expected())
+
+    ok, mean, largest = pxconvert.compare_tiffs(developed, reference, tolerance=8)
+    assert ok, (mean, largest)
+
+
+def test_develop_white_balance_and_orientation():
+    # The camera saw the scene with half the red, the as shot multipliers bring it back
+    bayer = mosaic()
+    bayer[0::2, 0::2] = 512 + (bayer[0::2, 0::2] - 512) // 2
+    raw = pxconvert.RawImage(bayer, 512.0, 16383.0, wb=(2.0, 1.0, 1.0), orientation=6)
+    rgb = pxconvert.develop(raw)
+
+    assert rgb.shape == (12, 8, 3)
+    assert np.abs(rgb.astype(np.int32) - expected(12, 8)).max() <= 16
+
+
+class FakeRaw:
+    """What read_cr2 uses of a rawpy.RawPy"""
+
+    raw_image_visible = mosaic()
+    black_level_per_channel = [512, 512, 512, 512]
+    white_level = 16383
+    camera_whitebalance = [2048.0, 1024.0, 1536.0, 1024.0]
+    raw_pattern = np.array([[0, 1], [3, 2]])
+    rgb_xyz_matrix = np.zeros((4, 3))
+
+    class sizes:
+        flip = 5
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_read_cr2_metadata(monkeypatch):
+    monkeypatch.setattr(pxconvert, 'rawpy', type('rawpy', (), {'imread': staticmethod(lambda filename: FakeRaw())}))
+    raw = pxconvert.read_cr2('king_louis.CR2')
+
+    assert raw.wb == (2.0, 1.0, 1.5)
+    assert raw.pattern == 'RGGB'
+    assert raw.orientation == 8
+    assert raw.black == 512.0 and raw.white == 16383.0
+    assert raw.matrix is None
+
+
+def test_native_backend_needs_rawpy(monkeypatch):
+    monkeypatch.setattr(pxconvert, 'rawpy', None)
+    with pytest.raises(RuntimeError):
+        pxconvert.NativeBackend()
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import pxingest
+
+
+@pytest.fixture
+def shoot(tmp_path, monkeypatch):
+    monkeypatch.setattr(pxingest.GlobalDirs, 'incoming', str(tmp_path / '_incoming') + '/')
+    monkeypatch.setattr(pxingest.GlobalDirs, 'projects', str(tmp_path / 'projects'))
+    path = tmp_path / '_incoming' / '12_10_2019'
+    take = path / '4_carbonel_ray_neutral_tk3'
+    (take / 'extra').mkdir(parents=True)
+    for name, size in (('A000_POLO.CR2', 1000), ('A000_POLO.JPG', 100), (os.path.join('extra', 'notes.txt'), 10)):
+        with open(str(take / name), 'wb') as f:
+            f.write(b'x' * size)
+
+    return str(path)
+
+
+def test_scan_shoot_is_recursive(shoot):
+    files = dict(pxingest.scan_shoot(shoot)['4_carbonel_ray_neutral_tk3'])
+
+    assert files[os.path.join('extra', 'notes.txt')] == 10
+    assert sum(files.values()) == pxingest.take_size(os.path.join(shoot, '4_carbonel_ray_neutral_tk3'))
+
+
+def test_plan_on_one_device_only_renames(shoot):
+    plan = pxingest.plan_ingest('2K_1018_NBA2K21', 'det', shoot)
+    entry = plan['players']['carbonel_ray'][0]
+
+    assert plan['bytes'] == 1110
+    assert plan['copy'] == 0
+    assert not entry['copy']
+    assert entry['conflict'] is None and entry['collision'] is None
+
+
+def test_same_device_of_a_missing_target(tmp_path):
+    source = tmp_path / 'take'
+    source.mkdir()
+
+    assert pxingest.same_device(str(source), str(tmp_path / 'projects' / 'det' / '_acquisition' / 'take'))
+    if os.path.isdir('/dev/shm') and os.stat('/dev/shm').st_dev != os.stat(str(tmp_path)).st_dev:
+        assert not pxingest.same_device(str(source), '/dev/shm/projects/take')
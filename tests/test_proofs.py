@@ -0,0 +1,63 @@
+import glob
+import os
+import re
+import uuid
+
+import pytest
+
+import pxproofs
+
+
+@pytest.fixture
+def player(tmp_path):
+    # The renders write /tmp/<take>.jpg, a unique player keeps parallel runs apart
+    name = 'pxtest_' + uuid.uuid4().hex[:8]
+    poses = []
+    for i in range(5):
+        pose = tmp_path / name / '_acquisition' / '01_12_2020_{}_pose{}_tk1'.format(name, i)
+        pose.mkdir(parents=True)
+        poses.append(str(pose))
+
+    yield str(tmp_path / name), name, poses
+
+    for jpg in glob.glob('/tmp/01_12_2020_{}_*.jpg'.format(name)) + glob.glob('/tmp/{}_*.nk'.format(name)):
+        os.remove(jpg)
+
+
+def jpg(pose):
+    return '/tmp/' + os.path.basename(pose) + '.jpg'
+
+
+def test_nuke_script_reads_every_frame(player):
+    proof_output, _, poses = player
+    script = pxproofs.nuke_script(poses, proof_output, ['Pose %d' % i for i in range(5)])
+
+    reads = [read for read in re.findall(r'Read \{(.*?)\n\}', script, re.S) if 'lindex' in read]
+    assert reads
+    assert all(' first 1\n last 5\n origfirst 1\n origlast 5\n' in read for read in reads)
+
+    single = pxproofs.nuke_script(poses[:1], proof_output, ['Pose 0'])
+    assert 'lindex' not in single and 'origlast' not in single
+
+
+def test_render_pool_renders_every_pose(player):
+    proof_output, name, poses = player
+    pool = pxproofs.RenderPool(licences=2, renderer='stub', backoff=0)
+    rows = pool.render_all(poses, proof_output, ['Pose %d' % i for i in range(5)], name)
+
+    assert [row['px take name'] for row in rows] == [os.path.basename(pose) for pose in poses]
+    assert [row['take name'] for row in rows] == ['Pose %d' % i for i in range(5)]
+    assert pool.failures == []
+    assert all(os.path.isfile(jpg(pose)) for pose in poses)
+
+
+def test_render_pool_kills_hung_renders(player, monkeypatch):
+    proof_output, name, poses = player
+    monkeypatch.setenv('PX_STUB_RENDER_SECONDS', '10')
+    pool = pxproofs.RenderPool(licences=2, timeout=1, retries=1, backoff=0, renderer='stub')
+    rows = pool.render_all(poses[:2], proof_output, ['Pose 0', 'Pose 1'], name)
+
+    assert rows == []
+    assert sorted(failure['pose'] for failure in pool.failures) == poses[:2]
+    assert all(failure['attempts'] == 2 and 'timed out' in failure['reason'] for failure in pool.failures)
+    assert not any(os.path.exists(jpg(pose)) for pose in poses[:2])
@@ -0,0 +1,24 @@
+import os
+
+import pxconvert
+
+
+def test_sidecars_link_by_default_and_clean_up_only_ours(tmp_path):
+    card = tmp_path / 'card.xmp'
+    card.write_text('<x:xmpmeta/>')
+    take = tmp_path / '_acquisition' / '01_12_2020_king_louis_neutral_tk1'
+    take.mkdir(parents=True)
+    raws = [str(take / name) for name in ('A000_POLO.CR2', 'AL010_POLO.CR2')]
+
+    sidecars = pxconvert.XmpSidecars(str(tmp_path / '_acquisition'))
+    assert sidecars.materialize(raws, [str(take)], [str(card)]) == 2
+    assert os.stat(str(take / 'A000_POLO.xmp')).st_ino == os.stat(str(card)).st_ino
+
+    # A hand tuned sidecar replaced ours, it stays
+    os.remove(str(take / 'AL010_POLO.xmp'))
+    (take / 'AL010_POLO.xmp').write_text('<x:xmpmeta tuned="1"/>')
+
+    assert pxconvert.XmpSidecars(str(tmp_path / '_acquisition')).cleanup() == 1
+    assert not os.path.exists(str(take / 'A000_POLO.xmp'))
+    assert os.path.exists(str(take / 'AL010_POLO.xmp'))
+    assert card.exists()
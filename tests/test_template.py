@@ -0,0 +1,46 @@
+import os
+import time
+
+import pxingest
+
+
+def make_template(root):
+    os.makedirs(os.path.join(root, 'Maya', 'scenes'))
+    for name in ('a.txt', os.path.join('Maya', 'b.txt'), os.path.join('Maya', 'scenes', 'c.txt')):
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(name)
+
+
+def test_manifest_sees_changes_below_the_root(tmp_path):
+    template = str(tmp_path / 'template')
+    make_template(template)
+    assert os.path.join('Maya', 'scenes', 'c.txt') in pxingest.template_manifest(template)[1]
+
+    time.sleep(0.01)
+    os.rename(os.path.join(template, 'Maya', 'scenes'), os.path.join(template, 'Maya', 'shots'))
+    dirs, files = pxingest.template_manifest(template)
+    assert os.path.join('Maya', 'shots') in dirs
+    assert os.path.join('Maya', 'shots', 'c.txt') in files
+
+
+def test_reflink_probed_once_per_device(tmp_path, monkeypatch):
+    template = str(tmp_path / 'template')
+    make_template(template)
+    calls = []
+    monkeypatch.setattr(pxingest, 'reflink', lambda src, dst: calls.append(dst) or False)
+    monkeypatch.setattr(pxingest, '_reflink_devices', {})
+
+    for player in ('king_louis', 'birch_khem'):
+        pxingest.materialize_template(str(tmp_path / player), template=template)
+        with open(str(tmp_path / player / 'Maya' / 'scenes' / 'c.txt')) as f:
+            assert f.read() == os.path.join('Maya', 'scenes', 'c.txt')
+
+    assert len(calls) == 1
+
+
+def test_hardlinked_template(tmp_path):
+    template = str(tmp_path / 'template')
+    make_template(template)
+    pxingest.materialize_template(str(tmp_path / 'player'), template=template, link='hardlink')
+
+    assert os.stat(str(tmp_path / 'player' / 'a.txt')).st_ino == os.stat(os.path.join(template, 'a.txt')).st_ino
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import pxconvert
+
+ENCODINGS = [('none', False, 0), ('deflate', False, 0), ('deflate', True, 0), ('deflate', True, 16),
+             ('lzw', True, 0), ('zstd', True, 16)]
+
+
+@pytest.mark.parametrize('compression, predictor, tile', ENCODINGS)
+def test_round_trip(tmp_path, compression, predictor, tile):
+    if compression == 'lzw' and pxconvert.imagecodecs is None:
+        pytest.skip('lzw needs imagecodecs')
+    if compression == 'zstd' and pxconvert.zstandard is None:
+        pytest.skip('zstd needs zstandard')
+
+    image = np.random.default_rng(0).integers(0, 65536, (37, 53, 3), dtype=np.uint16)
+    filename = str(tmp_path / 'frame.tif')
+    pxconvert.write_tiff16(filename, 53, 37, image, pxconvert.TiffEncoding(compression, predictor, tile=tile))
+
+    assert pxconvert.validate_tiff(filename) is None
+    assert np.array_equal(pxconvert.read_tiff16(filename), image)
+
+
+def test_lzw_without_imagecodecs(monkeypatch):
+    monkeypatch.setattr(pxconvert, 'imagecodecs', None)
+    with pytest.raises(ValueError):
+        pxconvert.TiffEncoding('lzw').compress(np.zeros((1, 1, 3), dtype=np.uint16))
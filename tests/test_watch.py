@@ -0,0 +1,31 @@
+import os
+
+import pxingest
+
+
+def test_watcher_claims_targets_before_submitting(tmp_path, monkeypatch):
+    incoming, projects, template = tmp_path / '_incoming', tmp_path / 'projects', tmp_path / 'template'
+    template.mkdir()
+    (template / 'readme.txt').write_text('template')
+    monkeypatch.setattr(pxingest.GlobalDirs, 'incoming', str(incoming) + '/')
+    monkeypatch.setattr(pxingest.GlobalDirs, 'projects', str(projects))
+    monkeypatch.setattr(pxingest.GlobalDirs, 'template', str(template))
+
+    # Both takes end up as 12_10_2019_king_louis_neutral_tk1
+    shoot = incoming / '12_10_2019'
+    for take in ('1_king_louis_neutral_tk1', '2_king_louis_neutral_tk1'):
+        (shoot / take).mkdir(parents=True)
+        (shoot / take / 'A000_POLO.JPG').write_bytes(take.encode())
+
+    watcher = pxingest.IncomingWatcher({'default': ('2K_1018_NBA2K21', 'det')}, settle=0, workers=2, dedup='off')
+    watcher.poll()
+    assert watcher.poll() == 1
+    watcher.pool.close()
+    watcher.pool.join()
+
+    target = projects / '2K_1018_NBA2K21' / 'Sections' / 'det' / 'king_louis' / '_acquisition'
+    assert os.listdir(str(target)) == ['12_10_2019_king_louis_neutral_tk1']
+    assert (target / '12_10_2019_king_louis_neutral_tk1' / 'A000_POLO.JPG').read_bytes() == b'1_king_louis_neutral_tk1'
+    assert sorted(take for take in os.listdir(str(shoot)) if not take.startswith('.')) == ['2_king_louis_neutral_tk1']
+    assert str(shoot / '2_king_louis_neutral_tk1') in watcher.failed
+    assert not watcher.claimed